@@ -0,0 +1,128 @@
+import fnmatch
+import json
+import os
+
+
+# Batch manifests
+#
+# Manifests are read both by the batch runner plugin inside gimp and by
+# batch_pool.py in a normal python, so the code to read them is kept here,
+# without importing gimp, so that the two always agree on what a manifest
+# means. The Speech Bubblifier plugins also use to_str for their scripts.
+
+
+# Exceptions
+class ManifestError(Exception):
+	def __init__(self, message=None):
+		if not message:
+			message = "Batch manifest is invalid."
+		super(ManifestError, self).__init__(message)
+
+
+# Utils
+def to_str(text):
+	"""Convert text read from a json file to a str that the pdb accepts.
+
+	Args:
+		text (str or unicode): the text to convert.
+
+	Returns:
+		str: the text as a str, utf-8 encoded if it was unicode.
+	"""
+	if isinstance(text, str):
+		return text
+	return text.encode("utf-8")
+
+
+# Functions
+def read_manifest(manifest_file, operation_names=None):
+	"""Read a batch manifest, resolving paths relative to the manifest.
+
+	Manifests are json objects with keys:
+		input_dir (str): directory of page files.
+		output_dir (str): directory to save processed pages to.
+		pattern (str): glob pattern of page files, defaults to "*".
+		pages (list(str)): page files to process, relative to the input
+			directory. If given, this is used instead of the pattern. Pages
+			in subdirectories are saved to the same subdirectories of the
+			output directory.
+		output_extension (str): file extension to save pages with, which
+			defaults to ".xcf". Other formats are saved flattened.
+		operations (list(dict)): operations to run on each page, in order.
+			Each has a "name" key naming the operation, and its other keys
+			are options for that operation.
+		report_file (str): file to write json report to, which defaults to
+			batch_report.json in the output directory.
+	All paths in the returned manifest are absolute, so it can be written
+	out again to another directory.
+
+	Args:
+		manifest_file (str): path to manifest file.
+		operation_names (iterable(str) or None): names of the operations
+			that can be run, or None to not check the operation names.
+
+	Returns:
+		dict: the manifest.
+	"""
+	with open(manifest_file, "r") as file_:
+		manifest = json.load(file_)
+	manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+	for key in ("input_dir", "output_dir"):
+		if key not in manifest:
+			raise ManifestError("Batch manifest has no {0}.".format(key))
+		manifest[key] = os.path.join(manifest_dir, to_str(manifest[key]))
+	for operation in manifest.get("operations", []):
+		if (operation_names is not None
+				and operation.get("name") not in operation_names):
+			raise ManifestError(
+				"Unknown batch operation {0}.".format(operation.get("name"))
+			)
+		if "script" in operation:
+			operation["script"] = os.path.join(
+				manifest_dir,
+				to_str(operation["script"]),
+			)
+	if "report_file" in manifest:
+		manifest["report_file"] = os.path.join(
+			manifest_dir,
+			to_str(manifest["report_file"]),
+		)
+	else:
+		manifest["report_file"] = os.path.join(
+			manifest["output_dir"],
+			"batch_report.json",
+		)
+	return manifest
+
+
+def get_page_files(manifest):
+	"""Get the page files of a manifest, relative to its input directory.
+
+	Args:
+		manifest (dict): the batch manifest.
+
+	Returns:
+		list(str): names of page files, in manifest order or sorted if
+			found with the pattern.
+	"""
+	if "pages" in manifest:
+		return [to_str(page_file) for page_file in manifest["pages"]]
+	pattern = to_str(manifest.get("pattern", "*"))
+	return [
+		file_name
+		for file_name in sorted(os.listdir(manifest["input_dir"]))
+		if fnmatch.fnmatch(file_name, pattern)
+	]
+
+
+def get_page_path(page_file, manifest):
+	"""Get absolute path of a page file, which is also its key in reports.
+
+	Args:
+		page_file (str): page file relative to the input directory.
+		manifest (dict): the batch manifest.
+
+	Returns:
+		str: the normalised absolute path of the page file.
+	"""
+	return os.path.normpath(os.path.join(manifest["input_dir"], page_file))
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+from batch_manifest import get_page_files, get_page_path, read_manifest
+
+
+# Functions
+def get_batch_command(gimp_executable, manifest_file):
+	"""Get command to run the batch runner plugin in a headless gimp.
+
+	Args:
+		gimp_executable (str): name or path of gimp executable.
+		manifest_file (str): path to manifest file for the batch runner.
+
+	Returns:
+		list(str): the command.
+	"""
+	scheme_path = manifest_file.replace("\\", "\\\\").replace('"', '\\"')
+	return [
+		gimp_executable,
+		"-i",
+		"-b",
+		'(python-fu-batch-runner RUN-NONINTERACTIVE "{0}")'.format(
+			scheme_path
+		),
+		"-b",
+		"(gimp-quit 0)",
+	]
+
+
+# Classes
+class BatchPool(object):
+	"""Class to shard the pages of a batch across worker gimp processes.
+
+	Pages are split into chunks on a work queue. Each worker thread takes a
+	chunk, writes a manifest for just those pages and runs the batch runner
+	on it in its own gimp process, so pages are processed in parallel. Pages
+	that fail are put back on the queue on their own until they have been
+	retried max_retries times.
+	"""
+	def __init__(
+			self,
+			manifest_file,
+			num_workers=None,
+			gimp_executable="gimp",
+			max_retries=1,
+			chunk_size=None,
+			):
+		self.manifest_file = os.path.abspath(manifest_file)
+		self.manifest = read_manifest(manifest_file)
+		self.num_workers = num_workers or multiprocessing.cpu_count()
+		self.gimp_executable = gimp_executable
+		self.max_retries = max_retries
+		self.page_files = get_page_files(self.manifest)
+		if chunk_size is None:
+			# aim for a few chunks per worker, to spread the load evenly
+			# while sharing the cost of starting gimp between pages
+			chunk_size = max(
+				1,
+				len(self.page_files) // (4 * self.num_workers),
+			)
+		self.chunk_size = chunk_size
+		self._queue = queue.Queue()
+		self._lock = threading.Lock()
+		self._page_reports = {}
+		self._chunk_reports = []
+		self._temp_dir = None
+		self._num_chunks = 0
+
+	def run(self):
+		"""Process all pages of the manifest and write the combined report.
+
+		Returns:
+			dict: the combined report.
+		"""
+		start_time = time.time()
+		if not os.path.isdir(self.manifest["output_dir"]):
+			os.makedirs(self.manifest["output_dir"])
+		self._temp_dir = tempfile.mkdtemp(prefix="batch_pool_")
+		try:
+			for i in range(0, len(self.page_files), self.chunk_size):
+				self._queue.put(
+					[(page_file, 0) for page_file in
+					self.page_files[i:i + self.chunk_size]]
+				)
+			workers = [
+				threading.Thread(target=self._run_worker)
+				for _ in range(self.num_workers)
+			]
+			for worker in workers:
+				worker.daemon = True
+				worker.start()
+			# retried pages are queued before their chunk is marked done,
+			# so this only returns once every page has a final result
+			self._queue.join()
+			for _ in workers:
+				self._queue.put(None)
+			for worker in workers:
+				worker.join()
+		finally:
+			shutil.rmtree(self._temp_dir, ignore_errors=True)
+		report = {
+			"manifest": self.manifest_file,
+			"workers": self.num_workers,
+			"seconds": time.time() - start_time,
+			"pages": [
+				self._page_reports[page_file]
+				for page_file in self.page_files
+			],
+			"chunks": self._chunk_reports,
+		}
+		with open(self.manifest["report_file"], "w") as file_:
+			json.dump(report, file_, indent=2)
+		return report
+
+	def _run_worker(self):
+		"""Process chunks from the work queue until given None."""
+		while True:
+			chunk = self._queue.get()
+			try:
+				if chunk is None:
+					return
+				start_time = time.time()
+				try:
+					self._run_chunk(chunk)
+				except Exception as e:
+					# eg. the chunk manifest couldn't be written, so record
+					# the chunk's pages as failed rather than losing them
+					self._record_chunk(
+						chunk,
+						{},
+						time.time() - start_time,
+						None,
+						"Chunk failed: {0}".format(e),
+					)
+			finally:
+				self._queue.task_done()
+
+	def _run_chunk(self, chunk):
+		"""Process a chunk of pages in a gimp process and collect results.
+
+		Args:
+			chunk (list(tuple(str, int))): page files in chunk and the number
+				of times each has already been retried.
+		"""
+		with self._lock:
+			chunk_index = self._num_chunks
+			self._num_chunks += 1
+		chunk_prefix = os.path.join(
+			self._temp_dir,
+			"chunk_{0}".format(chunk_index),
+		)
+		chunk_manifest = dict(self.manifest)
+		chunk_manifest["pages"] = [page_file for page_file, _ in chunk]
+		chunk_manifest["report_file"] = chunk_prefix + "_report.json"
+		with open(chunk_prefix + ".json", "w") as file_:
+			json.dump(chunk_manifest, file_)
+
+		start_time = time.time()
+		with open(chunk_prefix + ".log", "w") as log_file:
+			try:
+				return_code = subprocess.call(
+					get_batch_command(
+						self.gimp_executable,
+						chunk_prefix + ".json",
+					),
+					stdout=log_file,
+					stderr=subprocess.STDOUT,
+				)
+			except OSError as e:
+				return_code = str(e)
+		try:
+			with open(chunk_manifest["report_file"], "r") as file_:
+				reports = dict(
+					(os.path.normpath(page_report["page"]), page_report)
+					for page_report in json.load(file_)["pages"]
+				)
+		except (IOError, OSError, ValueError, KeyError):
+			# gimp failed before writing a report, so all pages failed
+			reports = {}
+		self._record_chunk(
+			chunk,
+			reports,
+			time.time() - start_time,
+			return_code,
+			"Gimp exited with {0} before finishing.".format(return_code),
+		)
+
+	def _record_chunk(self, chunk, reports, seconds, return_code, error):
+		"""Record the results of a chunk, and queue failed pages to retry.
+
+		Args:
+			chunk (list(tuple(str, int))): page files in chunk and the number
+				of times each has already been retried.
+			reports (dict(str, dict)): reports of the chunk's pages, keyed
+				by their absolute paths.
+			seconds (float): time taken by the chunk.
+			return_code (int or str or None): exit code of the gimp process,
+				or the error starting it, or None if it wasn't run.
+			error (str): error to report for pages with no report.
+		"""
+		with self._lock:
+			self._chunk_reports.append({
+				"pages": [page_file for page_file, _ in chunk],
+				"seconds": seconds,
+				"return_code": return_code,
+			})
+			for page_file, num_retries in chunk:
+				page_path = get_page_path(page_file, self.manifest)
+				page_report = reports.get(page_path, {
+					"page": page_path,
+					"ok": False,
+					"error": error,
+				})
+				page_report["retries"] = num_retries
+				if not page_report["ok"] and num_retries < self.max_retries:
+					self._queue.put([(page_file, num_retries + 1)])
+				else:
+					self._page_reports[page_file] = page_report
+
+
+# Main function
+def main():
+	parser = argparse.ArgumentParser(
+		description=(
+			"Run the batch runner plugin over the pages of a manifest in "
+			"parallel gimp processes."
+		),
+	)
+	parser.add_argument("manifest_file", help="path to batch manifest")
+	parser.add_argument(
+		"-w", "--workers",
+		type=int,
+		default=None,
+		help="number of gimp processes (defaults to number of cpus)",
+	)
+	parser.add_argument(
+		"-g", "--gimp",
+		default="gimp",
+		help="gimp executable (defaults to gimp)",
+	)
+	parser.add_argument(
+		"-r", "--retries",
+		type=int,
+		default=1,
+		help="number of times to retry failed pages (defaults to 1)",
+	)
+	parser.add_argument(
+		"-c", "--chunk-size",
+		type=int,
+		default=None,
+		help="pages per gimp process (defaults to a few chunks per worker)",
+	)
+	args = parser.parse_args()
+	report = BatchPool(
+		args.manifest_file,
+		args.workers,
+		args.gimp,
+		args.retries,
+		args.chunk_size,
+	).run()
+	num_failed = len([page for page in report["pages"] if not page["ok"]])
+	print("Processed {0} pages with {1} workers in {2:.2f}s, {3} failed.".format(
+		len(report["pages"]),
+		report["workers"],
+		report["seconds"],
+		num_failed,
+	))
+	return 1 if num_failed else 0
+
+
+if __name__ == "__main__":
+	raise SystemExit(main())
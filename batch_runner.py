@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+import json
+import os
+import time
+
+from gimpfu import *
+import gimpcolor
+import gimpenums
+
+from batch_manifest import (
+	get_page_files,
+	get_page_path,
+	read_manifest,
+	to_str,
+)
+
+
+# Utils
+def to_color(color):
+	"""Convert a manifest color to a gimp color.
+
+	Args:
+		color (str or list(int)): hex string such as "#1a237e", or list of
+			red, green and blue values from 0 to 255.
+
+	Returns:
+		gimpcolor.RGB: the color.
+	"""
+	if isinstance(color, list):
+		return gimpcolor.RGB(*color)
+	color = color.lstrip("#")
+	return gimpcolor.RGB(*[int(color[i:i + 2], 16) for i in (0, 2, 4)])
+
+
+# Operations
+# indices of the isolate outlines engine option, by manifest name
+ISOLATE_OUTLINES_ENGINES = {
+	"selection": 0,
+	"numpy": 1,
+	"numpy_strips": 2,
+	"numpy_threaded": 3,
+}
+
+# indices of the speech bubblifier scan mode option, by manifest name
+SPEECH_BUBBLIFIER_SCAN_MODES = {
+	"full": 0,
+	"analytic": 1,
+	"pyramid": 2,
+}
+
+
+def run_isolate_outlines(timg, tdrawable, page_name, options):
+	"""Run Isolate Outlines on a page.
+
+	The engine option is "selection", "numpy", "numpy_strips" or
+	"numpy_threaded", see isolate_outlines. The preview_thresholds option
+	is a list of thresholds to add hidden layers for.
+
+	Args:
+		timg (gimp.Image): image of page.
+		tdrawable (gimp.Drawable): drawable to isolate outlines of.
+		page_name (str): path of page file relative to the input directory,
+			without extension, see get_page_name.
+		options (dict): operation options from the manifest.
+
+	Returns:
+		None: this operation has no report.
+	"""
+	pdb.python_fu_isolate_outlines(
+		timg,
+		tdrawable,
+		options.get("threshold", 0.7),
+		ISOLATE_OUTLINES_ENGINES[options.get("engine", "selection")],
+		options.get("strip_height", 0),
+		options.get("threads", 0),
+		options.get("soft_edges", False),
+		" ".join(str(value) for value in options.get("preview_thresholds", [])),
+	)
+
+
+def run_isolate_inks(timg, tdrawable, page_name, options):
+	"""Run Isolate Inks on a page.
+
+	The inks option is a list of "color:threshold" strings, such as
+	"#1a237e:0.3". The engine option is as for run_isolate_outlines, but
+	defaults to "numpy".
+
+	Args:
+		timg (gimp.Image): image of page.
+		tdrawable (gimp.Drawable): drawable to isolate inks of.
+		page_name (str): path of page file relative to the input directory,
+			without extension, see get_page_name.
+		options (dict): operation options from the manifest.
+
+	Returns:
+		None: this operation has no report.
+	"""
+	pdb.python_fu_isolate_inks(
+		timg,
+		tdrawable,
+		" ".join(to_str(ink) for ink in options["inks"]),
+		ISOLATE_OUTLINES_ENGINES[options.get("engine", "numpy")],
+		options.get("strip_height", 0),
+		options.get("threads", 0),
+		options.get("soft_edges", False),
+	)
+
+
+def run_speech_bubblifier_batch(timg, tdrawable, page_name, options):
+	"""Run Speech Bubblifier Batch on a page.
+
+	The script option can contain "{page}", which is replaced by the page
+	name, so that each page can have its own script file.
+
+	Args:
+		timg (gimp.Image): image of page.
+		tdrawable (gimp.Drawable): active drawable of page.
+		page_name (str): path of page file relative to the input directory,
+			without extension, see get_page_name.
+		options (dict): operation options from the manifest.
+
+	Returns:
+		list(dict): report of which speech bubbles were filled.
+	"""
+	report = pdb.python_fu_speech_bubblifier_batch(
+		timg,
+		tdrawable,
+		to_str(options["script"]).replace("{page}", page_name),
+		to_str(options.get("font", "Comic Sans MS")),
+		options.get("text_size", 60),
+		to_color(options.get("color", "#000000")),
+		options.get("space_width", 15),
+		options.get("horizontal_offset", 10),
+		options.get("vertical_offset", 10),
+		options.get("auto_size", False),
+		options.get("balanced_lines", False),
+		options.get("detect_bubbles", False),
+		SPEECH_BUBBLIFIER_SCAN_MODES[options.get("scan_mode", "full")],
+	)
+	return json.loads(report)
+
+
+OPERATIONS = {
+	"isolate_outlines": run_isolate_outlines,
+	"isolate_inks": run_isolate_inks,
+	"speech_bubblifier_batch": run_speech_bubblifier_batch,
+}
+
+
+# Functions
+def save_page(timg, tdrawable, output_file):
+	"""Save processed page, flattening a copy of it if not saving as xcf.
+
+	Args:
+		timg (gimp.Image): image of page.
+		tdrawable (gimp.Drawable): active drawable of page.
+		output_file (str): path to save to.
+	"""
+	if output_file.lower().endswith(".xcf"):
+		pdb.gimp_xcf_save(0, timg, tdrawable, output_file, output_file)
+		return
+	flattened_image = pdb.gimp_image_duplicate(timg)
+	try:
+		flattened_layer = pdb.gimp_image_merge_visible_layers(
+			flattened_image,
+			gimpenums.CLIP_TO_IMAGE,
+		)
+		pdb.gimp_file_save(
+			flattened_image,
+			flattened_layer,
+			output_file,
+			output_file,
+		)
+	finally:
+		pdb.gimp_image_delete(flattened_image)
+
+
+def get_page_name(page_file, manifest):
+	"""Get name of a page, from its path relative to the input directory.
+
+	Keeping the page's subdirectory in its name stops pages with the same
+	file name in different subdirectories from overwriting each other.
+
+	Args:
+		page_file (str): path to page file.
+		manifest (dict): the batch manifest.
+
+	Returns:
+		str: the page's path relative to the input directory, without its
+			extension, or just its file name without extension if it's
+			outside the input directory.
+	"""
+	page_path = os.path.relpath(page_file, manifest["input_dir"])
+	if page_path.startswith(os.pardir):
+		page_path = os.path.basename(page_file)
+	return os.path.splitext(page_path)[0]
+
+
+def process_page(page_file, manifest):
+	"""Open a page, run the manifest's operations on it and save it.
+
+	Args:
+		page_file (str): path to page file.
+		manifest (dict): the batch manifest.
+
+	Returns:
+		dict: report for the page, with the time taken by each operation.
+	"""
+	start_time = time.time()
+	page_name = get_page_name(page_file, manifest)
+	output_file = os.path.join(
+		manifest["output_dir"],
+		page_name + manifest.get("output_extension", ".xcf"),
+	)
+	if not os.path.isdir(os.path.dirname(output_file)):
+		os.makedirs(os.path.dirname(output_file))
+	page_report = {
+		"page": page_file,
+		"output": output_file,
+		"ok": False,
+		"timings": [],
+	}
+	try:
+		timg = pdb.gimp_file_load(page_file, page_file)
+	except RuntimeError as e:
+		page_report["error"] = str(e)
+		page_report["seconds"] = time.time() - start_time
+		return page_report
+	try:
+		for operation in manifest.get("operations", []):
+			operation_start_time = time.time()
+			operation_report = OPERATIONS[operation["name"]](
+				timg,
+				pdb.gimp_image_get_active_drawable(timg),
+				page_name,
+				operation,
+			)
+			timing = {
+				"operation": operation["name"],
+				"seconds": time.time() - operation_start_time,
+			}
+			if operation_report is not None:
+				timing["report"] = operation_report
+			page_report["timings"].append(timing)
+		save_start_time = time.time()
+		save_page(timg, pdb.gimp_image_get_active_drawable(timg), output_file)
+		page_report["timings"].append({
+			"operation": "save",
+			"seconds": time.time() - save_start_time,
+		})
+		page_report["ok"] = True
+	except (RuntimeError, IOError, KeyError, ValueError) as e:
+		# pdb errors are raised as RuntimeError, and a failed page shouldn't
+		# stop the rest of the batch
+		page_report["error"] = str(e)
+	finally:
+		pdb.gimp_image_delete(timg)
+	page_report["seconds"] = time.time() - start_time
+	return page_report
+
+
+# Main function
+def batch_runner(manifest_file):
+	manifest = read_manifest(manifest_file, OPERATIONS)
+	if not os.path.isdir(manifest["output_dir"]):
+		os.makedirs(manifest["output_dir"])
+	start_time = time.time()
+	page_reports = []
+	for page_file in get_page_files(manifest):
+		page_file = get_page_path(page_file, manifest)
+		page_report = process_page(page_file, manifest)
+		page_reports.append(page_report)
+		gimp.message("{0}: {1} in {2:.2f}s{3}".format(
+			os.path.basename(page_file),
+			"ok" if page_report["ok"] else "failed",
+			page_report["seconds"],
+			"" if page_report["ok"] else " ({0})".format(page_report["error"]),
+		))
+	report = {
+		"manifest": os.path.abspath(manifest_file),
+		"seconds": time.time() - start_time,
+		"pages": page_reports,
+	}
+	with open(manifest["report_file"], "w") as file_:
+		json.dump(report, file_, indent=2)
+	gimp.message("Processed {0} pages in {1:.2f}s, {2} failed.".format(
+		len(page_reports),
+		report["seconds"],
+		len([page for page in page_reports if not page["ok"]]),
+	))
+
+
+# Register function
+register(
+	"python_fu_batch_runner",
+	"Run plugins over a directory of pages from a manifest",
+	(
+		"Open every page matching a json manifest, run the manifest's "
+		"operations on it, save it and write a json report with per-page "
+		"timings. Run headless with: gimp -i -b '(python-fu-batch-runner "
+		"RUN-NONINTERACTIVE \"manifest.json\")' -b '(gimp-quit 0)'"
+	),
+	"Ben Carey",
+	"Ben Carey",
+	"2021",
+	"Batch Runner...",
+	"",
+	[
+		(PF_FILE, "pf_manifest_file", "Manifest File", ""),
+	],
+	[],
+	batch_runner,
+	menu="<Image>/Tools/Custom",
+)
+
+main()
@@ -0,0 +1,587 @@
+#!/usr/bin/env python
+
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+sys.path.insert(
+	0,
+	os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+)
+
+from bubble_layout import (
+	SCAN_MODES,
+	SelectionSizeError,
+	SpeechBubble,
+	measure_words,
+)
+from layout_backends import ApproximateTextExtents, MaskSelection
+
+
+# Benchmarks
+#
+# Times the three phases of laying out text in a speech bubble separately,
+# over synthetic bubble shapes of different sizes and texts of different
+# lengths, using the stand-in backends so gimp isn't needed:
+#	row_bounds: reading the selection and finding the bounds of each pixel
+#		row (SpeechBubble._compute_pixel_row_bounds).
+#	block_rows: finding the block row bounds and block rows for the row
+#		height (SpeechBubble.set_row_height).
+#	placement: placing the words in the block rows (SpeechBubble.place_words).
+# Results are saved as json, and can be compared against an earlier run to
+# catch regressions.
+
+
+if hasattr(time, "perf_counter"):
+	timer = time.perf_counter
+else:
+	timer = time.time
+
+FONT = "Sans"
+PHASES = ("row_bounds", "block_rows", "placement")
+DEFAULT_SIZES = (256, 512, 1024, 2048, 4096, 8192)
+DEFAULT_WORD_COUNTS = (1, 10, 50, 200, 500)
+VOCABULARY = (
+	"a I to of it is be we no go on the and you was for are but not all "
+	"can her one our out day get has him his how man new now old see two "
+	"way who boy did its let put say she too use what there would about "
+	"think never shout really again where which people little always "
+	"nothing tomorrow somebody everything impossible"
+).split()
+
+
+# Shapes
+def ellipse_spans(width, height):
+	"""Get the selected spans of each row of an ellipse filling the bounds.
+
+	Args:
+		width (int): width of shape.
+		height (int): height of shape.
+
+	Returns:
+		list(list(tuple(int, int))): start and exclusive end of the spans of
+			each row.
+	"""
+	radius_x = 0.5 * width
+	radius_y = 0.5 * height
+	row_spans = []
+	for y in range(height):
+		distance = (y + 0.5 - radius_y) / radius_y
+		if abs(distance) >= 1:
+			row_spans.append([])
+			continue
+		half_width = radius_x * math.sqrt(1 - distance * distance)
+		row_spans.append([(
+			int(round(radius_x - half_width)),
+			int(round(radius_x + half_width)),
+		)])
+	return row_spans
+
+
+def rounded_rect_spans(width, height):
+	"""Get the selected spans of each row of a rounded rectangle.
+
+	Args:
+		width (int): width of shape.
+		height (int): height of shape.
+
+	Returns:
+		list(list(tuple(int, int))): start and exclusive end of the spans of
+			each row.
+	"""
+	radius = 0.25 * min(width, height)
+	row_spans = []
+	for y in range(height):
+		distance = max(radius - (y + 0.5), (y + 0.5) - (height - radius), 0)
+		inset = radius - math.sqrt(max(radius * radius - distance * distance, 0))
+		row_spans.append([(int(round(inset)), int(round(width - inset)))])
+	return row_spans
+
+
+def polygon_spans(points, width, height):
+	"""Get the selected spans of each row of a polygon, by the even-odd rule.
+
+	Args:
+		points (list(tuple(float, float))): vertices of polygon.
+		width (int): width of shape.
+		height (int): height of shape.
+
+	Returns:
+		list(list(tuple(int, int))): start and exclusive end of the spans of
+			each row.
+	"""
+	edges = list(zip(points, points[1:] + points[:1]))
+	row_spans = []
+	for y in range(height):
+		y_centre = y + 0.5
+		crossings = sorted(
+			x_1 + (y_centre - y_1) * (x_2 - x_1) / (y_2 - y_1)
+			for (x_1, y_1), (x_2, y_2) in edges
+			if (y_1 <= y_centre) != (y_2 <= y_centre)
+		)
+		row_spans.append([
+			(
+				max(int(round(start)), 0),
+				min(int(round(end)), width),
+			)
+			for start, end in zip(crossings[::2], crossings[1::2])
+		])
+	return row_spans
+
+
+def shout_spans(width, height, num_spikes=14, spike_depth=0.3, seed=0):
+	"""Get the selected spans of each row of a jagged "shout" bubble.
+
+	This is an ellipse with spikes, whose inner points are jittered so
+	that rows can have several spans.
+
+	Args:
+		width (int): width of shape.
+		height (int): height of shape.
+		num_spikes (int): number of spikes.
+		spike_depth (float): depth of spikes, as a fraction of the radius.
+		seed (int): seed for the jitter of the spikes.
+
+	Returns:
+		list(list(tuple(int, int))): start and exclusive end of the spans of
+			each row.
+	"""
+	rng = random.Random(seed)
+	radius_x = 0.5 * width
+	radius_y = 0.5 * height
+	points = []
+	for i in range(2 * num_spikes):
+		angle = math.pi * i / num_spikes
+		if i % 2:
+			scale = 1 - spike_depth * rng.uniform(0.6, 1)
+			angle += rng.uniform(-0.3, 0.3) * math.pi / num_spikes
+		else:
+			scale = 1
+		points.append((
+			radius_x + scale * radius_x * math.cos(angle),
+			radius_y + scale * radius_y * math.sin(angle),
+		))
+	return polygon_spans(points, width, height)
+
+
+def caption_spans(width, height):
+	"""Get the selected spans of each row of a caption box.
+
+	Args:
+		width (int): width of shape.
+		height (int): height of shape.
+
+	Returns:
+		list(list(tuple(int, int))): start and exclusive end of the spans of
+			each row.
+	"""
+	return [[(0, width)] for _ in range(height)]
+
+
+# functions to get spans of each shape, and the shape's height as a fraction
+# of its width
+SHAPES = {
+	"ellipse": (ellipse_spans, 0.75),
+	"rounded_rect": (rounded_rect_spans, 0.6),
+	"shout": (shout_spans, 0.8),
+	"caption": (caption_spans, 0.125),
+}
+
+
+def make_selection(shape, size):
+	"""Make a stand-in selection of a synthetic speech bubble.
+
+	Args:
+		shape (str): name of shape from SHAPES.
+		size (int): width of shape, in pixels.
+
+	Returns:
+		MaskSelection: the selection.
+	"""
+	get_spans, aspect_ratio = SHAPES[shape]
+	width = size
+	height = max(int(size * aspect_ratio), 1)
+	empty_row = b"\x00" * width
+	rows = []
+	for spans in get_spans(width, height):
+		row = empty_row
+		for start, end in spans:
+			if start < end:
+				row = row[:start] + b"\xff" * (end - start) + row[end:]
+		rows.append(row)
+	return MaskSelection(b"".join(rows), width, height)
+
+
+def make_text(num_words, seed=0):
+	"""Make text of the given number of words.
+
+	Args:
+		num_words (int): number of words.
+		seed (int): seed for picking words.
+
+	Returns:
+		list(str): the words.
+	"""
+	rng = random.Random(seed)
+	return [rng.choice(VOCABULARY) for _ in range(num_words)]
+
+
+def get_text_size(selection, words, extents):
+	"""Get a text size at which the words cover about half of the bubble.
+
+	Args:
+		selection (MaskSelection): selection of the bubble.
+		words (list(str)): words to lay out.
+		extents (ApproximateTextExtents): object to measure words with.
+
+	Returns:
+		int: the text size.
+	"""
+	area = selection.mask.count(b"\xff")
+	# word sizes scale with text size, so measure them at size 100
+	word_area = 0
+	for word in words:
+		width, height = extents.get_extents(FONT, 100, word)
+		word_area += (width + 25) * height
+	text_size = int(100 * math.sqrt(0.5 * area / word_area))
+	return max(6, min(text_size, selection.height // 4))
+
+
+# Measuring
+def measure_phase(function, repeat):
+	"""Time a phase and measure its peak memory.
+
+	Peak memory is measured with tracemalloc, on a separate run so that
+	tracing doesn't slow down the timed runs. Without tracemalloc, it falls
+	back to the growth in the process's maximum resident set size, which only
+	shows phases that use more memory than any earlier phase.
+
+	Args:
+		function (callable): function running the phase, which is given no
+			arguments and is called repeat + 1 times.
+		repeat (int): number of timed runs.
+
+	Returns:
+		dict: the fastest and median time in seconds, and the peak memory in
+			bytes with the method used to measure it.
+	"""
+	times = []
+	for _ in range(repeat):
+		gc.collect()
+		start_time = timer()
+		function()
+		times.append(timer() - start_time)
+	times.sort()
+	result = {
+		"seconds": times[0],
+		"median_seconds": times[len(times) // 2],
+	}
+	gc.collect()
+	if tracemalloc is not None:
+		tracemalloc.start()
+		try:
+			function()
+			_, peak = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+		result["peak_memory"] = peak
+		result["memory_method"] = "tracemalloc"
+	elif resource is not None:
+		max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		function()
+		# ru_maxrss is in kilobytes, except on mac where it's in bytes
+		scale = 1 if sys.platform == "darwin" else 1024
+		result["peak_memory"] = scale * (
+			resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss
+		)
+		result["memory_method"] = "max_rss"
+	else:
+		function()
+	return result
+
+
+def run_case(shape, size, num_words, repeat, balanced, scan_mode=0):
+	"""Benchmark laying out one text in one speech bubble.
+
+	Args:
+		shape (str): name of shape from SHAPES.
+		size (int): width of shape, in pixels.
+		num_words (int): number of words of text.
+		repeat (int): number of timed runs of each phase.
+		balanced (bool): if True, balance the lengths of the rows.
+		scan_mode (int): index of the way to find the selected spans of the
+			bubble, from SCAN_MODES.
+
+	Returns:
+		dict: results of each phase.
+	"""
+	selection = make_selection(shape, size)
+	words = make_text(num_words, seed=size + num_words)
+	extents = ApproximateTextExtents()
+	text_size = get_text_size(selection, words, extents)
+	word_layers = measure_words(words, FONT, text_size, extents)
+	row_height = max(word_layer.height for word_layer in word_layers)
+	space_width = max(text_size // 4, 1)
+	offset = max(size // 64, 2)
+	speech_bubble = SpeechBubble(
+		selection,
+		0,
+		0,
+		selection.width,
+		selection.height,
+		row_height,
+		space_width,
+		offset,
+		offset,
+		scan_mode,
+	)
+	case = {
+		"shape": shape,
+		"size": size,
+		"width": selection.width,
+		"height": selection.height,
+		"num_words": num_words,
+		"text_size": text_size,
+		"balanced": balanced,
+		"scan_mode": SCAN_MODES[scan_mode].lower(),
+		"phases": {},
+	}
+	case["phases"]["row_bounds"] = measure_phase(
+		speech_bubble._compute_pixel_row_bounds,
+		repeat,
+	)
+	case["phases"]["block_rows"] = measure_phase(
+		lambda: speech_bubble.set_row_height(row_height),
+		repeat,
+	)
+
+	def place_words():
+		try:
+			speech_bubble.place_words(
+				measure_words(words, FONT, text_size, extents),
+				balanced,
+			)
+		except SelectionSizeError:
+			return False
+		return True
+
+	case["fits"] = place_words()
+	case["phases"]["placement"] = measure_phase(place_words, repeat)
+	return case
+
+
+def compare_results(results, baseline, tolerance):
+	"""Find cases whose phases are slower or use more memory than a baseline.
+
+	Cases are only compared with baseline cases of the same shape, size,
+	number of words, scan mode and balancing. Memory is only compared if
+	both runs measured it the same way.
+
+	Args:
+		results (dict): results of this run.
+		baseline (dict): results of an earlier run.
+		tolerance (float): fraction that a phase can be slower by, or use
+			more memory by, before it counts as a regression.
+
+	Returns:
+		list(str): descriptions of the regressions.
+	"""
+	def get_key(case, run):
+		# older results only recorded the scan mode and balancing per run
+		return (
+			case["shape"],
+			case["size"],
+			case["num_words"],
+			case.get("scan_mode", run.get("scan_mode", "full")),
+			case.get("balanced", run.get("balanced", False)),
+		)
+
+	baseline_cases = dict(
+		(get_key(case, baseline), case) for case in baseline["cases"]
+	)
+	regressions = []
+	for case in results["cases"]:
+		key = get_key(case, results)
+		baseline_case = baseline_cases.get(key)
+		if baseline_case is None:
+			continue
+		description = "{0} {1}px {2} words ({3}{4})".format(
+			case["shape"],
+			case["size"],
+			case["num_words"],
+			key[3],
+			", balanced" if key[4] else "",
+		)
+		for phase in PHASES:
+			phase_result = case["phases"][phase]
+			baseline_phase_result = baseline_case["phases"][phase]
+			seconds = phase_result["seconds"]
+			baseline_seconds = baseline_phase_result["seconds"]
+			if seconds > (1 + tolerance) * baseline_seconds:
+				regressions.append(
+					"{0} {1}: {2:.6f}s vs {3:.6f}s".format(
+						description,
+						phase,
+						seconds,
+						baseline_seconds,
+					)
+				)
+			if ("peak_memory" not in phase_result
+					or "peak_memory" not in baseline_phase_result
+					or phase_result.get("memory_method")
+					!= baseline_phase_result.get("memory_method")):
+				continue
+			memory = phase_result["peak_memory"]
+			baseline_memory = baseline_phase_result["peak_memory"]
+			if memory > (1 + tolerance) * baseline_memory:
+				regressions.append(
+					"{0} {1}: {2} bytes vs {3} bytes".format(
+						description,
+						phase,
+						memory,
+						baseline_memory,
+					)
+				)
+	return regressions
+
+
+# Main function
+def main():
+	parser = argparse.ArgumentParser(
+		description=(
+			"Benchmark the phases of speech bubble layout over synthetic "
+			"bubble shapes and texts."
+		),
+	)
+	parser.add_argument(
+		"-o", "--output",
+		default="bench_layout.json",
+		help="json file to save results to (defaults to bench_layout.json)",
+	)
+	parser.add_argument(
+		"-s", "--shapes",
+		nargs="+",
+		choices=sorted(SHAPES),
+		default=sorted(SHAPES),
+		help="shapes to benchmark (defaults to all)",
+	)
+	parser.add_argument(
+		"-z", "--sizes",
+		nargs="+",
+		type=int,
+		default=DEFAULT_SIZES,
+		help="bubble widths in pixels (defaults to 256 to 8192)",
+	)
+	parser.add_argument(
+		"-n", "--word-counts",
+		nargs="+",
+		type=int,
+		default=DEFAULT_WORD_COUNTS,
+		help="numbers of words of text (defaults to 1 to 500)",
+	)
+	parser.add_argument(
+		"-r", "--repeat",
+		type=int,
+		default=5,
+		help="timed runs of each phase, the fastest is kept (defaults to 5)",
+	)
+	parser.add_argument(
+		"-b", "--balanced",
+		action="store_true",
+		help="balance the lengths of rows when placing words",
+	)
+	parser.add_argument(
+		"-m", "--scan-mode",
+		choices=[scan_mode.lower() for scan_mode in SCAN_MODES],
+		default="full",
+		help="way to find the selected spans of bubbles (defaults to full)",
+	)
+	parser.add_argument(
+		"-c", "--compare",
+		default=None,
+		help="json results of an earlier run to check for regressions against",
+	)
+	parser.add_argument(
+		"-t", "--tolerance",
+		type=float,
+		default=0.25,
+		help=(
+			"fraction a phase can be slower by, or use more memory by, in "
+			"comparisons (defaults to 0.25)"
+		),
+	)
+	args = parser.parse_args()
+	scan_mode = [mode.lower() for mode in SCAN_MODES].index(args.scan_mode)
+
+	results = {
+		"python": platform.python_version(),
+		"numpy": numpy.__version__ if numpy is not None else None,
+		"platform": platform.platform(),
+		"repeat": args.repeat,
+		"balanced": args.balanced,
+		"scan_mode": args.scan_mode,
+		"cases": [],
+	}
+	for shape in args.shapes:
+		for size in args.sizes:
+			for num_words in args.word_counts:
+				case = run_case(
+					shape,
+					size,
+					num_words,
+					args.repeat,
+					args.balanced,
+					scan_mode,
+				)
+				results["cases"].append(case)
+				print("{0} {1}px {2} words: {3}".format(
+					shape,
+					size,
+					num_words,
+					", ".join(
+						"{0} {1:.6f}s".format(
+							phase,
+							case["phases"][phase]["seconds"],
+						)
+						for phase in PHASES
+					),
+				))
+	with open(args.output, "w") as file_:
+		json.dump(results, file_, indent=2)
+
+	if args.compare:
+		with open(args.compare, "r") as file_:
+			regressions = compare_results(
+				results,
+				json.load(file_),
+				args.tolerance,
+			)
+		for regression in regressions:
+			print("Regression: {0}".format(regression))
+		return 1 if regressions else 0
+	return 0
+
+
+if __name__ == "__main__":
+	raise SystemExit(main())
@@ -0,0 +1,212 @@
+import numpy
+
+from bubble_layout import find_row_runs
+from layout_backends import MaskSelection
+
+
+# Classes
+class DetectedBubble(object):
+	"""Struct to encapsulate data for a speech bubble found on a page."""
+	def __init__(self, mask, x_min, y_min):
+		self.mask = mask
+		self.x_min = x_min
+		self.y_min = y_min
+		self.x_max = x_min + mask.shape[1]
+		self.y_max = y_min + mask.shape[0]
+		self.area = int(mask.sum())
+
+	@property
+	def selection(self):
+		"""Get a stand-in selection channel for the bubble.
+
+		Returns:
+			MaskSelection: selection that can be passed to SpeechBubble.
+		"""
+		return MaskSelection.from_array(self.mask, self.x_min, self.y_min)
+
+
+# Functions
+def get_light_mask(pixels, light_threshold):
+	"""Find the light pixels of a page.
+
+	Args:
+		pixels (numpy.ndarray): height x width x channels array of the page
+			as uint8, with channels being gray, gray and alpha, rgb or rgba.
+		light_threshold (float): pixels whose darkest color channel is at
+			least this fraction of white count as light.
+
+	Returns:
+		numpy.ndarray: height x width boolean array of the light pixels.
+	"""
+	pixels = numpy.asarray(pixels)
+	if pixels.ndim == 2:
+		pixels = pixels[:, :, numpy.newaxis]
+	num_channels = pixels.shape[2]
+	colors = pixels[:, :, :3] if num_channels >= 3 else pixels[:, :, :1]
+	darkest = colors.min(axis=2).astype(numpy.uint16)
+	if num_channels in (2, 4):
+		# composite transparent pixels over white
+		alpha = pixels[:, :, -1].astype(numpy.uint16)
+		darkest = (darkest * alpha + 255 * (255 - alpha)) // 255
+	return darkest >= light_threshold * 255
+
+
+def label_runs(rows, starts, ends, width):
+	"""Label runs by the 4-connected component that they belong to.
+
+	Pairs of runs in adjacent rows that overlap are found with binary
+	searches over all runs at once. Components are then found by repeatedly
+	hooking the larger of each pair's labels onto the smaller and flattening
+	the resulting trees, so every step is a whole-array operation.
+
+	Args:
+		rows (numpy.ndarray): the row of each run.
+		starts (numpy.ndarray): the start of each run.
+		ends (numpy.ndarray): the exclusive end of each run.
+		width (int): width of the mask that the runs came from.
+
+	Returns:
+		numpy.ndarray: label of each run, which is the index of the first run
+			in its component.
+	"""
+	num_runs = len(rows)
+	# runs are sorted by row and then start, and don't overlap within a row,
+	# so keys combining row with start or end are sorted too
+	start_keys = rows * (width + 1) + starts
+	end_keys = rows * (width + 1) + ends
+	first_overlaps = numpy.searchsorted(
+		end_keys,
+		(rows - 1) * (width + 1) + starts,
+		side="right",
+	)
+	last_overlaps = numpy.searchsorted(
+		start_keys,
+		(rows - 1) * (width + 1) + ends,
+		side="left",
+	)
+	num_overlaps = numpy.maximum(last_overlaps - first_overlaps, 0)
+	runs = numpy.repeat(numpy.arange(num_runs), num_overlaps)
+	overlap_offsets = (
+		numpy.arange(num_overlaps.sum())
+		- numpy.repeat(numpy.cumsum(num_overlaps) - num_overlaps, num_overlaps)
+	)
+	overlapping_runs = (
+		numpy.repeat(first_overlaps, num_overlaps) + overlap_offsets
+	)
+
+	labels = numpy.arange(num_runs)
+	while True:
+		run_labels = labels[runs]
+		overlapping_labels = labels[overlapping_runs]
+		unmerged = run_labels != overlapping_labels
+		if not unmerged.any():
+			return labels
+		numpy.minimum.at(
+			labels,
+			numpy.maximum(run_labels, overlapping_labels)[unmerged],
+			numpy.minimum(run_labels, overlapping_labels)[unmerged],
+		)
+		while True:
+			flattened_labels = labels[labels]
+			if (flattened_labels == labels).all():
+				break
+			labels = flattened_labels
+
+
+def sort_by_reading_order(bubbles):
+	"""Sort bubbles top to bottom, and left to right within each line.
+
+	Bubbles belong to the same line as the first bubble of that line if
+	their top is above that bubble's centre.
+
+	Args:
+		bubbles (list(DetectedBubble)): bubbles to sort.
+
+	Returns:
+		list(DetectedBubble): the sorted bubbles.
+	"""
+	sorted_bubbles = []
+	line = []
+	for bubble in sorted(bubbles, key=lambda bubble: bubble.y_min):
+		if line and bubble.y_min >= 0.5 * (line[0].y_min + line[0].y_max):
+			sorted_bubbles.extend(sorted(line, key=lambda b: b.x_min))
+			line = []
+		line.append(bubble)
+	sorted_bubbles.extend(sorted(line, key=lambda b: b.x_min))
+	return sorted_bubbles
+
+
+def detect_bubbles(
+		pixels,
+		light_threshold=0.85,
+		min_area=400,
+		max_area_fraction=0.25,
+		min_fill_ratio=0.5,
+		):
+	"""Find speech bubbles on a page.
+
+	Speech bubbles are taken to be the connected regions of light pixels
+	that are enclosed by darker outlines, so don't touch the edge of the page,
+	and that fill a good part of their bounding box.
+
+	Args:
+		pixels (numpy.ndarray): height x width x channels array of the
+			flattened page as uint8.
+		light_threshold (float): pixels whose darkest color channel is at
+			least this fraction of white count as light.
+		min_area (int): smallest area of bubble to find, in pixels.
+		max_area_fraction (float): largest area of bubble to find, as a
+			fraction of the page area.
+		min_fill_ratio (float): smallest fraction of its bounding box that a
+			bubble must fill.
+
+	Returns:
+		list(DetectedBubble): the bubbles found, in reading order.
+	"""
+	light_mask = get_light_mask(pixels, light_threshold)
+	height, width = light_mask.shape
+	rows, starts, ends = find_row_runs(light_mask)
+	if not len(rows):
+		return []
+	_, components = numpy.unique(
+		label_runs(rows, starts, ends, width),
+		return_inverse=True,
+	)
+	num_components = components.max() + 1
+	areas = numpy.bincount(components, weights=ends - starts)
+	x_mins = numpy.full(num_components, width)
+	y_mins = numpy.full(num_components, height)
+	x_maxes = numpy.zeros(num_components, dtype=ends.dtype)
+	y_maxes = numpy.zeros(num_components, dtype=rows.dtype)
+	numpy.minimum.at(x_mins, components, starts)
+	numpy.minimum.at(y_mins, components, rows)
+	numpy.maximum.at(x_maxes, components, ends)
+	numpy.maximum.at(y_maxes, components, rows + 1)
+	box_areas = (x_maxes - x_mins) * (y_maxes - y_mins)
+	is_bubble = (
+		(x_mins > 0) & (y_mins > 0) & (x_maxes < width) & (y_maxes < height)
+		& (areas >= min_area)
+		& (areas <= max_area_fraction * width * height)
+		& (areas >= min_fill_ratio * box_areas)
+	)
+
+	bubbles = []
+	run_order = numpy.argsort(components, kind="mergesort")
+	component_starts = numpy.searchsorted(
+		components[run_order],
+		numpy.arange(num_components + 1),
+	)
+	for component in numpy.nonzero(is_bubble)[0]:
+		x_min = x_mins[component]
+		y_min = y_mins[component]
+		mask = numpy.zeros(
+			(y_maxes[component] - y_min, x_maxes[component] - x_min),
+			dtype=bool,
+		)
+		component_runs = run_order[
+			component_starts[component]:component_starts[component + 1]
+		]
+		for run in component_runs:
+			mask[rows[run] - y_min, starts[run] - x_min:ends[run] - x_min] = True
+		bubbles.append(DetectedBubble(mask, int(x_min), int(y_min)))
+	return sort_by_reading_order(bubbles)
@@ -0,0 +1,1839 @@
+import array
+import bisect
+import collections
+import math
+import re
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	from gimp import error as PixelRegionError
+except ImportError:
+	PixelRegionError = IndexError
+
+
+# ways of finding the selected spans of a speech bubble
+SCAN_MODES = ("Full", "Analytic", "Pyramid")
+FULL_SCAN = 0
+ANALYTIC_SCAN = 1
+PYRAMID_SCAN = 2
+
+
+# Exceptions
+class InvalidRowError(Exception):
+	def __init__(self, message=None):
+		if not message:
+			message = "Tried to access row outside selected region."
+		super(InvalidRowError, self).__init__(message)
+
+
+class SelectionSizeError(Exception):
+	def __init__(self, message=None):
+		if not message:
+			message = "Selected region is too small to fit given text."
+		super(SelectionSizeError, self).__init__(message)
+
+
+# Utils
+# runs of selected pixels in a selection mask, with one byte per pixel
+SELECTED_RUN = re.compile(b"[^\x00]+")
+
+
+def read_region_mask(region, x_min, y_min, x_max, y_max):
+	"""Read part of a pixel region of a selection as a mask.
+
+	Args:
+		region (gimp.PixelRgn): pixel region of the selection.
+		x_min (int): x coordinate of left of part.
+		y_min (int): y coordinate of top of part.
+		x_max (int): x coordinate of right of part, exclusive.
+		y_max (int): y coordinate of bottom of part, exclusive.
+
+	Returns:
+		str: byte string of the part row by row, with one byte per pixel.
+	"""
+	mask = region[x_min:x_max, y_min:y_max]
+	if region.bpp > 1:
+		mask = mask[::region.bpp]
+	return mask
+
+
+def find_row_runs(mask):
+	"""Find the runs of consecutive true pixels in each row of a mask.
+
+	Runs start where the mask changes from false to true and end where it
+	changes back, so they are found with a single diff over the mask, padded
+	with a false pixel at each end of every row. This needs numpy.
+
+	Args:
+		mask (numpy.ndarray): height x width boolean array.
+
+	Returns:
+		tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray): the row, start
+			and (exclusive) end of every run, sorted by row and then start.
+	"""
+	height, width = mask.shape
+	padded_mask = numpy.zeros((height, width + 2), dtype=numpy.int8)
+	padded_mask[:, 1:-1] = mask
+	changes = numpy.diff(padded_mask, axis=1)
+	rows, starts = numpy.nonzero(changes == 1)
+	_, ends = numpy.nonzero(changes == -1)
+	return rows, starts, ends
+
+
+def sliding_window_max(values, window_size):
+	"""Get the maximum of every window of consecutive values.
+
+	This keeps a deque of indices of decreasing values, so each value is
+	added and removed at most once and the whole pass is linear.
+
+	Args:
+		values (list(int)): values to take window maxima of.
+		window_size (int): number of consecutive values in each window.
+
+	Returns:
+		list(int): the maximum of values[i:i + window_size] for each i from 0
+			to len(values) - window_size.
+	"""
+	maxima = []
+	window = collections.deque()
+	for index, value in enumerate(values):
+		while window and values[window[-1]] <= value:
+			window.pop()
+		window.append(index)
+		if window[0] <= index - window_size:
+			window.popleft()
+		if index >= window_size - 1:
+			maxima.append(values[window[0]])
+	return maxima
+
+
+def sliding_window_min(values, window_size):
+	"""Get the minimum of every window of consecutive values.
+
+	Args:
+		values (list(int)): values to take window minima of.
+		window_size (int): number of consecutive values in each window.
+
+	Returns:
+		list(int): the minimum of values[i:i + window_size] for each i from 0
+			to len(values) - window_size.
+	"""
+	return [
+		-value for value in
+		sliding_window_max([-value for value in values], window_size)
+	]
+
+
+def sliding_window_offset_max(values, window_size, offset):
+	"""Get the offset running maximum of every window of consecutive values.
+
+	Going through each window in order, this keeps its first value, and then
+	any later value that is greater than the kept value plus offset. With an
+	offset of zero that is just the maximum of the window. Each value is
+	linked to the next value that would replace it, found by binary search
+	over a stack of the running maxima after it. The links are then
+	followed within each window by binary lifting, so this takes time
+	proportional to the number of values times the log of the window size.
+
+	Args:
+		values (list(int)): values to take window maxima of.
+		window_size (int): number of consecutive values in each window.
+		offset (int): how much greater than the kept value a later value
+			must be to replace it.
+
+	Returns:
+		list(int): the kept value of values[i:i + window_size] for each i
+			from 0 to len(values) - window_size.
+	"""
+	num_values = len(values)
+	# next_indices[i] is the first index after i whose value is greater than
+	# values[i] + offset, or num_values if there is none
+	next_indices = [num_values] * (num_values + 1)
+	# indices of the running maxima after the current index, whose values
+	# decrease towards the end of the list
+	maxima = []
+	for index in range(num_values - 1, -1, -1):
+		threshold = values[index] + offset
+		low = 0
+		high = len(maxima)
+		while low < high:
+			middle = (low + high) // 2
+			if values[maxima[middle]] > threshold:
+				low = middle + 1
+			else:
+				high = middle
+		if low:
+			next_indices[index] = maxima[low - 1]
+		while maxima and values[maxima[-1]] <= values[index]:
+			maxima.pop()
+		maxima.append(index)
+	# jumps[k][i] is the index reached by following 2 ** k links from i
+	jumps = [next_indices]
+	while (1 << len(jumps)) < window_size:
+		previous_jumps = jumps[-1]
+		jumps.append([previous_jumps[index] for index in previous_jumps])
+	kept_values = []
+	for start in range(num_values - window_size + 1):
+		index = start
+		for jump in reversed(jumps):
+			if jump[index] < start + window_size:
+				index = jump[index]
+		kept_values.append(values[index])
+	return kept_values
+
+
+def intersect_spans(spans, other_spans):
+	"""Get the intersection of two lists of spans.
+
+	Args:
+		spans (list(tuple(int, int))): start and exclusive end of each span,
+			ordered by start and not overlapping.
+		other_spans (list(tuple(int, int))): spans to intersect with, in the
+			same form.
+
+	Returns:
+		list(tuple(int, int)): the spans covered by both lists, ordered by
+			start.
+	"""
+	intersection = []
+	index = 0
+	other_index = 0
+	while index < len(spans) and other_index < len(other_spans):
+		start, end = spans[index]
+		other_start, other_end = other_spans[other_index]
+		if max(start, other_start) < min(end, other_end):
+			intersection.append((max(start, other_start), min(end, other_end)))
+		if end < other_end:
+			index += 1
+		else:
+			other_index += 1
+	return intersection
+
+
+def sliding_window_intersection(row_spans, window_size):
+	"""Get the intersection of the spans of every window of consecutive rows.
+
+	Rows are split into blocks of window_size rows, and the intersections of
+	the rows from the start of each block down to every row, and from every
+	row down to the end of its block, are built up one row at a time. Every
+	window is covered by the end of one block and the start of the next, so
+	its intersection is the intersection of one of each. This takes a fixed
+	number of span intersections per row, however large the window.
+
+	Args:
+		row_spans (list(list(tuple(int, int)))): start and exclusive end of
+			the spans of each row, ordered by start.
+		window_size (int): number of consecutive rows in each window.
+
+	Returns:
+		list(list(tuple(int, int))): the spans common to every row of
+			row_spans[i:i + window_size] for each i from 0 to
+			len(row_spans) - window_size.
+	"""
+	num_rows = len(row_spans)
+	prefixes = []
+	suffixes = [None] * num_rows
+	for block_start in range(0, num_rows, window_size):
+		block_end = min(block_start + window_size, num_rows)
+		prefix = row_spans[block_start]
+		prefixes.append(prefix)
+		for row in range(block_start + 1, block_end):
+			prefix = intersect_spans(prefix, row_spans[row])
+			prefixes.append(prefix)
+		suffix = row_spans[block_end - 1]
+		suffixes[block_end - 1] = suffix
+		for row in range(block_end - 2, block_start - 1, -1):
+			suffix = intersect_spans(row_spans[row], suffix)
+			suffixes[row] = suffix
+	return [
+		intersect_spans(suffixes[row], prefixes[row + window_size - 1])
+		if row % window_size else prefixes[row + window_size - 1]
+		for row in range(num_rows - window_size + 1)
+	]
+
+
+def get_shape_row_bounds(bounds, radii, row):
+	"""Get the horizontal bounds of a row of a rounded rectangle.
+
+	The rectangle has elliptical corners with the given radii, so a
+	rectangle has radii of zero and an ellipse has radii of half its width
+	and height. A pixel is inside the shape if its centre is.
+
+	Args:
+		bounds (tuple(int, int, int, int)): x_min, y_min, x_max and y_max
+			bounds of the shape.
+		radii (tuple(float, float)): horizontal and vertical radius of the
+			corners.
+		row (int): the pixel row.
+
+	Returns:
+		tuple(int, int) or None: the first and last pixel of the row inside
+			the shape, or None if the row is outside it.
+	"""
+	x_min, y_min, x_max, y_max = bounds
+	radius_x, radius_y = radii
+	y = row + 0.5
+	if y < y_min or y > y_max:
+		return None
+	inset = 0.0
+	corner_distance = max(y_min + radius_y - y, y - y_max + radius_y)
+	if corner_distance > 0:
+		inset = radius_x * (
+			1 - math.sqrt(max(0.0, 1 - (corner_distance / radius_y) ** 2))
+		)
+	left = int(math.ceil(x_min + inset - 0.5))
+	right = int(math.floor(x_max - inset - 0.5))
+	if left > right:
+		return None
+	return (left, right)
+
+
+def get_sample_rows(y_min, y_max, num_samples):
+	"""Get rows to sample a selection at when fitting a shape to it.
+
+	Rows are spaced like Chebyshev nodes, so that they are closer together
+	near the top and bottom, where the bounds of rounded shapes change
+	fastest.
+
+	Args:
+		y_min (int): top row.
+		y_max (int): row after the bottom row.
+		num_samples (int): largest number of rows to sample.
+
+	Returns:
+		list(int): the rows to sample, from top to bottom.
+	"""
+	last_row = y_max - 1 - y_min
+	rows = set()
+	for index in range(num_samples):
+		fraction = 0.5 * (1 - math.cos(math.pi * index / (num_samples - 1)))
+		rows.add(y_min + int(round(fraction * last_row)))
+	return sorted(rows)
+
+
+def fit_selection_shape(bounds, row_bounds, tolerance):
+	"""Fit a rectangle, ellipse or rounded rectangle to sampled rows.
+
+	The radius of rounded rectangle corners is estimated from how far in the
+	top and bottom rows start and end. Each shape is checked against the
+	bounds of every sampled row, and the first that is within tolerance of
+	all of them is used.
+
+	Args:
+		bounds (tuple(int, int, int, int)): x_min, y_min, x_max and y_max
+			bounds of the selection.
+		row_bounds (dict(int, tuple(int, int) or None)): first and last
+			selected pixel of each sampled row, or None for rows with no
+			selected pixels.
+		tolerance (float): largest difference in pixels allowed between the
+			bounds of the shape and a sampled row.
+
+	Returns:
+		tuple(tuple(float, float), int) or None: the radii of the corners of
+			the fitted shape and the largest difference from a sampled row,
+			or None if no shape fits.
+	"""
+	x_min, y_min, x_max, y_max = bounds
+	insets = []
+	for row in (y_min, y_max - 1):
+		if row_bounds.get(row):
+			left, right = row_bounds[row]
+			insets.extend([left - x_min, x_max - 1 - right])
+	max_radius = 0.5 * min(x_max - x_min, y_max - y_min)
+	candidate_radii = [
+		(0.0, 0.0),
+		(0.5 * (x_max - x_min), 0.5 * (y_max - y_min)),
+	]
+	if insets:
+		# the first row of a circular corner of radius r is inset by about
+		# r - sqrt(r), so invert that for the mean inset
+		inset = float(sum(insets)) / len(insets)
+		radius = min((0.5 + math.sqrt(inset)) ** 2 + 0.25, max_radius)
+		candidate_radii.append((radius, radius))
+	for radii in candidate_radii:
+		max_error = 0
+		for row, bounds_of_row in row_bounds.items():
+			shape_bounds = get_shape_row_bounds(bounds, radii, row)
+			if shape_bounds is None:
+				# leaving out a row is always safe
+				continue
+			if bounds_of_row is None:
+				break
+			max_error = max(
+				max_error,
+				abs(shape_bounds[0] - bounds_of_row[0]),
+				abs(shape_bounds[1] - bounds_of_row[1]),
+			)
+			if max_error > tolerance:
+				break
+		else:
+			return radii, max_error
+	return None
+
+
+# Classes
+class WordLayer(object):
+	"""Struct to encapsulate data for word layers.
+
+	Word layers are laid out using the measured size of their word, and are
+	only given a gimp layer once they've been placed.
+	"""
+	def __init__(self, word, width, height):
+		self.word = word
+		self.layer = None
+		self.x_min = 0
+		self.y_min = 0
+		self.height = height
+		self.width = width
+
+	def move_to(self, x_pos, y_pos):
+		"""Move word layer to specified position and update attributes.
+
+		Args:
+			x_pos (int): x pos of top left hand corner of new position.
+			y_pos (int): y pos of top left hand corner of new position.
+		"""
+		if self.layer:
+			self.layer.translate(
+				int(x_pos - self.x_min),
+				int(y_pos - self.y_min),
+			)
+		self.x_min = x_pos
+		self.y_min = y_pos
+
+	def set_layer(self, layer):
+		"""Give word layer a gimp layer and move it to the word's position.
+
+		Args:
+			layer (gimp.Layer): text layer for the word.
+		"""
+		self.layer = layer
+		layer.translate(
+			int(self.x_min - layer.offsets[0]),
+			int(self.y_min - layer.offsets[1]),
+		)
+
+
+class BlockRow(object):
+	"""Class to represent a block row of a selected area.
+
+	A block row here means the largest rectangular area that fits inside a
+	given series of consecutive pixel rows.
+
+	We split selected regions into block rows of a given height, extending out
+	from the centre, and separate the cases where we have an even number of
+	rows and where we have an odd number.
+
+	eg. in the following selected area:
+
+        ................
+     .....................
+     ......................
+    .........................
+    ........................
+   .........................
+      ...................
+      .................
+         .............
+
+	the 'odd' block rows of height 3 would be:
+
+        +--------------+
+     ...| BLOCK ROW 2  |..
+     ...+--------------+...
+    +----------------------+.
+    |     BLOCK ROW 1      |
+   .+----------------------+
+      ...+-----------+...
+      ...|BLOCK ROW 3|.
+         +-----------+
+
+	and the 'even' block rows of height 3 would be:
+
+        ................
+     .....................
+     +--------------------+
+    .|   BLOCK ROW 1      |..
+    .+--------------------+.
+   ...+---------------+.....
+      |  BLOCK ROW 2  |..
+      +---------------+
+         .............
+	"""
+	def __init__(self, speech_bubble, top):
+		self.speech_bubble = speech_bubble
+		self.height = speech_bubble.row_height
+		self.top = top
+		self.bottom = top + self.height
+		self._compute_horizontal_bounds()
+
+	def _compute_horizontal_bounds(self):
+		"""Find left and right bounds of block row."""
+		self.left = None
+		self.right = None
+		self.width = 0
+		bounds = self.speech_bubble.get_block_row_bounds(self.top)
+		if not bounds:
+			return
+		self.left = bounds[0] + self.speech_bubble.horizontal_offset
+		self.right = bounds[1] - self.speech_bubble.horizontal_offset
+		if self.left and self.right and self.right > self.left:
+			self.width = self.right - self.left
+
+
+class SelectionSpans(object):
+	"""Class to store the selected spans of each row of a selection.
+
+	Spans are run length encoded in compressed sparse row form: the starts
+	and exclusive ends of all spans are kept in two flat arrays, ordered by
+	row and then start, with a third array giving the index of the first
+	span of each row. This keeps concave shapes and holes, while using a few
+	integers per row rather than a list of tuples.
+	"""
+	def __init__(self, x_min, y_min, row_offsets, starts, ends):
+		self.x_min = x_min
+		self.y_min = y_min
+		self.row_offsets = row_offsets
+		self.starts = starts
+		self.ends = ends
+		self.num_rows = len(row_offsets) - 1
+
+	@classmethod
+	def from_mask(cls, mask, x_min, y_min, width):
+		"""Find the spans of a selection mask.
+
+		Args:
+			mask (str): byte string of the selection mask row by row, with
+				one byte per pixel, which is non-zero where selected.
+			x_min (int): x coordinate of left of mask.
+			y_min (int): y coordinate of top of mask.
+			width (int): width of mask.
+
+		Returns:
+			SelectionSpans: the spans of the mask.
+		"""
+		num_rows = len(mask) // width if width > 0 else 0
+		if numpy is not None:
+			return cls._from_mask_numpy(mask, x_min, y_min, width, num_rows)
+		row_offsets = array.array("l", [0])
+		starts = array.array("l")
+		ends = array.array("l")
+		for row_start in range(0, num_rows * width, width):
+			for run in SELECTED_RUN.finditer(mask, row_start, row_start + width):
+				starts.append(x_min + run.start() - row_start)
+				ends.append(x_min + run.end() - row_start)
+			row_offsets.append(len(starts))
+		return cls(x_min, y_min, row_offsets, starts, ends)
+
+	@classmethod
+	def _from_mask_numpy(cls, mask, x_min, y_min, width, num_rows):
+		"""Find the spans of a selection mask with numpy, see find_row_runs.
+
+		Args:
+			mask (str): byte string of the selection mask, see from_mask.
+			x_min (int): x coordinate of left of mask.
+			y_min (int): y coordinate of top of mask.
+			width (int): width of mask.
+			num_rows (int): number of rows of mask.
+
+		Returns:
+			SelectionSpans: the spans of the mask.
+		"""
+		rows, starts, ends = find_row_runs(
+			numpy.frombuffer(
+				mask[:num_rows * width],
+				dtype=numpy.uint8,
+			).reshape(num_rows, width) != 0
+		)
+		return cls(
+			x_min,
+			y_min,
+			numpy.searchsorted(rows, numpy.arange(num_rows + 1)),
+			starts + x_min,
+			ends + x_min,
+		)
+
+	@classmethod
+	def from_row_spans(cls, row_spans, x_min, y_min):
+		"""Create spans from a list of the spans of each row.
+
+		Args:
+			row_spans (list(list(tuple(int, int)))): start and exclusive end
+				of the spans of each row, ordered by start.
+			x_min (int): x coordinate of left of selection.
+			y_min (int): y coordinate of the first row.
+
+		Returns:
+			SelectionSpans: the spans.
+		"""
+		row_offsets = array.array("l", [0])
+		starts = array.array("l")
+		ends = array.array("l")
+		for spans in row_spans:
+			for start, end in spans:
+				starts.append(start)
+				ends.append(end)
+			row_offsets.append(len(starts))
+		return cls(x_min, y_min, row_offsets, starts, ends)
+
+	@classmethod
+	def from_polygons(cls, polygons, scale=1.0):
+		"""Find the spans of the pixels inside some polygons.
+
+		A pixel is inside if its centre is, by the even-odd rule, so holes
+		can be cut with inner polygons. Each polygon is closed by an edge
+		from its last point back to its first. Edges are added to the
+		active edges as the scanline reaches their top, so this takes time
+		proportional to the number of edges plus the number of crossings of
+		each row, rather than the number of pixels.
+
+		Args:
+			polygons (list(list(tuple(float, float)))): points of each
+				polygon, such as the flattened strokes of a path.
+			scale (float): factor to scale the polygons by, eg. to lay out
+				the same path at print and web resolutions.
+
+		Returns:
+			SelectionSpans: the spans of the polygons.
+		"""
+		edges_by_row = collections.defaultdict(list)
+		x_min = y_min = None
+		y_max = None
+		for polygon in polygons:
+			points = [(scale * x, scale * y) for x, y in polygon]
+			for (x_start, y_start), (x_end, y_end) in zip(
+					points, points[1:] + points[:1]):
+				if y_start == y_end:
+					continue
+				if y_start > y_end:
+					x_start, x_end = x_end, x_start
+					y_start, y_end = y_end, y_start
+				# rows whose centres are in [y_start, y_end)
+				first_row = int(math.ceil(y_start - 0.5))
+				end_row = int(math.ceil(y_end - 0.5))
+				if first_row >= end_row:
+					continue
+				slope = (x_end - x_start) / (y_end - y_start)
+				edges_by_row[first_row].append((
+					end_row,
+					x_start + (first_row + 0.5 - y_start) * slope,
+					slope,
+				))
+				left = int(math.floor(min(x_start, x_end)))
+				x_min = left if x_min is None else min(left, x_min)
+				y_min = first_row if y_min is None else min(first_row, y_min)
+				y_max = end_row if y_max is None else max(end_row, y_max)
+		if y_min is None:
+			return cls.from_row_spans([], 0, 0)
+		row_spans = []
+		active_edges = []
+		for row in range(y_min, y_max):
+			active_edges = [
+				(end_row, x + slope, slope)
+				for end_row, x, slope in active_edges if end_row > row
+			]
+			active_edges.extend(edges_by_row.get(row, []))
+			crossings = sorted(x for _, x, _ in active_edges)
+			spans = []
+			for left, right in zip(crossings[0::2], crossings[1::2]):
+				start = int(math.ceil(left - 0.5))
+				end = int(math.ceil(right - 0.5))
+				if start >= end:
+					continue
+				if spans and start <= spans[-1][1]:
+					spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+				else:
+					spans.append((start, end))
+			row_spans.append(spans)
+		return cls.from_row_spans(row_spans, x_min, y_min)
+
+	def get_bounds(self):
+		"""Get bounds of the spans, like gimp_selection_bounds.
+
+		Returns:
+			tuple(bool, int, int, int, int): whether there are any spans, and
+				the x_min, y_min, x_max and y_max bounds of the spans.
+		"""
+		if not len(self.starts):
+			return (False, 0, 0, 0, 0)
+		rows = [
+			index for index in range(self.num_rows)
+			if self.row_offsets[index + 1] > self.row_offsets[index]
+		]
+		return (
+			True,
+			int(min(self.starts)),
+			self.y_min + rows[0],
+			int(max(self.ends)),
+			self.y_min + rows[-1] + 1,
+		)
+
+	def get_rows(self, y_min, y_max):
+		"""Get the spans of a range of rows.
+
+		Args:
+			y_min (int): the first row.
+			y_max (int): the row after the last row.
+
+		Returns:
+			SelectionSpans: the spans of the rows, with no spans for rows
+				outside these spans.
+		"""
+		return SelectionSpans.from_row_spans(
+			[self.get_row_spans(row) for row in range(y_min, y_max)],
+			self.x_min,
+			y_min,
+		)
+
+	@property
+	def has_single_spans(self):
+		"""bool: whether every row has at most one span."""
+		if numpy is not None:
+			row_offsets = numpy.asarray(self.row_offsets)
+			return not (row_offsets[1:] - row_offsets[:-1] > 1).any()
+		return all(
+			self.row_offsets[index + 1] - self.row_offsets[index] <= 1
+			for index in range(self.num_rows)
+		)
+
+	@property
+	def nbytes(self):
+		"""int: memory used by the span arrays, in bytes."""
+		return sum(
+			len(values) * values.itemsize
+			for values in (self.row_offsets, self.starts, self.ends)
+		)
+
+	def _get_row_range(self, row):
+		"""Get range of indices of the spans of a row.
+
+		Args:
+			row (int): the pixel row.
+
+		Returns:
+			tuple(int, int): the index of the row's first span and the index
+				after its last span, which are equal for rows outside the
+				selection.
+		"""
+		index = row - self.y_min
+		if index < 0 or index >= self.num_rows:
+			return (0, 0)
+		return (int(self.row_offsets[index]), int(self.row_offsets[index + 1]))
+
+	def get_row_spans(self, row):
+		"""Get the selected spans of a row.
+
+		Args:
+			row (int): the pixel row.
+
+		Returns:
+			list(tuple(int, int)): start and exclusive end of each span of the
+				row, from left to right.
+		"""
+		first_span, last_span = self._get_row_range(row)
+		return [
+			(int(self.starts[i]), int(self.ends[i]))
+			for i in range(first_span, last_span)
+		]
+
+	def find_span(self, row, x):
+		"""Find the span of a row that contains a pixel.
+
+		Args:
+			row (int): the pixel row.
+			x (int): x coordinate of the pixel.
+
+		Returns:
+			tuple(int, int) or None: start and exclusive end of the span, or
+				None if the pixel isn't selected.
+		"""
+		first_span, last_span = self._get_row_range(row)
+		index = bisect.bisect_right(self.starts, x, first_span, last_span) - 1
+		if index < first_span or self.ends[index] <= x:
+			return None
+		return (int(self.starts[index]), int(self.ends[index]))
+
+	def contains(self, row, start, end):
+		"""Check if part of a row is entirely selected.
+
+		Args:
+			row (int): the pixel row.
+			start (int): x coordinate of the start of the part.
+			end (int): exclusive x coordinate of the end of the part.
+
+		Returns:
+			bool: whether a single span covers the part.
+		"""
+		span = self.find_span(row, start)
+		return span is not None and span[1] >= end
+
+	def get_outer_bounds(self, empty_left, empty_right):
+		"""Get the first and last selected pixel of every row.
+
+		Args:
+			empty_left (int): left bound to give rows with no spans.
+			empty_right (int): right bound to give rows with no spans.
+
+		Returns:
+			tuple(array, array): the left bounds and inclusive right bounds
+				of each row.
+		"""
+		if numpy is not None:
+			row_offsets = numpy.asarray(self.row_offsets)
+			has_spans = row_offsets[1:] > row_offsets[:-1]
+			if not has_spans.any():
+				return (
+					numpy.full(self.num_rows, empty_left),
+					numpy.full(self.num_rows, empty_right),
+				)
+			starts = numpy.asarray(self.starts)
+			ends = numpy.asarray(self.ends)
+			last_span = len(starts) - 1
+			return (
+				numpy.where(
+					has_spans,
+					starts[numpy.minimum(row_offsets[:-1], last_span)],
+					empty_left,
+				),
+				numpy.where(
+					has_spans,
+					ends[numpy.maximum(row_offsets[1:] - 1, 0)] - 1,
+					empty_right,
+				),
+			)
+		lefts = array.array("l")
+		rights = array.array("l")
+		for index in range(self.num_rows):
+			first_span = self.row_offsets[index]
+			last_span = self.row_offsets[index + 1]
+			if first_span == last_span:
+				lefts.append(empty_left)
+				rights.append(empty_right)
+			else:
+				lefts.append(self.starts[first_span])
+				rights.append(self.ends[last_span - 1] - 1)
+		return lefts, rights
+
+
+class SpeechBubble(object):
+	"""Class to interact with speech bubble and split into block rows."""
+	def __init__(
+			self,
+			gimp_selection,
+			x_min,
+			y_min,
+			x_max,
+			y_max,
+			row_height,
+			space_width,
+			horizontal_offset,
+			vertical_offset,
+			scan_mode=FULL_SCAN,
+			):
+		self.selection = gimp_selection
+		self.selection_bounds = (x_min, y_min, x_max, y_max)
+		self.scan_mode = scan_mode
+		self.x_min = x_min
+		self.y_min = y_min + vertical_offset
+		self.x_max = x_max
+		self.y_max = y_max - vertical_offset
+		self.height = y_max - y_min
+		self.width = x_max - x_min
+		self.space_width = space_width
+		self.horizontal_offset = horizontal_offset
+		self._compute_pixel_row_bounds()
+		self.set_row_height(row_height)
+
+	def set_row_height(self, row_height):
+		"""Set height of block rows and recompute them.
+
+		This reuses the pixel row bounds, so the selection isn't read again.
+
+		Args:
+			row_height (int): the new height of the block rows.
+		"""
+		self.row_height = row_height
+		self._compute_block_row_bounds()
+		self._compute_block_rows()
+
+	def _compute_pixel_row_bounds(self):
+		"""Get the selected spans and horizontal bounds of each pixel row.
+
+		This reads the selection once into self.spans, and uses the first and
+		last span of each row to populate the self._row_lefts and
+		self._row_rights arrays. Rows with no selected pixels are given a
+		left bound greater than their right bound. The selection is read in a
+		single pixel region fetch, falling back to reading it pixel by pixel
+		if the region can't be read. With the analytic scan mode, the spans
+		are instead read from around the edges of a shape fitted to a few
+		sampled rows, if one fits, and with the pyramid scan mode only the
+		edges of the selection are read at full resolution. If the speech
+		bubble was given SelectionSpans rather than a selection, their rows
+		are used directly.
+		"""
+		self.spans = None
+		if hasattr(self.selection, "get_row_spans"):
+			# spans were found without a selection, eg. from a path
+			self.spans = self.selection.get_rows(self.y_min, self.y_max)
+		elif self.scan_mode == ANALYTIC_SCAN:
+			self.spans = self._compute_spans_analytic()
+		elif self.scan_mode == PYRAMID_SCAN:
+			self.spans = self._compute_spans_pyramid()
+		if self.spans is None:
+			try:
+				mask = self._read_selection_mask()
+			except (PixelRegionError, IndexError, TypeError):
+				self.spans = self._compute_spans_per_pixel()
+			else:
+				self.spans = SelectionSpans.from_mask(
+					mask,
+					self.x_min,
+					self.y_min,
+					self.x_max - self.x_min,
+				)
+		self._row_lefts, self._row_rights = self.spans.get_outer_bounds(
+			self.x_max,
+			self.x_min - 1,
+		)
+
+	def _read_selection_mask(self):
+		"""Read the selection mask within the speech bubble bounds.
+
+		Returns:
+			str: byte string of the selection mask from self.y_min to
+				self.y_max, row by row, with one byte per pixel from
+				self.x_min to self.x_max.
+		"""
+		width = self.x_max - self.x_min
+		height = self.y_max - self.y_min
+		if width <= 0 or height <= 0:
+			return b""
+		region = self.selection.get_pixel_rgn(
+			self.x_min, self.y_min, width, height, False, False
+		)
+		return read_region_mask(
+			region,
+			self.x_min,
+			self.y_min,
+			self.x_max,
+			self.y_max,
+		)
+
+	def _compute_spans_per_pixel(self):
+		"""Get the spans of each pixel row one pixel at a time.
+
+		This is much slower than reading the selection as a pixel region, so
+		is only used as a fallback by _compute_pixel_row_bounds. To keep it
+		from reading every pixel, it only searches in from each end of a row,
+		so each row is given a single span between its outer bounds.
+
+		Returns:
+			SelectionSpans: the spans of the selection.
+		"""
+		row_spans = []
+		for y in range(self.y_min, self.y_max):
+			bound_min = None
+			for x in range(self.x_min, self.x_max):
+				if self.selection.get_pixel(x, y)[0]:
+					bound_min = x
+					break
+			else:
+				row_spans.append([])
+				continue
+			bound_max = bound_min
+			for x in range(self.x_max - 1, self.x_min - 1, -1):
+				if self.selection.get_pixel(x, y)[0]:
+					bound_max = x
+					break
+			row_spans.append([(bound_min, bound_max + 1)])
+		return SelectionSpans.from_row_spans(row_spans, self.x_min, self.y_min)
+
+	def _compute_spans_analytic(self, num_samples=17, band_height=8):
+		"""Get the spans of each pixel row, guided by a fitted shape.
+
+		Most speech bubbles are made with the ellipse or rounded rectangle
+		select tools, so rather than reading the whole selection, this reads
+		a few rows and fits a rectangle, ellipse or rounded rectangle to
+		them, see fit_selection_shape. Every row is then checked against the
+		shape by reading only from the edges of the speech bubble to just
+		inside the row's predicted left and right bounds, see
+		_read_shape_band, so dents between the sampled rows and islands
+		outside the shape are still seen. Holes inside the bubble aren't, so
+		this is only suitable for solid bubbles.
+
+		Args:
+			num_samples (int): largest number of rows to sample.
+			band_height (int): number of rows to read the edge windows of at
+				once.
+
+		Returns:
+			SelectionSpans or None: the spans of the selection, or None if
+				no shape fits, any row differs from the shape by more than
+				the tolerance, or the selection can't be read.
+		"""
+		x_min, y_min, x_max, y_max = self.selection_bounds
+		width = x_max - x_min
+		if width <= 0 or y_max - y_min < 2:
+			return None
+		tolerance = max(2.0, 0.01 * width)
+		row_bounds = {}
+		try:
+			region = self.selection.get_pixel_rgn(
+				x_min, y_min, width, y_max - y_min, False, False
+			)
+			for row in get_sample_rows(y_min, y_max, num_samples):
+				mask = read_region_mask(region, x_min, row, x_max, row + 1)
+				spans = SelectionSpans.from_mask(mask, x_min, row, width)
+				if len(spans.starts) > 1:
+					return None
+				row_bounds[row] = (
+					(int(spans.starts[0]), int(spans.ends[0]) - 1)
+					if len(spans.starts) else None
+				)
+			fit = fit_selection_shape(
+				self.selection_bounds,
+				row_bounds,
+				tolerance,
+			)
+			if fit is None:
+				return None
+			radii, _ = fit
+			row_spans = []
+			for band_min in range(self.y_min, self.y_max, band_height):
+				band_spans = self._read_shape_band(
+					region,
+					band_min,
+					min(band_min + band_height, self.y_max),
+					radii,
+					tolerance,
+				)
+				if band_spans is None:
+					return None
+				row_spans.extend(band_spans)
+		except (PixelRegionError, IndexError, TypeError):
+			return None
+		return SelectionSpans.from_row_spans(row_spans, self.x_min, self.y_min)
+
+	def _read_shape_band(self, region, y_min, y_max, radii, tolerance):
+		"""Read the spans of a band of rows and check them against a shape.
+
+		The windows around the left and right bounds reach from the edges of
+		the speech bubble to tolerance pixels inside the shape's bounds for
+		every row of the band, see _read_edge_bounds. If the windows would
+		overlap, or the shape leaves out a row of the band, the band is read
+		in full instead.
+
+		Args:
+			region (gimp.PixelRgn): pixel region of the selection.
+			y_min (int): the first row.
+			y_max (int): the row after the last row.
+			radii (tuple(float, float)): horizontal and vertical radius of
+				the corners of the shape, see get_shape_row_bounds.
+			tolerance (float): largest difference in pixels allowed between
+				the bounds of the shape and a row.
+
+		Returns:
+			list(list(tuple(int, int))) or None: start and exclusive end of
+				the spans of each row of the band, or None if a row has
+				several spans, or an edge outside the tolerance.
+		"""
+		shape_bounds = [
+			get_shape_row_bounds(self.selection_bounds, radii, row)
+			for row in range(y_min, y_max)
+		]
+		row_spans = None
+		if None not in shape_bounds:
+			reach = int(math.ceil(tolerance)) + 1
+			lefts, rights = zip(*shape_bounds)
+			left_end = max(lefts) + reach
+			right_start = min(rights) + 1 - reach
+			if left_end < right_start:
+				row_spans = [
+					[bounds] if bounds else None
+					for bounds in self._read_edge_bounds(
+						region,
+						y_min,
+						y_max,
+						left_end,
+						right_start,
+					)
+				]
+		if row_spans is None:
+			row_spans = self._read_row_spans(region, y_min, y_max)
+		for bounds, spans in zip(shape_bounds, row_spans):
+			if spans is None or len(spans) > 1:
+				return None
+			if bounds is None:
+				# leaving out a row is always safe
+				continue
+			if not spans:
+				return None
+			(start, end), = spans
+			error = max(abs(start - bounds[0]), abs(end - 1 - bounds[1]))
+			if error > tolerance:
+				return None
+		return row_spans
+
+	def _compute_spans_pyramid(self, factor=8):
+		"""Get the spans of each pixel row, reading the edges at full size.
+
+		Every factor-th row is read in full first, as a coarse level of the
+		selection. Between two coarse rows with one span each, the left and
+		right bounds of each row are expected to lie between those of the
+		coarse rows, so only the pixels from each edge of the speech bubble
+		to factor pixels inside them are read for the rows of the band, see
+		_refine_band. Rows with other selected pixels in those windows, and
+		bands next to coarse rows that are empty or have several spans, are
+		read in full, so islands are kept and joined bubbles keep their
+		gaps. This copies roughly the area outside the selection plus a
+		factor-th of its area out of the selection, rather than all of it.
+		Holes inside the bubble between coarse rows aren't seen though, so
+		a row with a hole is given a single span across it, and this is
+		only suitable for solid bubbles. Gimp selections are fetched a tile
+		at a time, and coarse rows are closer together than the height of a
+		tile, so every tile of the bubble is still fetched once, given a
+		tile cache that holds a row of tiles, see
+		speech_bubblifier.set_tile_cache.
+
+		Args:
+			factor (int): number of rows from one coarse row to the next.
+
+		Returns:
+			SelectionSpans or None: the spans of the selection, or None if
+				it can't be read as a pixel region.
+		"""
+		width = self.x_max - self.x_min
+		if width <= 0 or self.y_max <= self.y_min:
+			return None
+		coarse_rows = list(range(self.y_min, self.y_max, factor))
+		if coarse_rows[-1] != self.y_max - 1:
+			coarse_rows.append(self.y_max - 1)
+		try:
+			region = self.selection.get_pixel_rgn(
+				self.x_min,
+				self.y_min,
+				width,
+				self.y_max - self.y_min,
+				False,
+				False,
+			)
+			coarse_spans = [
+				self._read_row_spans(region, row, row + 1)[0]
+				for row in coarse_rows
+			]
+			row_spans = []
+			for top, bottom, top_spans, bottom_spans in zip(
+					coarse_rows,
+					coarse_rows[1:],
+					coarse_spans,
+					coarse_spans[1:]):
+				row_spans.append(top_spans)
+				row_spans.extend(self._refine_band(
+					region,
+					top + 1,
+					bottom,
+					top_spans,
+					bottom_spans,
+					factor,
+				))
+			row_spans.append(coarse_spans[-1])
+		except (PixelRegionError, IndexError, TypeError):
+			return None
+		return SelectionSpans.from_row_spans(row_spans, self.x_min, self.y_min)
+
+	def _read_row_spans(self, region, y_min, y_max):
+		"""Read the spans of some full rows of the selection.
+
+		Args:
+			region (gimp.PixelRgn): pixel region of the selection.
+			y_min (int): the first row.
+			y_max (int): the row after the last row.
+
+		Returns:
+			list(list(tuple(int, int))): start and exclusive end of the spans
+				of each row.
+		"""
+		spans = SelectionSpans.from_mask(
+			read_region_mask(region, self.x_min, y_min, self.x_max, y_max),
+			self.x_min,
+			y_min,
+			self.x_max - self.x_min,
+		)
+		return [spans.get_row_spans(row) for row in range(y_min, y_max)]
+
+	def _refine_band(
+			self,
+			region,
+			y_min,
+			y_max,
+			top_spans,
+			bottom_spans,
+			factor,
+			):
+		"""Find the spans of the rows between two coarse rows.
+
+		The windows around the left and right bounds are read for the whole
+		band at once, see _read_edge_bounds. Rows whose bounds aren't found
+		in the windows are read in full.
+
+		Args:
+			region (gimp.PixelRgn): pixel region of the selection.
+			y_min (int): the first row after the top coarse row.
+			y_max (int): the bottom coarse row.
+			top_spans (list(tuple(int, int))): spans of the top coarse row.
+			bottom_spans (list(tuple(int, int))): spans of the bottom coarse
+				row.
+			factor (int): number of pixels to widen the windows by.
+
+		Returns:
+			list(list(tuple(int, int))): start and exclusive end of the spans
+				of each row of the band.
+		"""
+		if y_min >= y_max:
+			return []
+		if len(top_spans) != 1 or len(bottom_spans) != 1:
+			return self._read_row_spans(region, y_min, y_max)
+		(top_start, top_end), = top_spans
+		(bottom_start, bottom_end), = bottom_spans
+		left_end = max(top_start, bottom_start) + factor
+		right_start = min(top_end, bottom_end) - factor
+		if left_end >= right_start:
+			return self._read_row_spans(region, y_min, y_max)
+		row_spans = []
+		edge_bounds = self._read_edge_bounds(
+			region,
+			y_min,
+			y_max,
+			left_end,
+			right_start,
+		)
+		for row, bounds in zip(range(y_min, y_max), edge_bounds):
+			if bounds:
+				row_spans.append([bounds])
+			else:
+				row_spans.extend(self._read_row_spans(region, row, row + 1))
+		return row_spans
+
+	def _read_edge_bounds(self, region, y_min, y_max, left_end, right_start):
+		"""Find the outer bounds of some rows from windows around their edges.
+
+		The left window reaches from the left of the speech bubble to
+		left_end, and the right window from right_start to its right, and
+		each is read for all the rows at once. A row's left bound is taken
+		from its window if the window holds a single run of selected pixels
+		that reaches the window's right end, and likewise for the right
+		bound, so that pixels selected outside the row's outer span are
+		never missed.
+
+		Args:
+			region (gimp.PixelRgn): pixel region of the selection.
+			y_min (int): the first row.
+			y_max (int): the row after the last row.
+			left_end (int): pixel after the last pixel of the left window.
+			right_start (int): first pixel of the right window.
+
+		Returns:
+			list(tuple(int, int) or None): start and exclusive end of the
+				outer bounds of each row, or None for rows whose bounds
+				aren't both found in the windows.
+		"""
+		left_width = left_end - self.x_min
+		right_width = self.x_max - right_start
+		left_mask = read_region_mask(
+			region,
+			self.x_min,
+			y_min,
+			left_end,
+			y_max,
+		)
+		right_mask = read_region_mask(
+			region,
+			right_start,
+			y_min,
+			self.x_max,
+			y_max,
+		)
+		edge_bounds = []
+		for index in range(y_max - y_min):
+			left_run = left_mask[
+				index * left_width:(index + 1) * left_width
+			].lstrip(b"\x00")
+			right_run = right_mask[
+				index * right_width:(index + 1) * right_width
+			].rstrip(b"\x00")
+			if (left_run and b"\x00" not in left_run
+					and right_run and b"\x00" not in right_run):
+				edge_bounds.append(
+					(left_end - len(left_run), right_start + len(right_run))
+				)
+			else:
+				edge_bounds.append(None)
+		return edge_bounds
+
+	def get_pixel_row_spans(self, pixel_row):
+		"""Get the selected spans of given pixel row.
+
+		Args:
+			pixel_row (int): the row we're looking at.
+
+		Returns:
+			list(tuple(int, int)): start and exclusive end of each selected
+				span of the row, from left to right.
+		"""
+		return self.spans.get_row_spans(pixel_row)
+
+	def get_pixel_row_bounds(self, pixel_row):
+		"""Get horizontal bounds of given pixel row.
+		
+		Args:
+			pixel_row (int): the row we're looking at.
+
+		Returns:
+			tuple(int, int) or None: the start and end of the selected region
+				of the pixel row, or None if row is all unselected.
+		"""
+		try:
+			left = self._row_lefts[pixel_row - self.y_min]
+			right = self._row_rights[pixel_row - self.y_min]
+		except IndexError:
+			raise InvalidRowError()
+		if left > right:
+			return None
+		return (int(left), int(right))
+
+	def _compute_block_row_bounds(self):
+		"""Find the horizontal bounds of every possible block row.
+
+		For each window of self.row_height consecutive pixel rows, this finds
+		the bounds of the region that is selected in every row of the window,
+		so that block rows can be created without rescanning their pixel
+		rows. If no row has more than one span, block rows have always
+		compared each row's bounds against bounds that already include the
+		horizontal offset, so a row only narrows the block row if it is
+		narrower by more than the offset. That is kept here, with
+		sliding_window_offset_max, so that layouts don't change. Otherwise,
+		as in concave bubbles or joined bubbles, the spans of the rows in
+		each window are intersected, so that block rows don't cross the
+		unselected gaps between spans.
+		"""
+		if not self.spans.has_single_spans:
+			self._compute_block_row_bounds_from_spans()
+			return
+		row_lefts = self._row_lefts.tolist()
+		row_rights = self._row_rights.tolist()
+		self._block_row_lefts = sliding_window_offset_max(
+			row_lefts,
+			self.row_height,
+			self.horizontal_offset,
+		)
+		self._block_row_rights = [
+			-right for right in sliding_window_offset_max(
+				[-right for right in row_rights],
+				self.row_height,
+				self.horizontal_offset,
+			)
+		]
+		# block rows with an unselected pixel row have no bounds
+		has_empty_rows = sliding_window_max(
+			[int(left > right) for left, right in zip(row_lefts, row_rights)],
+			self.row_height,
+		)
+		for index, has_empty_row in enumerate(has_empty_rows):
+			if has_empty_row:
+				self._block_row_lefts[index] = self.x_max
+				self._block_row_rights[index] = self.x_min - 1
+
+	def _compute_block_row_bounds_from_spans(self):
+		"""Find the widest common span of every possible block row.
+
+		Where a window of pixel rows has several common spans of the same
+		width, the leftmost is used.
+		"""
+		row_spans = [
+			self.spans.get_row_spans(row)
+			for row in range(self.y_min, self.y_min + self.spans.num_rows)
+		]
+		self._block_row_lefts = []
+		self._block_row_rights = []
+		for spans in sliding_window_intersection(row_spans, self.row_height):
+			left, right = self.x_max, self.x_min - 1
+			for start, end in spans:
+				if end - 1 - start > right - left:
+					left, right = start, end - 1
+			self._block_row_lefts.append(left)
+			self._block_row_rights.append(right)
+
+	def get_block_row_bounds(self, top):
+		"""Get horizontal bounds of the block row with the given top row.
+
+		Args:
+			top (int): the top pixel row of the block row.
+
+		Returns:
+			tuple(int, int) or None: the start and end of the region that is
+				selected in every pixel row of the block row, or None if there
+				is no such region or the block row leaves the selected area.
+		"""
+		index = top - self.y_min
+		if index < 0 or index >= len(self._block_row_lefts):
+			return None
+		left = self._block_row_lefts[index]
+		right = self._block_row_rights[index]
+		if left > right:
+			return None
+		return (left, right)
+
+	def _compute_block_rows(self):
+		"""Find the odd and even block rows for this selection."""
+		centre_height = int(math.floor(0.5 * (self.y_min + self.y_max)))
+		num_steps = int(math.floor(0.5 * (self.height / self.row_height)))
+		half_row_height_floor = int(math.floor(0.5 * self.row_height))
+		half_row_height_ceil = int(math.ceil(0.5 * self.row_height))
+		self.odd_block_rows = [
+			BlockRow(self, centre_height - half_row_height_floor)
+		]
+		self.even_block_rows = []
+		# add rows going out from centre
+		for i in range(num_steps):
+			even_row_higher = centre_height - ((i + 1) * self.row_height)
+			even_row_lower = centre_height + (i * self.row_height)
+			odd_row_higher = even_row_higher - half_row_height_floor
+			odd_row_lower = even_row_lower + half_row_height_ceil
+			self.even_block_rows.extend([
+				BlockRow(self, even_row_higher),
+				BlockRow(self, even_row_lower),
+			])
+			if odd_row_higher >= self.y_min:
+				self.odd_block_rows.extend([
+					BlockRow(self, odd_row_higher),
+					BlockRow(self, odd_row_lower)
+				])
+		self.max_num_rows = max(len(self.odd_block_rows), len(self.even_block_rows))
+
+	def place_words(self, word_layers, balanced=False):
+		"""Place words in selection.
+
+		This uses the block rows and places the words centred around
+		the middle of the selection, using the smallest number of rows that
+		the words fit in.
+
+		Args:
+			word_layers (list(WordLayer)): list of WordLayer objects
+				representing text to add.
+			balanced (bool): if True, break the words into rows with the
+				least raggedness rather than filling each row in turn.
+		"""
+		min_num_rows = self._get_min_num_rows(word_layers)
+		if min_num_rows is None:
+			raise SelectionSizeError()
+		fit = self._find_num_rows(
+			word_layers,
+			min_num_rows,
+			self.max_num_rows,
+		)
+		# only need to check the other parity for fewer rows than this fit
+		other_parity_fit = self._find_num_rows(
+			word_layers,
+			min_num_rows + 1,
+			fit[0] if fit else self.max_num_rows,
+		)
+		if other_parity_fit:
+			fit = other_parity_fit
+		if fit is None:
+			# word layers do not fit in any number of rows
+			raise SelectionSizeError()
+		num_rows, word_layers_by_row = fit
+		if balanced:
+			word_layers_by_row = self._fit_words_balanced(
+				word_layers,
+				num_rows,
+			)
+		self._place_words(word_layers_by_row)
+
+	def _find_num_rows(self, word_layers, start, stop):
+		"""Find the smallest number of rows of one parity that words fit in.
+
+		The block rows for n + 2 rows are the block rows for n rows with an
+		extra row added at each end, and adding rows can never stop the words
+		fitting. So whether the words fit is monotonic in the number of rows
+		of a given parity, and we can gallop out from start until the words
+		fit and then bisect back, rather than trying every number of rows.
+
+		Args:
+			word_layers (list(WordLayer)): list of WordLayer objects
+				representing text to add.
+			start (int): smallest number of rows to try.
+			stop (int): number of rows to stop before.
+
+		Returns:
+			tuple(int, dict(BlockRow, list(WordLayer))) or None: the smallest
+				number of rows in range(start, stop, 2) that the words fit
+				in and the grouping of words by row, or None if they don't
+				fit in any of them.
+		"""
+		block_rows = (
+			self.even_block_rows if start % 2 == 0 else self.odd_block_rows
+		)
+		candidates = range(start, min(stop, len(block_rows) + 1), 2)
+		if not candidates:
+			return None
+		failed_index = -1
+		index = 0
+		step = 1
+		while True:
+			word_layers_by_row = self._fit_words(word_layers, candidates[index])
+			if word_layers_by_row is not None:
+				break
+			failed_index = index
+			if index == len(candidates) - 1:
+				return None
+			index = min(index + step, len(candidates) - 1)
+			step *= 2
+		while index - failed_index > 1:
+			middle_index = (failed_index + index) // 2
+			middle_fit = self._fit_words(word_layers, candidates[middle_index])
+			if middle_fit is None:
+				failed_index = middle_index
+			else:
+				index = middle_index
+				word_layers_by_row = middle_fit
+		return candidates[index], word_layers_by_row
+
+	def _fit_words(self, word_layers, num_rows):
+		"""Greedily fit words into the given number of block rows.
+
+		Args:
+			word_layers (list(WordLayer)): list of WordLayer objects
+				representing text to add.
+			num_rows (int): number of block rows to use.
+
+		Returns:
+			dict(BlockRow, list(WordLayer)) or None: dictionary of word layers
+				keyed by the block row they should be added to, or None if the
+				words don't fit in the given number of rows.
+		"""
+		block_row_generator = self._get_block_rows(num_rows)
+		block_row = next(block_row_generator)
+		word_layers_by_row = {}
+		cumulative_word_width = 0
+		for word_layer in word_layers:
+			cumulative_word_width += word_layer.width
+			while cumulative_word_width > block_row.width:
+				try:
+					block_row = next(block_row_generator)
+					cumulative_word_width = word_layer.width
+				except StopIteration:
+					# reached end of generator so words don't fit
+					return None
+			word_layers_by_row.setdefault(block_row, []).append(word_layer)
+			cumulative_word_width += self.space_width
+		return word_layers_by_row
+
+	def _fit_words_balanced(self, word_layers, num_rows):
+		"""Fit words into the given number of block rows as evenly as possible.
+
+		This is a Knuth-Plass style line breaker: the raggedness of a row is
+		the square of its unused width, and dynamic programming over the rows
+		finds the breaks with the smallest total raggedness. Rows can be left
+		empty, but cost their whole width squared. Line widths come from
+		prefix sums of the word widths, and the search back from each break
+		stops as soon as the line is too wide, so this takes time
+		proportional to the number of words times the number of rows times
+		the number of words that fit on a row.
+
+		Args:
+			word_layers (list(WordLayer)): list of WordLayer objects
+				representing text to add.
+			num_rows (int): number of block rows to use.
+
+		Returns:
+			dict(BlockRow, list(WordLayer)) or None: dictionary of word layers
+				keyed by the block row they should be added to, or None if the
+				words don't fit in the given number of rows.
+		"""
+		block_rows = list(self._get_block_rows(num_rows))
+		num_words = len(word_layers)
+		prefix_widths = [0]
+		for word_layer in word_layers:
+			prefix_widths.append(prefix_widths[-1] + word_layer.width)
+
+		# costs[i] is the least raggedness of fitting the first i words
+		# into the rows so far, and row_starts[r][i] is the index of the
+		# first word in row r when row r ends with the first i words
+		infinity = float("inf")
+		costs = [0] + [infinity] * num_words
+		row_starts = []
+		for block_row in block_rows:
+			new_costs = [infinity] * (num_words + 1)
+			starts = list(range(num_words + 1))
+			for end in range(num_words + 1):
+				new_costs[end] = costs[end] + block_row.width ** 2
+				for start in range(end - 1, -1, -1):
+					line_width = (
+						prefix_widths[end] - prefix_widths[start]
+						+ self.space_width * (end - start - 1)
+					)
+					if line_width > block_row.width:
+						break
+					cost = costs[start] + (block_row.width - line_width) ** 2
+					if cost < new_costs[end]:
+						new_costs[end] = cost
+						starts[end] = start
+			costs = new_costs
+			row_starts.append(starts)
+		if costs[num_words] == infinity:
+			return None
+
+		word_layers_by_row = {}
+		end = num_words
+		for block_row, starts in reversed(list(zip(block_rows, row_starts))):
+			start = starts[end]
+			if end > start:
+				word_layers_by_row[block_row] = word_layers[start:end]
+			end = start
+		return word_layers_by_row
+
+	def _place_words(self, word_layers_by_row):
+		"""Place words in selection using given grouping of words with rows.
+
+		This is used by place_words method and it assumes that we already know
+		the word_layers will fit in the given rows.
+
+		Args:
+			word_layers_by_row (dict(BlockRow, WordLayer)): dictionary of word
+				layers keyed by the block row they should be added to.
+		"""
+		for block_row, word_layers in word_layers_by_row.items():
+			total_word_width = sum(
+				word_layer.width for word_layer in word_layers
+			)
+			text_start = block_row.left + 0.5 * int(
+				math.floor((block_row.width - total_word_width))
+			)
+			for word_layer in word_layers:
+				word_layer.move_to(text_start, block_row.top)
+				text_start += word_layer.width + self.space_width
+
+	def _get_min_num_rows(self, word_layers):
+		"""Get minimum number of block rows needed to add text.
+
+		This returns the smallest number of rows that could possibly be needed
+		to cover all the text, so that we're not recalculating the text
+		positions too many times. We get this value by comparing the total
+		width of all the text in the word_layers to the cumulative width of the
+		row blocks that will be used.
+
+		Args:
+			word_layers (list(WordLayer)): list of WordLayer objects
+				representing text to add.
+
+		Returns:
+			int or None: minimum number of rows required, or None if the text
+				will not fit in this selection.
+		"""
+		total_word_width = sum(word_layer.width for word_layer in word_layers)
+		cumulative_even_row_width = 0
+		cumulative_odd_row_width = 0
+		min_num_rows_even = None
+		min_num_rows_odd = None
+		for index, row in enumerate(self.even_block_rows):
+			cumulative_even_row_width += row.width
+			if cumulative_even_row_width >= total_word_width:
+				min_num_rows_even = index + 1 if index % 2 == 0 else index + 2
+				break
+		for index, row in enumerate(self.odd_block_rows):
+			cumulative_odd_row_width += row.width
+			if cumulative_odd_row_width >= total_word_width:
+				min_num_rows_odd = index + 1 if index % 2 == 1 else index + 2
+				break
+		if min_num_rows_even is None:
+			return min_num_rows_odd
+		if min_num_rows_odd is None:
+			return min_num_rows_even
+		return min(min_num_rows_odd, min_num_rows_even)
+
+	def _get_block_rows(self, n):
+		"""Yields the first n block rows, from top downwards.
+
+		If n is odd this will return the first n rows from self.odd_block_rows,
+		Otherwise, this will return the first n rows from self.even_block_rows.
+		In either case, it reorders the rows from top downwards.
+
+		Args:
+			n (int): number of rows we want to get.
+
+		Yields:
+			BlockRow: list of the first n BlockRow objects.
+		"""
+		block_rows = self.even_block_rows if n % 2 == 0 else self.odd_block_rows
+		num_steps = int(0.5 * n)
+		for i in range(num_steps):
+			yield block_rows[n - 2*i - 2]
+		if n % 2 == 1:
+			yield block_rows[0]
+		for i in reversed(range(num_steps)):
+			yield block_rows[n - 2*i - 1]
+
+
+# Functions
+def measure_words(words, font, text_size, text_extents_cache):
+	"""Create word layers for the given words from their measured sizes.
+
+	Args:
+		words (list(str)): words to measure.
+		font (str): name of font.
+		text_size (int): size of text, in pixels.
+		text_extents_cache (TextExtentsCache): object to measure words with,
+			using its get_extents(font, text_size, word) method.
+
+	Returns:
+		list(WordLayer): word layers for the words, with no gimp layers yet.
+	"""
+	word_layers = []
+	for word in words:
+		width, height = text_extents_cache.get_extents(font, text_size, word)
+		word_layers.append(WordLayer(word, width, height))
+	return word_layers
+
+
+def fit_text_size(
+		speech_bubble,
+		words,
+		font,
+		max_text_size,
+		space_width,
+		text_extents_cache,
+		balanced=False,
+		):
+	"""Find the largest text size that the words fit in the speech bubble.
+
+	This bisects over text size, reusing the speech bubble's pixel row
+	bounds for each size tried, with the space width scaled in proportion
+	to the text size.
+
+	Args:
+		speech_bubble (SpeechBubble): the speech bubble to fit words in.
+		words (list(str)): words to fit.
+		font (str): name of font.
+		max_text_size (int): largest text size to try, in pixels.
+		space_width (int): width of spaces at the maximum text size.
+		text_extents_cache (TextExtentsCache): object to measure words with,
+			using its get_extents(font, text_size, word) method.
+		balanced (bool): if True, balance the lengths of the rows of words.
+
+	Returns:
+		tuple(int, list(WordLayer)): the text size found and the placed word
+			layers for that size.
+	"""
+	def place_words_at_size(text_size):
+		word_layers = measure_words(words, font, text_size, text_extents_cache)
+		speech_bubble.set_row_height(
+			max(word_layer.height for word_layer in word_layers)
+		)
+		speech_bubble.space_width = int(
+			round(space_width * float(text_size) / max_text_size)
+		)
+		try:
+			speech_bubble.place_words(word_layers, balanced)
+		except SelectionSizeError:
+			return None
+		return word_layers
+
+	word_layers = place_words_at_size(max_text_size)
+	if word_layers is not None:
+		return max_text_size, word_layers
+	fitting_size = None
+	fitting_word_layers = None
+	low = 0
+	high = max_text_size
+	while high - low > 1:
+		text_size = (low + high) // 2
+		word_layers = place_words_at_size(text_size)
+		if word_layers is None:
+			high = text_size
+		else:
+			low = text_size
+			fitting_size = text_size
+			fitting_word_layers = word_layers
+	if fitting_word_layers is None:
+		raise SelectionSizeError()
+	return fitting_size, fitting_word_layers
+
+
+def layout_text(
+		selection,
+		bounds,
+		text,
+		font,
+		text_size,
+		space_width,
+		horizontal_offset,
+		vertical_offset,
+		auto_size,
+		balanced_lines,
+		text_extents_cache,
+		scan_mode=FULL_SCAN,
+		):
+	"""Lay out the words of some text in a speech bubble.
+
+	Words are laid out using their measured sizes, so that text layers only
+	need to be created once we know the words fit.
+
+	Args:
+		selection (gimp.Channel or SelectionSpans): selection channel, or a
+			stand-in for one, that is non-empty over the speech bubble, or
+			the spans of the speech bubble, eg. from a path.
+		bounds (tuple(int, int, int, int)): x_min, y_min, x_max and y_max
+			bounds of the speech bubble.
+		text (str): text to lay out.
+		font (str): name of font.
+		text_size (int): size of text, in pixels, or the maximum size if
+			auto_size is True.
+		space_width (int): width of spaces between words, in pixels.
+		horizontal_offset (int): horizontal gap to leave inside selection.
+		vertical_offset (int): vertical gap to leave inside selection.
+		auto_size (bool): if True, use the largest text size that fits.
+		balanced_lines (bool): if True, balance the lengths of the rows.
+		text_extents_cache (TextExtentsCache): object to measure words with,
+			using its get_extents(font, text_size, word) method.
+		scan_mode (int): index of the way to find the selected spans of the
+			speech bubble, from SCAN_MODES.
+
+	Returns:
+		tuple(list(WordLayer), int): the placed word layers and the text size
+			used.
+	"""
+	x_min, y_min, x_max, y_max = bounds
+	words = text.split()
+	word_layers = measure_words(words, font, text_size, text_extents_cache)
+	row_height = max(word_layer.height for word_layer in word_layers)
+	speech_bubble = SpeechBubble(
+		selection,
+		x_min,
+		y_min,
+		x_max,
+		y_max,
+		row_height,
+		space_width,
+		horizontal_offset,
+		vertical_offset,
+		scan_mode,
+	)
+	if auto_size:
+		# treat text size as maximum and find largest size that fits
+		text_size, word_layers = fit_text_size(
+			speech_bubble,
+			words,
+			font,
+			text_size,
+			space_width,
+			text_extents_cache,
+			balanced_lines,
+		)
+	else:
+		speech_bubble.place_words(word_layers, balanced_lines)
+	return word_layers, text_size
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Thresholding and ink separation of pixels for the Isolate Outlines and
+# Isolate Inks plugins. These work on numpy arrays of pixels and don't import
+# gimp, so they can be run and tested in plain python.
+
+
+# Functions
+def parse_thresholds(text):
+    """Parse a list of thresholds.
+
+    Args:
+        text (str): thresholds separated by commas or spaces, eg. "0.5, 0.6".
+
+    Returns:
+        list(float): the thresholds.
+    """
+    return [float(value) for value in text.replace(",", " ").split()]
+
+
+def get_outline_alpha(distances, alpha, threshold):
+    """Get the alpha of outline pixels from their distance to black.
+
+    Pixels within the threshold keep their alpha and others are transparent.
+
+    Args:
+        distances (numpy.ndarray): height x width uint8 array of each pixel's
+            distance to black, or to an ink.
+        alpha (numpy.ndarray or None): height x width uint8 array of the
+            alpha of each pixel, or None if the pixels are opaque.
+        threshold (float): largest distance to keep, from 0 to 1.
+
+    Returns:
+        numpy.ndarray: height x width uint8 array of the outline alpha.
+    """
+    is_outline = distances <= threshold * 255
+    if alpha is None:
+        return is_outline * numpy.uint8(255)
+    return numpy.where(is_outline, alpha, 0).astype(numpy.uint8)
+
+
+def unmix_from_white(colors, alpha=None):
+    """Split pixels into a color and its coverage, as if painted over white.
+
+    The anti-aliased edges of lines are the color of the line partly
+    covering white paper, so each pixel is split into the strongest color
+    that gives it when painted over white, and that color's coverage, as
+    gimp's Color to Alpha does. The result looks the same as the pixels
+    over white, and doesn't leave light fringes over other colors.
+
+    Args:
+        colors (numpy.ndarray): height x width x colors uint8 array of the
+            color channels of the pixels.
+        alpha (numpy.ndarray or None): height x width uint8 array of the
+            alpha of each pixel, or None if the pixels are opaque.
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray): height x width x colors uint8
+            array of the un-mixed colors, and height x width uint8 array of
+            their alpha.
+    """
+    lightness = 255 - colors.astype(numpy.float32)
+    coverage = lightness.max(axis=2) / 255
+    unmixed_colors = 255 - lightness / numpy.where(
+        coverage > 0,
+        coverage,
+        1,
+    )[:, :, numpy.newaxis]
+    coverage *= 255 if alpha is None else alpha
+    return (
+        (numpy.clip(unmixed_colors, 0, 255) + 0.5).astype(numpy.uint8),
+        (coverage + 0.5).astype(numpy.uint8),
+    )
+
+
+def threshold_outlines(pixels, thresholds, soft_edges=False):
+    """Keep the pixels of an image that are close to black.
+
+    A pixel's distance to black is the largest of its color channels, as
+    when selecting black by color, so pixels are kept if none of their color
+    channels are above the threshold. Distances are found once and shared
+    between thresholds.
+
+    Args:
+        pixels (numpy.ndarray): height x width x channels uint8 array, with
+            channels being gray, gray and alpha, rgb or rgba.
+        thresholds (list(float)): largest distances to black to keep, from 0
+            to 1.
+        soft_edges (bool): if True, give kept pixels their color and
+            coverage un-mixed from white, see unmix_from_white, rather than
+            their own color at full alpha.
+
+    Returns:
+        list(numpy.ndarray): for each threshold, height x width x channels
+            uint8 array of the pixels with an alpha channel added if there
+            wasn't one, which is transparent where pixels weren't kept.
+    """
+    num_channels = pixels.shape[2]
+    has_alpha = num_channels in (2, 4)
+    num_colors = num_channels - 1 if has_alpha else num_channels
+    colors = pixels[:, :, :num_colors]
+    distances = colors.max(axis=2)
+    alpha = pixels[:, :, -1] if has_alpha else None
+    if soft_edges:
+        colors, alpha = unmix_from_white(colors, alpha)
+    all_outlines = []
+    for threshold in thresholds:
+        outlines = numpy.empty(
+            pixels.shape[:2] + (num_colors + 1,),
+            dtype=numpy.uint8,
+        )
+        outlines[:, :, :num_colors] = colors
+        outlines[:, :, -1] = get_outline_alpha(distances, alpha, threshold)
+        all_outlines.append(outlines)
+    return all_outlines
+
+
+def parse_inks(text):
+    """Parse a list of ink colors and thresholds.
+
+    Args:
+        text (str): inks separated by commas or spaces, each being a hex
+            color and a threshold separated by a colon, eg.
+            "#000000:0.7, #1a237e:0.3".
+
+    Returns:
+        list(tuple(tuple(int, int, int), float)): the red, green and blue
+            values of each ink from 0 to 255, and its threshold.
+    """
+    inks = []
+    for ink in text.replace(",", " ").split():
+        color, separator, threshold = ink.partition(":")
+        color = color.lstrip("#")
+        if not separator or len(color) != 6:
+            raise ValueError(
+                "Ink {0} isn't a hex color and threshold, eg. "
+                "#1a237e:0.3.".format(ink)
+            )
+        inks.append((
+            tuple(int(color[i:i + 2], 16) for i in (0, 2, 4)),
+            float(threshold),
+        ))
+    if not inks:
+        raise ValueError("No inks given.")
+    return inks
+
+
+def get_ink_channels(color, num_colors):
+    """Get the color channels of an ink to compare pixels against.
+
+    Args:
+        color (tuple(int, int, int)): red, green and blue values of ink.
+        num_colors (int): number of color channels of the pixels, 1 for gray
+            or 3 for rgb.
+
+    Returns:
+        numpy.ndarray: int16 array of the ink's color channels, using its
+            luminance for gray pixels.
+    """
+    if num_colors == 1:
+        red, green, blue = color
+        color = (int(round(0.2126 * red + 0.7152 * green + 0.0722 * blue)),)
+    return numpy.array(color, dtype=numpy.int16)
+
+
+def separate_inks(pixels, inks, soft_edges=False):
+    """Separate the pixels of an image by the ink that they are closest to.
+
+    A pixel's distance to an ink is the largest difference between their
+    color channels, as when selecting by color. Each pixel belongs to its
+    nearest ink, or the first listed of equally near inks, if it is within
+    that ink's threshold.
+
+    Args:
+        pixels (numpy.ndarray): height x width x channels uint8 array, with
+            channels being gray, gray and alpha, rgb or rgba.
+        inks (list(tuple(tuple(int, int, int), float))): color and threshold
+            of each ink, see parse_inks.
+        soft_edges (bool): if True, give pixels their color and coverage
+            un-mixed from white, see unmix_from_white, rather than their own
+            color at full alpha.
+
+    Returns:
+        list(numpy.ndarray): for each ink, height x width x channels uint8
+            array of the pixels with an alpha channel added if there wasn't
+            one, which is transparent where pixels don't belong to the ink.
+    """
+    num_channels = pixels.shape[2]
+    has_alpha = num_channels in (2, 4)
+    num_colors = num_channels - 1 if has_alpha else num_channels
+    colors = pixels[:, :, :num_colors]
+    signed_colors = colors.astype(numpy.int16)
+    distances = numpy.array([
+        numpy.abs(
+            signed_colors - get_ink_channels(color, num_colors)
+        ).max(axis=2)
+        for color, _ in inks
+    ], dtype=numpy.uint8)
+    nearest_inks = distances.argmin(axis=0)
+    alpha = pixels[:, :, -1] if has_alpha else None
+    if soft_edges:
+        colors, alpha = unmix_from_white(colors, alpha)
+    all_inks = []
+    for index, (_, threshold) in enumerate(inks):
+        ink_pixels = numpy.empty(
+            pixels.shape[:2] + (num_colors + 1,),
+            dtype=numpy.uint8,
+        )
+        ink_pixels[:, :, :num_colors] = colors
+        ink_alpha = get_outline_alpha(distances[index], alpha, threshold)
+        ink_alpha[nearest_inks != index] = 0
+        ink_pixels[:, :, -1] = ink_alpha
+        all_inks.append(ink_pixels)
+    return all_inks
@@ -1,31 +1,555 @@
-
 #!/usr/bin/env python
 
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from gimpfu import *
 import gimpcolor
 import gimpenums
 
+from ink_separation import (
+    parse_inks,
+    parse_thresholds,
+    separate_inks,
+    threshold_outlines,
+)
+
+
+ENGINES = ("Selection", "NumPy", "NumPy (Strips)", "NumPy (Threaded Strips)")
+SELECTION_ENGINE = 0
+NUMPY_ENGINE = 1
+NUMPY_STRIPS_ENGINE = 2
+NUMPY_THREADED_ENGINE = 3
+
+
+# Functions
+def can_use_numpy(tdrawable):
+    """Check if the drawable's pixels can be thresholded with numpy.
+
+    Args:
+        tdrawable (gimp.Drawable): drawable to isolate outlines of.
+
+    Returns:
+        bool: whether numpy is available and the drawable is an 8 bit gray or
+            rgb layer, with or without alpha.
+    """
+    if numpy is None or not pdb.gimp_item_is_layer(tdrawable):
+        return False
+    if pdb.gimp_drawable_is_indexed(tdrawable):
+        return False
+    num_channels = 3 if pdb.gimp_drawable_is_rgb(tdrawable) else 1
+    if pdb.gimp_drawable_has_alpha(tdrawable):
+        num_channels += 1
+    # pixel regions of high bit depth images have more bytes per pixel
+    return tdrawable.bpp == num_channels
+
+
+def get_strips(height, strip_height):
+    """Split rows of a drawable into strips.
+
+    Args:
+        height (int): height of drawable.
+        strip_height (int): height of each strip, except maybe the last.
+
+    Yields:
+        tuple(int, int): the first row and the exclusive last row of each
+            strip, from top to bottom.
+    """
+    for y_min in range(0, height, strip_height):
+        yield y_min, min(y_min + strip_height, height)
+
+
+def read_pixels(tdrawable, y_min, y_max):
+    """Read a strip of the pixels of a drawable in a single region fetch.
+
+    Args:
+        tdrawable (gimp.Drawable): drawable to read.
+        y_min (int): first row to read.
+        y_max (int): row after the last row to read.
+
+    Returns:
+        numpy.ndarray: height x width x channels uint8 array of the pixels.
+    """
+    width = tdrawable.width
+    region = tdrawable.get_pixel_rgn(
+        0,
+        y_min,
+        width,
+        y_max - y_min,
+        False,
+        False,
+    )
+    return numpy.frombuffer(
+        region[0:width, y_min:y_max],
+        dtype=numpy.uint8,
+    ).reshape(y_max - y_min, width, region.bpp)
+
+
+def map_strips(tdrawable, function, strip_height, num_threads=1):
+    """Apply a function to each strip of a drawable's pixels.
+
+    Strips are always read in this thread, since gimp's pixel regions can't
+    be used from several threads at once. With more than one thread, the
+    function is applied to strips in a thread pool while later strips are
+    read, which speeds up numpy functions as they release the GIL. A few
+    strips per thread are read ahead, to bound the memory used.
+
+    Args:
+        tdrawable (gimp.Drawable): drawable to read.
+        function (callable): function to apply to the height x width x
+            channels uint8 array of each strip.
+        strip_height (int): height of strips.
+        num_threads (int): number of threads to apply the function in.
+
+    Yields:
+        tuple(int, object): the first row of each strip and the result of
+            the function for it, from top to bottom.
+    """
+    strips = get_strips(tdrawable.height, strip_height)
+    if num_threads <= 1:
+        for y_min, y_max in strips:
+            yield y_min, function(read_pixels(tdrawable, y_min, y_max))
+        return
+    pool = ThreadPool(num_threads)
+    try:
+        pending_results = collections.deque()
+        for y_min, y_max in strips:
+            pending_results.append((
+                y_min,
+                pool.apply_async(
+                    function,
+                    (read_pixels(tdrawable, y_min, y_max),),
+                ),
+            ))
+            if len(pending_results) >= 2 * num_threads:
+                y_min, result = pending_results.popleft()
+                yield y_min, result.get()
+        while pending_results:
+            y_min, result = pending_results.popleft()
+            yield y_min, result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def set_tile_cache(tdrawable, strip_height):
+    """Set gimp's tile cache to hold one strip of a drawable and its output.
+
+    This means each tile is only fetched from gimp's tile manager once when
+    reading and writing a strip at a time.
+
+    Args:
+        tdrawable (gimp.Drawable): drawable that will be read in strips.
+        strip_height (int): height of strips.
+    """
+    tile_width = gimp.tile_width()
+    tile_height = gimp.tile_height()
+    gimp.tile_cache_ntiles(
+        2
+        * ((tdrawable.width + tile_width - 1) // tile_width)
+        * ((strip_height + tile_height - 1) // tile_height)
+    )
+
+
+def new_outline_layer(timg, tdrawable, name):
+    """Create a transparent layer to write outlines of the drawable to.
+
+    The layer isn't added to the image, see add_outline_layer.
+
+    Args:
+        timg (gimp.Image): image to create layer for.
+        tdrawable (gimp.Drawable): drawable to isolate outlines of.
+        name (str): name of layer.
+
+    Returns:
+        gimp.Layer: the new layer, the same size as the drawable and with an
+            alpha channel.
+    """
+    if pdb.gimp_drawable_is_rgb(tdrawable):
+        layer_type = gimpenums.RGBA_IMAGE
+    else:
+        layer_type = gimpenums.GRAYA_IMAGE
+    return pdb.gimp_layer_new(
+        timg,
+        tdrawable.width,
+        tdrawable.height,
+        layer_type,
+        name,
+        100,
+        gimpenums.NORMAL_MODE,
+    )
+
+
+def write_pixels(layer, pixels, y_min):
+    """Write a strip of pixels to a layer.
+
+    Args:
+        layer (gimp.Layer): layer to write to.
+        pixels (numpy.ndarray): height x width x channels uint8 array, the
+            full width of the layer.
+        y_min (int): row of layer to write the first row of pixels to.
+    """
+    height, width = pixels.shape[:2]
+    region = layer.get_pixel_rgn(0, y_min, width, height, True, False)
+    region[0:width, y_min:y_min + height] = (
+        numpy.ascontiguousarray(pixels).tobytes()
+    )
+
+
+def add_outline_layer(timg, tdrawable, layer):
+    """Add a layer that outlines were written to above the drawable.
+
+    Args:
+        timg (gimp.Image): image to add layer to.
+        tdrawable (gimp.Drawable): drawable that the outlines came from.
+        layer (gimp.Layer): the layer of outlines.
+    """
+    layer.flush()
+    layer.set_offsets(*tdrawable.offsets)
+    pdb.gimp_image_insert_layer(
+        timg,
+        layer,
+        pdb.gimp_item_get_parent(tdrawable),
+        pdb.gimp_image_get_item_position(timg, tdrawable),
+    )
+    layer.update(0, 0, layer.width, layer.height)
+
+
+def get_outline_layer_name(threshold, thresholds):
+    """Get name of the layer of outlines for a threshold.
+
+    Args:
+        threshold (float): the threshold.
+        thresholds (list(float)): all thresholds that layers are made for.
+
+    Returns:
+        str: the layer name, which includes the threshold if there are
+            several layers.
+    """
+    if len(thresholds) == 1:
+        return "Outlines"
+    return "Outlines {0:g}".format(threshold)
+
+
+def get_ink_layer_name(color):
+    """Get name of the layer of an ink.
+
+    Args:
+        color (tuple(int, int, int)): red, green and blue values of ink.
+
+    Returns:
+        str: the layer name.
+    """
+    return "Ink #{0:02x}{1:02x}{2:02x}".format(*color)
+
+
+def create_outline_layers(
+        timg,
+        tdrawable,
+        get_outlines,
+        names,
+        strip_height=None,
+        num_threads=1,
+        ):
+    """Create layers from the drawable's pixels, reading them only once.
 
-# Main function
-def isolate_outlines(timg, tdrawable, threshold):
+    The drawable is read and the layers written a strip at a time if a strip
+    height is given, so memory use is proportional to the strip size rather
+    than the image size. Strips are written in order by this thread, while
+    other threads can process later strips.
+
+    Args:
+        timg (gimp.Image): image to add layers to.
+        tdrawable (gimp.Drawable): drawable to read.
+        get_outlines (callable): function that takes the height x width x
+            channels uint8 array of a strip, and returns a list of arrays of
+            that strip for each layer, with an alpha channel.
+        names (list(str)): names of the layers.
+        strip_height (int or None): height of strips to process, or None to
+            process the whole drawable at once.
+        num_threads (int): number of threads to process strips in.
+
+    Returns:
+        list(gimp.Layer): the layers, added above the drawable with the first
+            layer on top.
+    """
+    if strip_height is None:
+        strip_height = tdrawable.height
+    else:
+        set_tile_cache(tdrawable, strip_height)
+    layers = [new_outline_layer(timg, tdrawable, name) for name in names]
+    for y_min, all_outlines in map_strips(
+            tdrawable,
+            get_outlines,
+            strip_height,
+            num_threads):
+        for layer, outlines in zip(layers, all_outlines):
+            write_pixels(layer, outlines, y_min)
+    # layers are added above the drawable, so add the first layer last
+    for layer in reversed(layers):
+        add_outline_layer(timg, tdrawable, layer)
+    return layers
+
+
+def select_and_paste(timg, tdrawable, color, threshold, name=None):
+    """Select a color and paste it as a new layer.
+
+    Args:
+        timg (gimp.Image): image to select in.
+        tdrawable (gimp.Drawable): drawable to select color of.
+        color (gimpcolor.RGB): color to select.
+        threshold (float): sample threshold to select color with.
+        name (str or None): name to give new layer, if any.
+
+    Returns:
+        gimp.Layer: the new layer, added above the drawable.
+    """
     pdb.gimp_context_set_sample_threshold(threshold)
     pdb.gimp_image_select_color(
         timg,
         gimpenums.CHANNEL_OP_REPLACE,
         tdrawable,
-        gimpcolor.RGB(0, 0, 0)
+        color
     )
 
     pdb.gimp_edit_copy(tdrawable)
     floating_layer = pdb.gimp_edit_paste(tdrawable, False)
     pdb.gimp_floating_sel_to_layer(floating_layer)
+    if name is not None:
+        floating_layer.name = name
+    return floating_layer
+
+
+def isolate_outlines_with_selection(timg, tdrawable, thresholds):
+    """Isolate outlines by selecting black and pasting it as a new layer.
+
+    Args:
+        timg (gimp.Image): image to isolate outlines of.
+        tdrawable (gimp.Drawable): drawable to isolate outlines of.
+        thresholds (list(float)): sample thresholds to select black with,
+            pasting one layer for each. The first threshold's layer is on
+            top and visible, and the others are hidden below it to compare
+            against.
+
+    Returns:
+        list(gimp.Layer): the layer of outlines for each threshold.
+    """
+    layers = [
+        select_and_paste(
+            timg,
+            tdrawable,
+            gimpcolor.RGB(0, 0, 0),
+            threshold,
+            None if len(thresholds) == 1 else
+            get_outline_layer_name(threshold, thresholds),
+        )
+        for threshold in thresholds
+    ]
+    for layer in layers[1:]:
+        layer.visible = False
+    return layers
+
+
+def isolate_outlines_with_numpy(
+        timg,
+        tdrawable,
+        thresholds,
+        soft_edges=False,
+        strip_height=None,
+        num_threads=1,
+        ):
+    """Isolate outlines by thresholding the drawable's pixels with numpy.
+
+    This reads the drawable once and writes the pixels close to black
+    straight to a new layer for each threshold, leaving the selection and
+    clipboard alone.
+
+    Args:
+        timg (gimp.Image): image to isolate outlines of.
+        tdrawable (gimp.Drawable): drawable to isolate outlines of.
+        thresholds (list(float)): largest distances to black to keep, from 0
+            to 1. The first threshold's layer is on top and visible, and the
+            others are hidden below it to compare against.
+        soft_edges (bool): if True, give kept pixels their color and
+            coverage un-mixed from white, rather than full alpha.
+        strip_height (int or None): height of strips to process, or None to
+            process the whole drawable at once.
+        num_threads (int): number of threads to threshold strips in.
+
+    Returns:
+        list(gimp.Layer): the layer of outlines for each threshold.
+    """
+    layers = create_outline_layers(
+        timg,
+        tdrawable,
+        lambda pixels: threshold_outlines(pixels, thresholds, soft_edges),
+        [
+            get_outline_layer_name(threshold, thresholds)
+            for threshold in thresholds
+        ],
+        strip_height,
+        num_threads,
+    )
+    for layer in layers[1:]:
+        layer.visible = False
+    return layers
+
+
+def isolate_inks_with_selection(timg, tdrawable, inks):
+    """Isolate each ink by selecting its color and pasting it as a new layer.
+
+    Pixels that are within the threshold of several inks are pasted to each
+    of their layers.
+
+    Args:
+        timg (gimp.Image): image to isolate inks of.
+        tdrawable (gimp.Drawable): drawable to isolate inks of.
+        inks (list(tuple(tuple(int, int, int), float))): color and threshold
+            of each ink, see parse_inks.
+    """
+    for color, threshold in inks:
+        select_and_paste(
+            timg,
+            tdrawable,
+            gimpcolor.RGB(*color),
+            threshold,
+            get_ink_layer_name(color),
+        )
+
+
+def isolate_inks_with_numpy(
+        timg,
+        tdrawable,
+        inks,
+        soft_edges=False,
+        strip_height=None,
+        num_threads=1,
+        ):
+    """Separate the drawable's pixels into a layer for each ink with numpy.
 
+    Args:
+        timg (gimp.Image): image to isolate inks of.
+        tdrawable (gimp.Drawable): drawable to isolate inks of.
+        inks (list(tuple(tuple(int, int, int), float))): color and threshold
+            of each ink, see parse_inks.
+        soft_edges (bool): if True, give pixels their color and coverage
+            un-mixed from white, rather than full alpha.
+        strip_height (int or None): height of strips to process, or None to
+            process the whole drawable at once.
+        num_threads (int): number of threads to process strips in.
 
-# Register function
+    Returns:
+        list(gimp.Layer): the layer of each ink.
+    """
+    return create_outline_layers(
+        timg,
+        tdrawable,
+        lambda pixels: separate_inks(pixels, inks, soft_edges),
+        [get_ink_layer_name(color) for color, _ in inks],
+        strip_height,
+        num_threads,
+    )
+
+
+def get_strip_options(engine, strip_height, num_threads):
+    """Get strip height and number of threads to use for a numpy engine.
+
+    Args:
+        engine (int): index of engine from ENGINES.
+        strip_height (int): strip height parameter, 0 for gimp's tile height.
+        num_threads (int): threads parameter, 0 for one per cpu.
+
+    Returns:
+        tuple(int or None, int): the strip height, or None to process the
+            whole drawable at once, and the number of threads.
+    """
+    if engine == NUMPY_ENGINE:
+        return None, 1
+    strip_height = strip_height or gimp.tile_height()
+    if engine == NUMPY_THREADED_ENGINE:
+        return strip_height, num_threads or multiprocessing.cpu_count()
+    return strip_height, 1
+
+
+# Main functions
+def isolate_outlines(
+        timg,
+        tdrawable,
+        threshold,
+        engine,
+        strip_height,
+        num_threads,
+        soft_edges,
+        preview_thresholds,
+        ):
+    thresholds = [threshold] + [
+        preview_threshold
+        for preview_threshold in parse_thresholds(preview_thresholds)
+        if preview_threshold != threshold
+    ]
+    # the numpy engines can't read indexed or high bit depth pixels, so
+    # those fall back to selecting by color, which only has hard edges
+    if engine == SELECTION_ENGINE or not can_use_numpy(tdrawable):
+        isolate_outlines_with_selection(timg, tdrawable, thresholds)
+    else:
+        isolate_outlines_with_numpy(
+            timg,
+            tdrawable,
+            thresholds,
+            soft_edges,
+            *get_strip_options(engine, strip_height, num_threads)
+        )
+
+
+def isolate_inks(
+        timg,
+        tdrawable,
+        inks,
+        engine,
+        strip_height,
+        num_threads,
+        soft_edges,
+        ):
+    inks = parse_inks(inks)
+    # selecting by color can't pick each pixel's nearest ink, so pixels
+    # close to several inks end up in several layers with that fallback
+    if engine == SELECTION_ENGINE or not can_use_numpy(tdrawable):
+        isolate_inks_with_selection(timg, tdrawable, inks)
+    else:
+        isolate_inks_with_numpy(
+            timg,
+            tdrawable,
+            inks,
+            soft_edges,
+            *get_strip_options(engine, strip_height, num_threads)
+        )
+
+
+# Register functions
 register(
 	"python_fu_isolate_outlines",
 	"Isolate black outlines and paste to new layer",
-	"Isolate black outlines and paste to new layer",
+	(
+        "Isolate black outlines and paste to new layer. The NumPy engine "
+        "reads the drawable once and writes the outlines straight to a new "
+        "layer, without changing the selection or clipboard. It falls back "
+        "to the Selection engine without numpy or for indexed or high bit "
+        "depth images. The NumPy (Strips) engine does the same a strip of "
+        "rows at a time, to bound memory use on huge scans. A strip height "
+        "of 0 uses gimp's tile height. The NumPy (Threaded Strips) engine "
+        "also thresholds strips in several threads, and 0 threads uses one "
+        "per cpu. With Soft Edges, the numpy engines give the anti-aliased "
+        "edges of outlines partial alpha rather than keeping their light "
+        "color at full alpha, so they don't leave a fringe over colors. "
+        "Preview thresholds, eg. \"0.5, 0.6\", add a hidden layer for each "
+        "threshold to compare against, from a single read of the drawable."
+    ),
     "Ben Carey",
     "Ben Carey",
     "2021",
@@ -33,9 +557,47 @@ register(
 	"*",
 	[
         (PF_FLOAT, "pf_threshold", "Threshold", 0.7),
+        (PF_OPTION, "pf_engine", "Engine", SELECTION_ENGINE, ENGINES),
+        (PF_INT, "pf_strip_height", "Strip Height (0 for tile height)", 0),
+        (PF_INT, "pf_num_threads", "Threads (0 for one per cpu)", 0),
+        (PF_TOGGLE, "pf_soft_edges", "Soft Edges", False),
+        (PF_STRING, "pf_preview_thresholds", "Preview Thresholds", ""),
     ],
 	[],
 	isolate_outlines
 )
 
+register(
+	"python_fu_isolate_inks",
+	"Separate lines of several ink colors into a layer for each ink",
+	(
+        "Separate lines of several ink colors into a layer for each ink. "
+        "Inks are given as hex colors and thresholds, eg. \"#000000:0.7, "
+        "#1a237e:0.3, #c62828:0.3\". The numpy engines read the drawable "
+        "once and put each pixel in the layer of its nearest ink, if it is "
+        "within that ink's threshold. The Selection engine, which they fall "
+        "back to without numpy or for indexed or high bit depth images, "
+        "selects each ink in turn, so pixels can be in several layers."
+    ),
+    "Ben Carey",
+    "Ben Carey",
+    "2021",
+	"<Image>/Tools/Custom/Isolate Inks",
+	"*",
+	[
+        (
+            PF_STRING,
+            "pf_inks",
+            "Inks (color:threshold)",
+            "#000000:0.7, #1a237e:0.3, #c62828:0.3",
+        ),
+        (PF_OPTION, "pf_engine", "Engine", NUMPY_ENGINE, ENGINES),
+        (PF_INT, "pf_strip_height", "Strip Height (0 for tile height)", 0),
+        (PF_INT, "pf_num_threads", "Threads (0 for one per cpu)", 0),
+        (PF_TOGGLE, "pf_soft_edges", "Soft Edges", False),
+    ],
+	[],
+	isolate_inks
+)
+
 main()
@@ -0,0 +1,380 @@
+import math
+import struct
+import zlib
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+# Layout backends
+#
+# The layout code in bubble_layout only needs three things from gimp:
+#	- a selection with get_pixel(x, y) and get_pixel_rgn(...), that can be
+#		sliced like a gimp.PixelRgn to read one byte per pixel.
+#	- something with a get_extents(font, text_size, word) method to measure
+#		words, such as speech_bubblifier.TextExtentsCache.
+#	- optionally, layers with offsets, width, height and translate(x, y),
+#		to move once words are placed.
+# In gimp these are the image's selection channel, the text extents cache
+# and text layers. The classes here are pure python stand-ins for them, so
+# that the same layout code can run without gimp, eg. for benchmarks and
+# regression tests against png masks.
+
+
+# Utils
+# maps mask values of at least 128 to selected (255), and others to 0
+THRESHOLD_TABLE = bytes(bytearray([0] * 128 + [255] * 128))
+
+
+def unfilter_png_rows(data, width, height, bpp):
+	"""Undo the filtering of the rows of decompressed png data.
+
+	Args:
+		data (str): decompressed png image data.
+		width (int): width of image in pixels.
+		height (int): height of image in pixels.
+		bpp (int): bytes per pixel.
+
+	Returns:
+		list(bytearray): the unfiltered pixel data of each row.
+	"""
+	stride = width * bpp
+	rows = []
+	previous_row = bytearray(stride)
+	offset = 0
+	for _ in range(height):
+		filter_type = bytearray(data[offset:offset + 1])[0]
+		row = bytearray(data[offset + 1:offset + 1 + stride])
+		offset += stride + 1
+		if filter_type == 1:
+			for i in range(bpp, stride):
+				row[i] = (row[i] + row[i - bpp]) & 0xff
+		elif filter_type == 2:
+			row = bytearray(
+				(value + above) & 0xff
+				for value, above in zip(row, previous_row)
+			)
+		elif filter_type == 3:
+			for i in range(stride):
+				left = row[i - bpp] if i >= bpp else 0
+				row[i] = (row[i] + ((left + previous_row[i]) >> 1)) & 0xff
+		elif filter_type == 4:
+			for i in range(stride):
+				left = row[i - bpp] if i >= bpp else 0
+				above = previous_row[i]
+				above_left = previous_row[i - bpp] if i >= bpp else 0
+				estimate = left + above - above_left
+				left_distance = abs(estimate - left)
+				above_distance = abs(estimate - above)
+				above_left_distance = abs(estimate - above_left)
+				if (left_distance <= above_distance
+						and left_distance <= above_left_distance):
+					predictor = left
+				elif above_distance <= above_left_distance:
+					predictor = above
+				else:
+					predictor = above_left
+				row[i] = (row[i] + predictor) & 0xff
+		rows.append(row)
+		previous_row = row
+	return rows
+
+
+def read_png_mask(file_path):
+	"""Read a png file as a selection mask.
+
+	Only 8 bit, non-interlaced gray, gray and alpha, rgb and rgba pngs are
+	supported. A pixel is selected if its first channel is at least 128,
+	and, for pngs with alpha, if its alpha is at least 128 too.
+
+	Args:
+		file_path (str): path to png file.
+
+	Returns:
+		tuple(str, int, int): the mask, with one byte per pixel that is 255
+			for selected pixels and 0 otherwise, and its width and height.
+	"""
+	with open(file_path, "rb") as file_:
+		data = file_.read()
+	if data[:8] != b"\x89PNG\r\n\x1a\n":
+		raise ValueError("{0} is not a png file.".format(file_path))
+	offset = 8
+	compressed_data = []
+	while offset < len(data):
+		length, chunk_type = struct.unpack(">I4s", data[offset:offset + 8])
+		chunk_data = data[offset + 8:offset + 8 + length]
+		offset += length + 12
+		if chunk_type == b"IHDR":
+			width, height, bit_depth, color_type, _, _, interlace = (
+				struct.unpack(">IIBBBBB", chunk_data)
+			)
+		elif chunk_type == b"IDAT":
+			compressed_data.append(chunk_data)
+		elif chunk_type == b"IEND":
+			break
+	bpp = {0: 1, 2: 3, 4: 2, 6: 4}.get(color_type)
+	if bit_depth != 8 or interlace or bpp is None:
+		raise ValueError(
+			"Only 8 bit non-interlaced gray or rgb pngs can be read as masks."
+		)
+	rows = unfilter_png_rows(
+		zlib.decompress(b"".join(compressed_data)),
+		width,
+		height,
+		bpp,
+	)
+	mask_rows = []
+	for row in rows:
+		mask_row = bytes(row[0::bpp]).translate(THRESHOLD_TABLE)
+		if color_type in (4, 6):
+			alpha_row = bytes(row[bpp - 1::bpp]).translate(THRESHOLD_TABLE)
+			mask_row = bytes(bytearray(
+				value & alpha for value, alpha
+				in zip(bytearray(mask_row), bytearray(alpha_row))
+			))
+		mask_rows.append(mask_row)
+	return b"".join(mask_rows), width, height
+
+
+# Classes
+class MaskPixelRegion(object):
+	"""Stand-in for a gimp pixel region of a MaskSelection.
+
+	Slicing this with [x_start:x_end, y_start:y_end] gives the mask bytes for
+	that area, one byte per pixel, as slicing a gimp.PixelRgn would.
+	"""
+	bpp = 1
+
+	def __init__(self, mask_selection, x, y, width, height):
+		self.mask_selection = mask_selection
+		self.x = x
+		self.y = y
+		self.w = width
+		self.h = height
+
+	def __getitem__(self, key):
+		x_slice, y_slice = key
+		if (x_slice.start < self.x or x_slice.stop > self.x + self.w
+				or y_slice.start < self.y or y_slice.stop > self.y + self.h):
+			raise IndexError("Subscript out of range of pixel region.")
+		return self.mask_selection.read_mask(
+			x_slice.start,
+			y_slice.start,
+			x_slice.stop,
+			y_slice.stop,
+		)
+
+
+class MaskSelection(object):
+	"""Stand-in for a gimp selection channel, backed by a mask.
+
+	This implements the parts of the gimp.Channel interface that SpeechBubble
+	uses, so that masks that were never selected in gimp can be used as
+	speech bubbles. The mask is a byte string with one byte per pixel, and
+	is placed with its top left corner at the given offsets.
+	"""
+	def __init__(self, mask, width, height, x_offset=0, y_offset=0):
+		self.mask = mask
+		self.width = width
+		self.height = height
+		self.x_offset = x_offset
+		self.y_offset = y_offset
+
+	@classmethod
+	def from_array(cls, mask, x_offset=0, y_offset=0):
+		"""Create a mask selection from a numpy array.
+
+		Args:
+			mask (numpy.ndarray): height x width array, which is selected
+				where it is non-zero.
+			x_offset (int): x coordinate of left of mask.
+			y_offset (int): y coordinate of top of mask.
+
+		Returns:
+			MaskSelection: the mask selection.
+		"""
+		mask = numpy.asarray(mask) != 0
+		height, width = mask.shape
+		return cls(
+			(mask.astype(numpy.uint8) * numpy.uint8(255)).tobytes(),
+			width,
+			height,
+			x_offset,
+			y_offset,
+		)
+
+	@classmethod
+	def from_rows(cls, rows, x_offset=0, y_offset=0):
+		"""Create a mask selection from rows of values.
+
+		Args:
+			rows (list(list)): rows of values, which are selected where they
+				are truthy. All rows must be the same length.
+			x_offset (int): x coordinate of left of mask.
+			y_offset (int): y coordinate of top of mask.
+
+		Returns:
+			MaskSelection: the mask selection.
+		"""
+		mask = bytes(bytearray(
+			255 if value else 0 for row in rows for value in row
+		))
+		width = len(rows[0]) if rows else 0
+		return cls(mask, width, len(rows), x_offset, y_offset)
+
+	@classmethod
+	def from_png(cls, file_path, x_offset=0, y_offset=0):
+		"""Create a mask selection from a png file.
+
+		Args:
+			file_path (str): path to png file, see read_png_mask.
+			x_offset (int): x coordinate of left of mask.
+			y_offset (int): y coordinate of top of mask.
+
+		Returns:
+			MaskSelection: the mask selection.
+		"""
+		mask, width, height = read_png_mask(file_path)
+		return cls(mask, width, height, x_offset, y_offset)
+
+	def get_bounds(self):
+		"""Get bounds of the selected pixels, like gimp_selection_bounds.
+
+		Returns:
+			tuple(bool, int, int, int, int): whether anything is selected, and
+				the x_min, y_min, x_max and y_max bounds of the selection.
+		"""
+		rows = [
+			self.mask[y * self.width:(y + 1) * self.width]
+			for y in range(self.height)
+		]
+		selected_rows = [
+			y for y, row in enumerate(rows) if row.strip(b"\x00")
+		]
+		if not selected_rows:
+			return (False, 0, 0, 0, 0)
+		x_min = min(
+			len(row) - len(row.lstrip(b"\x00"))
+			for row in rows if row.strip(b"\x00")
+		)
+		x_max = max(len(row.rstrip(b"\x00")) for row in rows)
+		return (
+			True,
+			self.x_offset + x_min,
+			self.y_offset + selected_rows[0],
+			self.x_offset + x_max,
+			self.y_offset + selected_rows[-1] + 1,
+		)
+
+	def get_pixel(self, x, y):
+		"""Get value of the selection at the given pixel.
+
+		Args:
+			x (int): x coordinate of pixel.
+			y (int): y coordinate of pixel.
+
+		Returns:
+			tuple(int): value of the mask at the pixel, or 0 outside it.
+		"""
+		x -= self.x_offset
+		y -= self.y_offset
+		if 0 <= x < self.width and 0 <= y < self.height:
+			index = y * self.width + x
+			return (ord(self.mask[index:index + 1]),)
+		return (0,)
+
+	def get_pixel_rgn(self, x, y, width, height, dirty=False, shadow=False):
+		"""Get a pixel region that reads the given area of the selection.
+
+		Args:
+			x (int): x coordinate of left of region.
+			y (int): y coordinate of top of region.
+			width (int): width of region.
+			height (int): height of region.
+			dirty (bool): unused, as the region is read only.
+			shadow (bool): unused, as the region is read only.
+
+		Returns:
+			MaskPixelRegion: the pixel region.
+		"""
+		return MaskPixelRegion(self, x, y, width, height)
+
+	def read_mask(self, x_min, y_min, x_max, y_max):
+		"""Read the given area of the selection as bytes.
+
+		Args:
+			x_min (int): x coordinate of left of area.
+			y_min (int): y coordinate of top of area.
+			x_max (int): x coordinate of right of area, exclusive.
+			y_max (int): y coordinate of bottom of area, exclusive.
+
+		Returns:
+			str: byte string of the area row by row, with one byte per pixel,
+				which is 0 outside the mask.
+		"""
+		left = max(x_min, self.x_offset)
+		right = min(x_max, self.x_offset + self.width)
+		empty_row = b"\x00" * (x_max - x_min)
+		rows = []
+		for y in range(y_min, y_max):
+			mask_y = y - self.y_offset
+			if left >= right or not 0 <= mask_y < self.height:
+				rows.append(empty_row)
+				continue
+			start = mask_y * self.width + left - self.x_offset
+			rows.append(
+				b"\x00" * (left - x_min)
+				+ self.mask[start:start + right - left]
+				+ b"\x00" * (x_max - right)
+			)
+		return b"".join(rows)
+
+
+class StandInLayer(object):
+	"""Stand-in for a gimp text layer that records how it is moved."""
+	def __init__(self, width, height, x_offset=0, y_offset=0):
+		self.width = width
+		self.height = height
+		self.offsets = (x_offset, y_offset)
+		self.moves = []
+
+	def translate(self, x_offset, y_offset):
+		"""Move layer by the given offsets and record the move.
+
+		Args:
+			x_offset (int): horizontal distance to move.
+			y_offset (int): vertical distance to move.
+		"""
+		self.moves.append((x_offset, y_offset))
+		self.offsets = (self.offsets[0] + x_offset, self.offsets[1] + y_offset)
+
+
+class ApproximateTextExtents(object):
+	"""Stand-in for a text extents cache that estimates the size of words.
+
+	Every character is given the same advance width, as a fraction of the
+	text size, so that words can be laid out without gimp's text rendering.
+	"""
+	def __init__(self, advance_ratio=0.6, height_ratio=1.25):
+		self.advance_ratio = advance_ratio
+		self.height_ratio = height_ratio
+		self.num_measured = 0
+
+	def get_extents(self, font, text_size, word):
+		"""Estimate size of the text layer for the given word.
+
+		Args:
+			font (str): name of font, which is ignored.
+			text_size (int): size of text, in pixels.
+			word (str): the word to measure.
+
+		Returns:
+			tuple(int, int): the width and height of the word.
+		"""
+		self.num_measured += 1
+		return (
+			int(math.ceil(len(word) * text_size * self.advance_ratio)),
+			int(math.ceil(text_size * self.height_ratio)),
+		)
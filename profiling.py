@@ -0,0 +1,196 @@
+import collections
+import functools
+import os
+import time
+
+
+# Profiling
+#
+# Profiling is opt-in, and is turned on by setting an environment variable
+# before starting gimp. When it is off, get_profiler returns None and nothing
+# is instrumented, so the plugins run exactly as they would without it. When
+# it is on, the functions and methods to profile are replaced by wrappers
+# that record their wall time and number of calls, and objects such as the
+# pdb can be wrapped in proxies that count calls to their methods.
+
+
+# Classes
+class CallCounter(object):
+	"""Proxy that counts calls to the methods of the object it wraps.
+
+	Calls are recorded in the profiler as "<name>.<method>".
+	"""
+	def __init__(self, target, name, profiler):
+		self._target = target
+		self._name = name
+		self._profiler = profiler
+
+	def __getattr__(self, attribute):
+		value = getattr(self._target, attribute)
+		if not callable(value):
+			return value
+		return self._profiler.count_calls(
+			value,
+			"{0}.{1}".format(self._name, attribute),
+		)
+
+	def __setattr__(self, attribute, value):
+		if attribute.startswith("_"):
+			super(CallCounter, self).__setattr__(attribute, value)
+		else:
+			setattr(self._target, attribute, value)
+
+
+class Profiler(object):
+	"""Class to record the wall time and calls of each phase of a run.
+
+	Times are inclusive, so a phase that runs inside another phase, such as
+	place_words inside fit_text_size, counts towards both.
+	"""
+	def __init__(self, log_file=None):
+		self.log_file = log_file
+		self.times = collections.OrderedDict()
+		self.counts = collections.OrderedDict()
+
+	def reset(self):
+		"""Clear the recorded times and calls."""
+		self.times.clear()
+		self.counts.clear()
+
+	def record(self, name, seconds=None):
+		"""Record a call, and the time it took if it was timed.
+
+		Args:
+			name (str): name of the phase or call.
+			seconds (float or None): wall time of the call.
+		"""
+		self.counts[name] = self.counts.get(name, 0) + 1
+		if seconds is not None:
+			self.times[name] = self.times.get(name, 0.0) + seconds
+
+	def time_calls(self, function, name):
+		"""Wrap a function to record its wall time and calls.
+
+		Args:
+			function (callable): the function to wrap.
+			name (str): name of phase to record calls as.
+
+		Returns:
+			callable: the wrapped function.
+		"""
+		@functools.wraps(function)
+		def timed_function(*args, **kwargs):
+			start_time = time.time()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				self.record(name, time.time() - start_time)
+		return timed_function
+
+	def count_calls(self, function, name):
+		"""Wrap a function to record its calls.
+
+		Args:
+			function (callable): the function to wrap.
+			name (str): name to record calls as.
+
+		Returns:
+			callable: the wrapped function.
+		"""
+		def counted_function(*args, **kwargs):
+			self.record(name)
+			return function(*args, **kwargs)
+		return counted_function
+
+	def time_method(self, cls, method_name, name=None):
+		"""Replace a method of a class with one that records its time.
+
+		Args:
+			cls (type): the class.
+			method_name (str): name of the method.
+			name (str or None): name of phase, which defaults to
+				"<class>.<method>".
+		"""
+		setattr(cls, method_name, self.time_calls(
+			cls.__dict__[method_name],
+			name or "{0}.{1}".format(cls.__name__, method_name),
+		))
+
+	def count_argument_calls(self, cls, method_name, index, name):
+		"""Make a method of a class count calls made on one of its arguments.
+
+		The argument is replaced by a CallCounter before the method is called,
+		so calls on it are counted for as long as the method's object keeps it.
+
+		Args:
+			cls (type): the class.
+			method_name (str): name of the method.
+			index (int): index of the argument, after self.
+			name (str): name to record calls on the argument as.
+		"""
+		method = cls.__dict__[method_name]
+
+		@functools.wraps(method)
+		def counting_method(instance, *args, **kwargs):
+			args = list(args)
+			args[index] = CallCounter(args[index], name, self)
+			return method(instance, *args, **kwargs)
+		setattr(cls, method_name, counting_method)
+
+	def get_report(self):
+		"""Get the recorded times and calls as text.
+
+		Returns:
+			str: one line for each phase or call, in the order first seen.
+		"""
+		lines = ["Speech Bubblifier profile:"]
+		for name, count in self.counts.items():
+			if name in self.times:
+				lines.append("{0}: {1} calls in {2:.4f}s".format(
+					name,
+					count,
+					self.times[name],
+				))
+			else:
+				lines.append("{0}: {1} calls".format(name, count))
+		return "\n".join(lines)
+
+	def report(self, message):
+		"""Report the recorded times and calls, then clear them.
+
+		The report is appended to the log file if the profiler has one, and
+		passed to the message function otherwise.
+
+		Args:
+			message (callable): function to show the report with, such as
+				gimp.message, which writes to the gimp error console.
+		"""
+		report = self.get_report()
+		if self.log_file:
+			with open(self.log_file, "a") as file_:
+				file_.write("{0}\n{1}\n\n".format(time.ctime(), report))
+		else:
+			message(report)
+		self.reset()
+
+
+# Functions
+def get_profiler(environment_variable):
+	"""Get a profiler if profiling is turned on by an environment variable.
+
+	The variable can be "1" to report to the gimp error console, or the path
+	of a log file to append reports to. If it is unset, empty or "0",
+	profiling is off.
+
+	Args:
+		environment_variable (str): name of environment variable.
+
+	Returns:
+		Profiler or None: the profiler, or None if profiling is off.
+	"""
+	value = os.environ.get(environment_variable, "")
+	if value in ("", "0"):
+		return None
+	if value == "1":
+		return Profiler()
+	return Profiler(log_file=value)
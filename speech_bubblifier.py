@@ -1,355 +1,471 @@
 #!/usr/bin/env python
 
-import math
+import collections
+import csv
+import json
+import os
+import re
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 from gimpfu import *
 import gimpcolor
 import gimpenums
 
+from batch_manifest import to_str
+import bubble_layout
+from bubble_layout import (
+	FULL_SCAN,
+	SCAN_MODES,
+	SelectionSizeError,
+	SelectionSpans,
+	layout_text,
+)
+import profiling
+
+try:
+	import bubble_detection
+except ImportError:
+	bubble_detection = None
+
 
 # Exceptions
-class InvalidRowError(Exception):
+class NoSelectionError(Exception):
 	def __init__(self, message=None):
 		if not message:
-			message = "Tried to access row outside selected region."
-		super(InvalidRowError, self).__init__(message)
+			message = (
+				"SpeechBubblifier must be run with a speech bubble "
+				"area selected."
+			)
+		super(NoSelectionError, self).__init__(message)
 
 
-class SelectionSizeError(Exception):
+class EmptyTextError(Exception):
 	def __init__(self, message=None):
 		if not message:
-			message = "Selected region is too small to fit given text."
-		super(SelectionSizeError, self).__init__(message)
+			message = "There is no text to add to the speech bubble."
+		super(EmptyTextError, self).__init__(message)
 
 
-class NoSelectionError(Exception):
+class BubbleDetectionError(Exception):
 	def __init__(self, message=None):
 		if not message:
-			message = (
-				"SpeechBubblifier must be run with a speech bubble "
-				"area selected."
-			)
-		super(NoSelectionError, self).__init__(message)
+			message = "Detecting speech bubbles requires numpy."
+		super(BubbleDetectionError, self).__init__(message)
 
 
 # Classes
-class WordLayer(object):
-	"""Struct to encapsulate data for word layers"""
-	def __init__(self, layer):
-		self.layer = layer
-		self.x_min = layer.offsets[0]
-		self.y_min = layer.offsets[1]
-		self.height = layer.height
-		self.width = layer.width
-
-	def move_to(self, x_pos, y_pos):
-		"""Move word layer to specified position and update attributes.
+class TextExtentsCache(object):
+	"""Least recently used cache of the sizes of rendered words."""
+	def __init__(self, max_size=4096):
+		self.max_size = max_size
+		self._extents = collections.OrderedDict()
+
+	def get_extents(self, font, text_size, word):
+		"""Get size of the text layer that the given word would be rendered as.
 
 		Args:
-			x_pos (int): x pos of top left hand corner of new position.
-			y_pos (int): y pos of top left hand corner of new position.
-		"""
-		self.layer.translate(
-			int(x_pos - self.x_min),
-			int(y_pos - self.y_min),
-		)
-		self.x_min = x_pos
-		self.y_min = y_pos
-
-class BlockRow(object):
-	"""Class to represent a block row of a selected area.
-
-	A block row here means the largest rectangular area that fits inside a
-	given series of consecutive pixel rows.
-
-	We split selected regions into block rows of a given height, extending out
-	from the centre, and separate the cases where we have an even number of
-	rows and where we have an odd number.
-
-	eg. in the following selected area:
-
-        ................
-     .....................
-     ......................
-    .........................
-    ........................
-   .........................
-      ...................
-      .................
-         .............
-
-	the 'odd' block rows of height 3 would be:
-
-        +--------------+
-     ...| BLOCK ROW 2  |..
-     ...+--------------+...
-    +----------------------+.
-    |     BLOCK ROW 1      |
-   .+----------------------+
-      ...+-----------+...
-      ...|BLOCK ROW 3|.
-         +-----------+
-
-	and the 'even' block rows of height 3 would be:
-
-        ................
-     .....................
-     +--------------------+
-    .|   BLOCK ROW 1      |..
-    .+--------------------+.
-   ...+---------------+.....
-      |  BLOCK ROW 2  |..
-      +---------------+
-         .............
-	"""
-	def __init__(self, speech_bubble, top):
-		self.speech_bubble = speech_bubble
-		self.height = speech_bubble.row_height
-		self.top = top
-		self.bottom = top + self.height
-		self._compute_horizontal_bounds()
-
-	def _compute_horizontal_bounds(self):
-		"""Find left and right bounds of block row."""
-		self.left = None
-		self.right = None
-		self.width = 0
-		for y in range(self.top, self.bottom):
-			bounds = self.speech_bubble.get_pixel_row_bounds(y)
-			if not bounds:
-				return
-			if not self.left or bounds[0] > self.left:
-				self.left = bounds[0] + self.speech_bubble.horizontal_offset
-			if not self.right or bounds[1] < self.right:
-				self.right = bounds[1] - self.speech_bubble.horizontal_offset
-		if self.left and self.right and self.right > self.left:
-			self.width = self.right - self.left
-
-
-class SpeechBubble(object):
-	"""Class to interact with speech bubble and split into block rows."""
-	def __init__(
-			self,
-			gimp_selection,
-			x_min,
-			y_min,
-			x_max,
-			y_max,
-			row_height,
-			space_width,
-			horizontal_offset,
-			vertical_offset,
-			):
-		self.selection = gimp_selection
-		self.x_min = x_min
-		self.y_min = y_min + vertical_offset
-		self.x_max = x_max
-		self.y_max = y_max - vertical_offset
-		self.height = y_max - y_min
-		self.width = x_max - x_min
-		self.row_height = row_height
-		self.space_width = space_width
-		self.horizontal_offset = horizontal_offset
-		self._compute_pixel_row_bounds()
-		self._compute_block_rows()
-
-	def _compute_pixel_row_bounds(self):
-		"""Get the horizontal bounds of each pixel row.
-
-		This finds the first and last non-empty pixel of each row and uses
-		it to populate self.pixel_row_bounds.
-		"""
-		self._pixel_row_bounds = []
-		for y in range(self.y_min, self.y_max):
-			bound_min = None
-			bound_max = None
-			for x in range(self.x_min, self.x_max):
-				if self.selection.get_pixel(x, y)[0]:
-					bound_min = x
-					break
-			else:
-				self._pixel_row_bounds.append(None)
-				continue
-			for x in range(self.x_max, self.x_min, -1):
-				if self.selection.get_pixel(x, y)[0]:
-					bound_max = x
-					break
-			self._pixel_row_bounds.append((bound_min, bound_max))
-
-	def get_pixel_row_bounds(self, pixel_row):
-		"""Get horizontal bounds of given pixel row.
-		
-		Args:
-			pixel_row (int): the row we're looking at.
+			font (str): name of font.
+			text_size (int): size of text, in pixels.
+			word (str): the word to measure.
 
 		Returns:
-			tuple(int, int) or None: the start and end of the selected region
-				of the pixel row, or None if row is all unselected.
+			tuple(int, int): the width and height of the word.
 		"""
+		key = (font, text_size, word)
 		try:
-			return self._pixel_row_bounds[pixel_row - self.y_min]
-		except IndexError:
-			raise InvalidRowError()
-
-	def _compute_block_rows(self):
-		"""Find the odd and even block rows for this selection."""
-		centre_height = int(math.floor(0.5 * (self.y_min + self.y_max)))
-		num_steps = int(math.floor(0.5 * (self.height / self.row_height)))
-		half_row_height_floor = int(math.floor(0.5 * self.row_height))
-		half_row_height_ceil = int(math.ceil(0.5 * self.row_height))
-		self.odd_block_rows = [
-			BlockRow(self, centre_height - half_row_height_floor)
-		]
-		self.even_block_rows = []
-		# add rows going out from centre
-		for i in range(num_steps):
-			even_row_higher = centre_height - ((i + 1) * self.row_height)
-			even_row_lower = centre_height + (i * self.row_height)
-			odd_row_higher = even_row_higher - half_row_height_floor
-			odd_row_lower = even_row_lower + half_row_height_ceil
-			self.even_block_rows.extend([
-				BlockRow(self, even_row_higher),
-				BlockRow(self, even_row_lower),
-			])
-			if odd_row_higher >= self.y_min:
-				self.odd_block_rows.extend([
-					BlockRow(self, odd_row_higher),
-					BlockRow(self, odd_row_lower)
-				])
-		self.max_num_rows = max(len(self.odd_block_rows), len(self.even_block_rows))
-
-	def place_words(self, word_layers):
-		"""Place words in selection.
-
-		This uses the block rows and places the words centred around
-		the middle of the selection.
+			extents = self._extents.pop(key)
+		except KeyError:
+			extents = self._measure(font, text_size, word)
+		self._extents[key] = extents
+		if len(self._extents) > self.max_size:
+			self._extents.popitem(last=False)
+		return extents
+
+	def _measure(self, font, text_size, word):
+		"""Measure the given word without creating a layer for it.
 
 		Args:
-			word_layers (list(WordLayer)): list of WordLayer objects
-				representing text to add.
+			font (str): name of font.
+			text_size (int): size of text, in pixels.
+			word (str): the word to measure.
+
+		Returns:
+			tuple(int, int): the width and height of the word.
 		"""
-		min_num_rows = self._get_min_num_rows(word_layers)
-		if min_num_rows is None:
-			raise SelectionSizeError()
-		for num_rows in range(min_num_rows, self.max_num_rows):
-			block_row_generator = self._get_block_rows(num_rows)
-			block_row = next(block_row_generator)
-			word_layers_by_row = {}
-			cumulative_word_width = 0
-			for word_layer in word_layers:
-				cumulative_word_width += word_layer.width
-				while cumulative_word_width > block_row.width:
-					try:
-						block_row = next(block_row_generator)
-						cumulative_word_width = word_layer.width
-					except StopIteration:
-						# reached end of generator
-						# break and try again with higher num_rows
-						break
-				else:
-					# didn't hit StopIteration
-					# so can add word_layer to word_layers_by_row
-					word_layers_by_row.setdefault(block_row, []).append(
-						word_layer
-					)
-					cumulative_word_width += self.space_width
-					continue
-				# if we get here, we hit StopIteration above
-				# break and try again with higher num_rows
-				break
-			else:
-				# didn't hit StopIteration with this number of rows
-				# hence word layers fit in given number of rows
-				# so we can actually place the words now
-				self._place_words(word_layers_by_row)
-				return
-		# didn't hit return above
-		# hence word layers do not fit in any number of rows
-		raise SelectionSizeError()
-
-	def _place_words(self, word_layers_by_row):
-		"""Place words in selection using given grouping of words with rows.
-
-		This is used by place_words method and it assumes that we already know
-		the word_layers will fit in the given rows.
+		width, height, _, _ = pdb.gimp_text_get_extents_fontname(
+			word,
+			text_size,
+			gimpenums.PIXELS,
+			font,
+		)
+		return width, height
+
+
+class PersistentTextExtentsCache(TextExtentsCache):
+	"""Text extents cache that is kept on disk between plugin runs.
+
+	Extents are stored in one json file per font, under the gimp profile
+	directory by default. A font's file is only loaded the first time one
+	of its words is measured, and each file keeps at most max_file_size
+	words, dropping the least recently used ones when it is saved.
+	"""
+	def __init__(self, directory=None, max_size=4096, max_file_size=20000):
+		super(PersistentTextExtentsCache, self).__init__(max_size)
+		if directory is None:
+			directory = os.path.join(
+				gimp.directory,
+				"speech_bubblifier",
+				"text_extents",
+			)
+		self.directory = directory
+		self.max_file_size = max_file_size
+		self._font_extents = {}
+		self._used_fonts = set()
+
+	def _measure(self, font, text_size, word):
+		"""Get extents from the font's file, or measure them if not there.
 
 		Args:
-			word_layers_by_row (dict(BlockRow, WordLayer)): dictionary of word
-				layers keyed by the block row they should be added to.
+			font (str): name of font.
+			text_size (int): size of text, in pixels.
+			word (str): the word to measure.
+
+		Returns:
+			tuple(int, int): the width and height of the word.
 		"""
-		for block_row, word_layers in word_layers_by_row.items():
-			total_word_width = sum(
-				word_layer.width for word_layer in word_layers
-			)
-			text_start = block_row.left + 0.5 * int(
-				math.floor((block_row.width - total_word_width))
+		font_extents = self._get_font_extents(font)
+		key = (text_size, word)
+		try:
+			extents = font_extents.pop(key)
+		except KeyError:
+			extents = super(PersistentTextExtentsCache, self)._measure(
+				font,
+				text_size,
+				word,
 			)
-			for word_layer in word_layers:
-				word_layer.move_to(text_start, block_row.top)
-				text_start += word_layer.width + self.space_width
+		font_extents[key] = extents
+		self._used_fonts.add(font)
+		return extents
 
-	def _get_min_num_rows(self, word_layers):
-		"""Get minimum number of block rows needed to add text.
+	def _get_font_file_path(self, font):
+		"""Get path of the file that stores extents for the given font.
 
-		This returns the smallest number of rows that could possibly be needed
-		to cover all the text, so that we're not recalculating the text
-		positions too many times. We get this value by comparing the total
-		width of all the text in the word_layers to the cumulative width of the
-		row blocks that will be used.
+		Args:
+			font (str): name of font.
+
+		Returns:
+			str: path to the font's json file.
+		"""
+		file_name = re.sub(r"[^\w.-]+", "_", font) + ".json"
+		return os.path.join(self.directory, file_name)
+
+	def _get_font_extents(self, font):
+		"""Get the stored extents for the given font, loading them if needed.
 
 		Args:
-			word_layers (list(WordLayer)): list of WordLayer objects
-				representing text to add.
+			font (str): name of font.
 
 		Returns:
-			int or None: minimum number of rows required, or None if the text
-				will not fit in this selection.
+			OrderedDict(tuple(int, str), tuple(int, int)): width and height
+				of words keyed by text size and word, from least to most
+				recently used.
 		"""
-		total_word_width = sum(word_layer.width for word_layer in word_layers)
-		cumulative_even_row_width = 0
-		cumulative_odd_row_width = 0
-		min_num_rows_even = None
-		min_num_rows_odd = None
-		for index, row in enumerate(self.even_block_rows):
-			cumulative_even_row_width += row.width
-			if cumulative_even_row_width >= total_word_width:
-				min_num_rows_even = index + 1 if index % 2 == 0 else index + 2
-				break
-		for index, row in enumerate(self.odd_block_rows):
-			cumulative_odd_row_width += row.width
-			if cumulative_odd_row_width >= total_word_width:
-				min_num_rows_odd = index + 1 if index % 2 == 1 else index + 2
-				break
-		if min_num_rows_even is None:
-			return min_num_rows_odd
-		if min_num_rows_odd is None:
-			return min_num_rows_even
-		return min(min_num_rows_odd, min_num_rows_even)
-
-	def _get_block_rows(self, n):
-		"""Yields the first n block rows, from top downwards.
-
-		If n is odd this will return the first n rows from self.odd_block_rows,
-		Otherwise, this will return the first n rows from self.even_block_rows.
-		In either case, it reorders the rows from top downwards.
+		if font in self._font_extents:
+			return self._font_extents[font]
+		font_extents = self._read_font_file(font)
+		self._font_extents[font] = font_extents
+		return font_extents
+
+	def _read_font_file(self, font):
+		"""Read the extents stored on disk for the given font.
 
 		Args:
-			n (int): number of rows we want to get.
+			font (str): name of font.
 
-		Yields:
-			BlockRow: list of the first n BlockRow objects.
+		Returns:
+			OrderedDict(tuple(int, str), tuple(int, int)): width and height
+				of words keyed by text size and word, in the order they were
+				saved, or empty if the file is missing or unreadable.
+		"""
+		font_extents = collections.OrderedDict()
+		try:
+			with open(self._get_font_file_path(font), "r") as file_:
+				data = json.load(file_)
+			if data.get("font") == font:
+				for text_size, word, width, height in data["extents"]:
+					font_extents[(text_size, to_str(word))] = (width, height)
+		except (IOError, OSError, ValueError, KeyError, TypeError):
+			# missing or unreadable files just mean nothing is cached yet
+			font_extents.clear()
+		return font_extents
+
+	def save(self):
+		"""Write extents of the fonts used in this run back to disk.
+
+		Several gimp processes may share the cache directory in batch runs,
+		so extents saved by other processes since the file was loaded are
+		merged in first, as less recently used than this run's extents.
 		"""
-		block_rows = self.even_block_rows if n % 2 == 0 else self.odd_block_rows
-		num_steps = int(0.5 * n)
-		for i in range(num_steps):
-			yield block_rows[n - 2*i - 2]
-		if n % 2 == 1:
-			yield block_rows[0]
-		for i in reversed(range(num_steps)):
-			yield block_rows[n - 2*i - 1]
+		for font in self._used_fonts:
+			font_extents = self._read_font_file(font)
+			for key, extents in self._font_extents[font].items():
+				font_extents.pop(key, None)
+				font_extents[key] = extents
+			self._font_extents[font] = font_extents
+			while len(font_extents) > self.max_file_size:
+				font_extents.popitem(last=False)
+			data = {
+				"font": font,
+				"extents": [
+					[text_size, word, width, height]
+					for (text_size, word), (width, height)
+					in font_extents.items()
+				],
+			}
+			file_path = self._get_font_file_path(font)
+			# write to a file of our own then rename it, so that other
+			# processes never read a half written file
+			temp_file_path = "{0}.{1}.tmp".format(file_path, os.getpid())
+			try:
+				if not os.path.isdir(self.directory):
+					os.makedirs(self.directory)
+				with open(temp_file_path, "w") as file_:
+					json.dump(data, file_)
+				if os.name == "nt" and os.path.exists(file_path):
+					# rename can't replace files on windows
+					os.remove(file_path)
+				os.rename(temp_file_path, file_path)
+			except (IOError, OSError):
+				# failing to save the cache shouldn't stop the text being added
+				pass
+		self._used_fonts.clear()
+
+
+# Gimp functions
+def create_text_layers(timg, word_layers, font, text_size, color):
+	"""Create text layers for placed word layers in a new layer group.
+
+	Args:
+		timg (gimp.Image): image to add text layers to.
+		word_layers (list(WordLayer)): word layers that have been placed.
+		font (str): name of font.
+		text_size (int): size of text, in pixels.
+		color (gimpcolor.RGB): color of text.
+
+	Returns:
+		gimp.GroupLayer: the layer group containing the text layers.
+	"""
+	text_group_layer = pdb.gimp_layer_group_new(timg)
+	text_group_layer.name = "text group"
+	pdb.gimp_image_insert_layer(timg, text_group_layer, None, -1)
+	try:
+		for word_layer in word_layers:
+			layer = pdb.gimp_text_layer_new(
+				timg,
+				word_layer.word,
+				font,
+				text_size,
+				0,
+			)
+			layer.name = word_layer.word
+			pdb.gimp_image_insert_layer(timg, layer, text_group_layer, -1)
+			pdb.gimp_text_layer_set_color(layer, color)
+			word_layer.set_layer(layer)
+	except Exception as e:
+		pdb.gimp_image_remove_layer(timg, text_group_layer)
+		raise e
+	return text_group_layer
+
+
+def get_selected_bubble(timg):
+	"""Get the current selection of the image as a speech bubble.
+
+	Args:
+		timg (gimp.Image): image whose selection is the speech bubble.
+
+	Returns:
+		tuple(gimp.Channel, tuple(int, int, int, int)): the selection and its
+			x_min, y_min, x_max and y_max bounds.
+	"""
+	non_empty, x_min, y_min, x_max, y_max = pdb.gimp_selection_bounds(timg)
+	if not non_empty:
+		raise NoSelectionError()
+	return timg.selection, (x_min, y_min, x_max, y_max)
+
+
+def get_path_bubble(tvectors, precision=0.2):
+	"""Get the area inside a path as a speech bubble.
+
+	The path's strokes are flattened to polygons, which are scanned straight
+	into spans without making a selection, by the even-odd rule. Open
+	strokes are treated as closed.
+
+	Args:
+		tvectors (gimp.Vectors): path around the speech bubble.
+		precision (float): largest distance in pixels between the path and
+			its flattened polygons.
+
+	Returns:
+		tuple(SelectionSpans, tuple(int, int, int, int)): the spans of the
+			speech bubble and their x_min, y_min, x_max and y_max bounds.
+	"""
+	polygons = []
+	_, stroke_ids = pdb.gimp_vectors_get_strokes(tvectors)
+	for stroke_id in stroke_ids:
+		_, coords, _ = pdb.gimp_vectors_stroke_interpolate(
+			tvectors,
+			stroke_id,
+			precision,
+		)
+		polygons.append(list(zip(coords[0::2], coords[1::2])))
+	spans = SelectionSpans.from_polygons(polygons)
+	non_empty, x_min, y_min, x_max, y_max = spans.get_bounds()
+	if not non_empty:
+		raise NoSelectionError(
+			"Path {0} doesn't enclose any pixels.".format(tvectors.name)
+		)
+	return spans, (x_min, y_min, x_max, y_max)
+
+
+def set_tile_cache(timg):
+	"""Set gimp's tile cache to hold two rows of tiles of the selection.
+
+	The analytic and pyramid scan modes read the selection a few rows at a
+	time, so without a cache each tile would be fetched again for every row
+	of it that is read. Two rows of tiles are kept because the bands of rows
+	that are read don't line up with the tiles.
+
+	Args:
+		timg (gimp.Image): image whose selection will be read.
+	"""
+	tile_width = gimp.tile_width()
+	gimp.tile_cache_ntiles(2 * ((timg.width + tile_width - 1) // tile_width))
+
+
+def read_visible_pixels(timg):
+	"""Read the visible pixels of the image, as if it had been flattened.
+
+	Args:
+		timg (gimp.Image): image to read.
+
+	Returns:
+		numpy.ndarray: height x width x channels uint8 array of the pixels.
+	"""
+	visible_layer = pdb.gimp_layer_new_from_visible(timg, timg, "visible")
+	width = visible_layer.width
+	height = visible_layer.height
+	try:
+		region = visible_layer.get_pixel_rgn(0, 0, width, height, False, False)
+		pixels = region[0:width, 0:height]
+	finally:
+		pdb.gimp_item_delete(visible_layer)
+	return numpy.frombuffer(pixels, dtype=numpy.uint8).reshape(
+		height,
+		width,
+		region.bpp,
+	)
+
+
+def fill_bubble(
+		timg,
+		selection,
+		bounds,
+		text,
+		font,
+		text_size,
+		color,
+		space_width,
+		horizontal_offset,
+		vertical_offset,
+		auto_size,
+		balanced_lines,
+		text_extents_cache,
+		scan_mode=FULL_SCAN,
+		):
+	"""Fill a speech bubble of the image with text layers.
+
+	Args:
+		timg (gimp.Image): image to add text layers to.
+		selection (gimp.Channel or SelectionSpans): selection channel, or a
+			stand-in for one, that is non-empty over the speech bubble, or
+			the spans of the speech bubble, eg. from a path.
+		bounds (tuple(int, int, int, int)): x_min, y_min, x_max and y_max
+			bounds of the speech bubble.
+		text (str): text to add.
+		font (str): name of font.
+		text_size (int): size of text, in pixels, or the maximum size if
+			auto_size is True.
+		color (gimpcolor.RGB): color of text.
+		space_width (int): width of spaces between words, in pixels.
+		horizontal_offset (int): horizontal gap to leave inside selection.
+		vertical_offset (int): vertical gap to leave inside selection.
+		auto_size (bool): if True, use the largest text size that fits.
+		balanced_lines (bool): if True, balance the lengths of the rows.
+		text_extents_cache (TextExtentsCache): cache to measure words with.
+		scan_mode (int): index of the way to find the selected spans of the
+			speech bubble, from SCAN_MODES.
+
+	Returns:
+		tuple(gimp.GroupLayer, int): the layer group containing the text
+			layers and the text size used.
+	"""
+	word_layers, text_size = layout_text(
+		selection,
+		bounds,
+		text,
+		font,
+		text_size,
+		space_width,
+		horizontal_offset,
+		vertical_offset,
+		auto_size,
+		balanced_lines,
+		text_extents_cache,
+		scan_mode,
+	)
+	text_group_layer = create_text_layers(
+		timg,
+		word_layers,
+		font,
+		text_size,
+		color,
+	)
+	return text_group_layer, text_size
+
+
+def read_bubble_script(file_path):
+	"""Read the text for each speech bubble from a script file.
 
+	Json scripts should contain an object mapping bubble ids to their text.
+	Any other file is read as csv, with a bubble id and its text on each row.
 
-# Main function
+	Args:
+		file_path (str): path to script file.
+
+	Returns:
+		list(tuple(str, str)): bubble ids and their text, in script order.
+	"""
+	with open(file_path, "r") as file_:
+		if file_path.lower().endswith(".json"):
+			script = json.load(
+				file_,
+				object_pairs_hook=collections.OrderedDict,
+			)
+			return [
+				(to_str(bubble_id), to_str(text))
+				for bubble_id, text in script.items()
+			]
+		return [
+			(row[0].strip(), ",".join(row[1:]).strip())
+			for row in csv.reader(file_) if row
+		]
+
+
+# Main functions
 def speech_bubblifier(
 		timg,
 		tdrawable,
@@ -360,46 +476,281 @@ def speech_bubblifier(
 		space_width,
 		horizontal_offset,
 		vertical_offset,
+		auto_size,
+		balanced_lines,
+		scan_mode,
 		):
-	# get bounds of current selection (which should be the speech bubble)
-	non_empty, x_min, y_min, x_max, y_max = pdb.gimp_selection_bounds(timg)
-	if not non_empty:
-		raise NoSelectionError()
-	gimp_selection = timg.selection
-
-	text_group_layer = pdb.gimp_layer_group_new(timg)
-	text_group_layer.name = "text group"
-	pdb.gimp_image_insert_layer(timg, text_group_layer, None, -1)
+	if not text.strip():
+		raise EmptyTextError()
+	selection, bounds = get_selected_bubble(timg)
+	if scan_mode != FULL_SCAN:
+		set_tile_cache(timg)
+	text_extents_cache = PersistentTextExtentsCache()
+	try:
+		fill_bubble(
+			timg,
+			selection,
+			bounds,
+			text,
+			font,
+			text_size,
+			color,
+			space_width,
+			horizontal_offset,
+			vertical_offset,
+			auto_size,
+			balanced_lines,
+			text_extents_cache,
+			scan_mode,
+		)
+	finally:
+		text_extents_cache.save()
+		if profiler is not None:
+			profiler.report(gimp.message)
 
-	words = text.split()
-	word_layers = []
-	for word in words:
-		word_layer = pdb.gimp_text_layer_new(timg, word, font, text_size, 0)
-		word_layer.name = word
-		pdb.gimp_image_insert_layer(timg, word_layer, text_group_layer, -1)
-		pdb.gimp_text_layer_set_color(word_layer, color)
-		word_layers.append(WordLayer(word_layer))
-	row_height = max(word_layer.height for word_layer in word_layers)
 
+def speech_bubblifier_path(
+		timg,
+		tdrawable,
+		tvectors,
+		font,
+		text,
+		text_size,
+		color,
+		space_width,
+		horizontal_offset,
+		vertical_offset,
+		auto_size,
+		balanced_lines,
+		):
+	if not text.strip():
+		raise EmptyTextError()
+	spans, bounds = get_path_bubble(tvectors)
+	text_extents_cache = PersistentTextExtentsCache()
 	try:
-		speech_bubble = SpeechBubble(
-			gimp_selection,
-			x_min,
-			y_min,
-			x_max,
-			y_max,
-			row_height,
+		fill_bubble(
+			timg,
+			spans,
+			bounds,
+			text,
+			font,
+			text_size,
+			color,
 			space_width,
 			horizontal_offset,
 			vertical_offset,
+			auto_size,
+			balanced_lines,
+			text_extents_cache,
 		)
-		speech_bubble.place_words(word_layers)
-	except Exception as e:
-		pdb.gimp_image_remove_layer(timg, text_group_layer)
-		raise e
+	finally:
+		text_extents_cache.save()
+		if profiler is not None:
+			profiler.report(gimp.message)
+
+
+def speech_bubblifier_batch(
+		timg,
+		tdrawable,
+		script_file,
+		font,
+		text_size,
+		color,
+		space_width,
+		horizontal_offset,
+		vertical_offset,
+		auto_size,
+		balanced_lines,
+		detect_bubbles,
+		scan_mode,
+		):
+	# each bubble is either a channel (ie. a saved selection) or a path named
+	# by its bubble id, or if detecting bubbles the bubble id is the number of
+	# the bubble in reading order, starting from 1
+	bubble_texts = read_bubble_script(script_file)
+	detected_bubbles = {}
+	if detect_bubbles:
+		if bubble_detection is None:
+			raise BubbleDetectionError()
+		for index, bubble in enumerate(
+				bubble_detection.detect_bubbles(read_visible_pixels(timg))):
+			detected_bubbles[str(index + 1)] = bubble
+	if scan_mode != FULL_SCAN:
+		set_tile_cache(timg)
+	text_extents_cache = PersistentTextExtentsCache()
+	report = []
+	pdb.gimp_image_undo_group_start(timg)
+	saved_selection = pdb.gimp_selection_save(timg)
+	try:
+		for bubble_id, text in bubble_texts:
+			try:
+				if not text.strip():
+					raise EmptyTextError(
+						"Bubble {0} has no text in the script.".format(
+							bubble_id
+						)
+					)
+				if detect_bubbles:
+					bubble = detected_bubbles.get(bubble_id)
+					if bubble is None:
+						raise NoSelectionError(
+							"No bubble {0} was detected.".format(bubble_id)
+						)
+					selection = bubble.selection
+					bounds = (
+						bubble.x_min,
+						bubble.y_min,
+						bubble.x_max,
+						bubble.y_max,
+					)
+				else:
+					channel = pdb.gimp_image_get_channel_by_name(
+						timg,
+						bubble_id,
+					)
+					if channel is not None:
+						pdb.gimp_image_select_item(
+							timg,
+							gimpenums.CHANNEL_OP_REPLACE,
+							channel,
+						)
+						selection, bounds = get_selected_bubble(timg)
+					else:
+						tvectors = pdb.gimp_image_get_vectors_by_name(
+							timg,
+							bubble_id,
+						)
+						if tvectors is None:
+							raise NoSelectionError(
+								"No channel or path named {0}.".format(
+									bubble_id
+								)
+							)
+						selection, bounds = get_path_bubble(tvectors)
+				text_group_layer, bubble_text_size = fill_bubble(
+					timg,
+					selection,
+					bounds,
+					text,
+					font,
+					text_size,
+					color,
+					space_width,
+					horizontal_offset,
+					vertical_offset,
+					auto_size,
+					balanced_lines,
+					text_extents_cache,
+					scan_mode,
+				)
+			except (
+					SelectionSizeError,
+					NoSelectionError,
+					EmptyTextError,
+					ValueError,
+					RuntimeError) as e:
+				# RuntimeErrors come from failed pdb calls, eg. for a font
+				# that isn't installed, so only fail this bubble
+				report.append({"id": bubble_id, "ok": False, "error": str(e)})
+				continue
+			text_group_layer.name = "text group {0}".format(bubble_id)
+			report.append({
+				"id": bubble_id,
+				"ok": True,
+				"text_size": bubble_text_size,
+			})
+	finally:
+		pdb.gimp_image_select_item(
+			timg,
+			gimpenums.CHANNEL_OP_REPLACE,
+			saved_selection,
+		)
+		pdb.gimp_image_remove_channel(timg, saved_selection)
+		pdb.gimp_image_undo_group_end(timg)
+		text_extents_cache.save()
+		if profiler is not None:
+			profiler.report(gimp.message)
+
+	num_filled = len([bubble for bubble in report if bubble["ok"]])
+	report_lines = [
+		"Filled {0} of {1} speech bubbles.".format(num_filled, len(report))
+	]
+	for bubble in report:
+		if bubble["ok"]:
+			report_lines.append("{0}: ok (text size {1})".format(
+				bubble["id"],
+				bubble["text_size"],
+			))
+		else:
+			report_lines.append("{0}: failed ({1})".format(
+				bubble["id"],
+				bubble["error"],
+			))
+	gimp.message("\n".join(report_lines))
+	return json.dumps(report)
+
+
+# Profiling
+def profile_speech_bubblifier(profiler):
+	"""Instrument the plugin and layout code to record each phase of a run.
+
+	This times text measurement, layout and text layer creation, and counts
+	calls to the pdb, to the selection from SpeechBubble and to text layers
+	from WordLayer.
+
+	Args:
+		profiler (profiling.Profiler): profiler to record to.
+	"""
+	global pdb, fill_bubble, create_text_layers, read_visible_pixels
+	pdb = profiling.CallCounter(pdb, "pdb", profiler)
+	fill_bubble = profiler.time_calls(fill_bubble, "fill_bubble")
+	create_text_layers = profiler.time_calls(
+		create_text_layers,
+		"create_text_layers",
+	)
+	read_visible_pixels = profiler.time_calls(
+		read_visible_pixels,
+		"read_visible_pixels",
+	)
+	profiler.time_method(TextExtentsCache, "_measure")
+	profiler.time_method(PersistentTextExtentsCache, "_measure")
+	for method_name in (
+			"_compute_pixel_row_bounds",
+			"_compute_block_row_bounds",
+			"_compute_block_rows",
+			"place_words"):
+		profiler.time_method(bubble_layout.SpeechBubble, method_name)
+	bubble_layout.fit_text_size = profiler.time_calls(
+		bubble_layout.fit_text_size,
+		"fit_text_size",
+	)
+	profiler.count_argument_calls(
+		bubble_layout.SpeechBubble,
+		"__init__",
+		0,
+		"selection",
+	)
+	profiler.count_argument_calls(
+		bubble_layout.WordLayer,
+		"set_layer",
+		0,
+		"layer",
+	)
+	if bubble_detection is not None:
+		bubble_detection.detect_bubbles = profiler.time_calls(
+			bubble_detection.detect_bubbles,
+			"detect_bubbles",
+		)
+
 
+# set SPEECH_BUBBLIFIER_PROFILE to 1 to report profiles to the error console,
+# or to the path of a log file to append them to
+profiler = profiling.get_profiler("SPEECH_BUBBLIFIER_PROFILE")
+if profiler is not None:
+	profile_speech_bubblifier(profiler)
 
-# Register function
+
+# Register functions
 register(
 	"python_fu_speech_bubblifier",
 	"Arrange text in preselected speech bubble shape",
@@ -417,9 +768,74 @@ register(
 		(PF_INT, "pf_space_width", "Space Width", 15),
 		(PF_INT, "pf_horizontal_offset", "Horizontal Offset", 10),
 		(PF_INT, "pf_vertical_offset", "Vertical Offset", 10),
+		(PF_TOGGLE, "pf_auto_size", "Auto Size (up to Text Size)", False),
+		(PF_TOGGLE, "pf_balanced_lines", "Balance Line Lengths", False),
+		(PF_OPTION, "pf_scan_mode", "Scan Mode", FULL_SCAN, SCAN_MODES),
 	],
 	[],
 	speech_bubblifier
 )
 
+register(
+	"python_fu_speech_bubblifier_path",
+	"Arrange text in a path's speech bubble shape",
+	(
+		"Arrange text in the speech bubble shape enclosed by a path, such as "
+		"one drawn with the paths tool or imported from an svg, without "
+		"making a selection from it."
+	),
+	"Ben Carey",
+	"Ben Carey",
+	"2021",
+	"<Image>/Tools/Custom/Speech Bubblifier (Path)",
+	"*",
+	[
+		(PF_VECTORS, "pf_path", "Path", None),
+		(PF_FONT, "pf_font", "Choose Font", "Comic Sans MS"),
+		(PF_STRING, "pf_text", "Text", ""),
+		(PF_INT, "pf_text_size", "Text Size", 60),
+		(PF_COLOR, "pf_text_color", "Text Color", gimpcolor.RGB(0,0,0)),
+		(PF_INT, "pf_space_width", "Space Width", 15),
+		(PF_INT, "pf_horizontal_offset", "Horizontal Offset", 10),
+		(PF_INT, "pf_vertical_offset", "Vertical Offset", 10),
+		(PF_TOGGLE, "pf_auto_size", "Auto Size (up to Text Size)", False),
+		(PF_TOGGLE, "pf_balanced_lines", "Balance Line Lengths", False),
+	],
+	[],
+	speech_bubblifier_path
+)
+
+register(
+	"python_fu_speech_bubblifier_batch",
+	"Fill every speech bubble in a script file",
+	(
+		"Fill the speech bubbles saved as channels or paths in the image, or "
+		"the bubbles detected on the page, with the text for each bubble id in "
+		"a json or csv script file, and return a json report of which "
+		"bubbles were filled."
+	),
+	"Ben Carey",
+	"Ben Carey",
+	"2021",
+	"<Image>/Tools/Custom/Speech Bubblifier Batch",
+	"*",
+	[
+		(PF_FILE, "pf_script_file", "Script File", ""),
+		(PF_FONT, "pf_font", "Choose Font", "Comic Sans MS"),
+		(PF_INT, "pf_text_size", "Text Size", 60),
+		(PF_COLOR, "pf_text_color", "Text Color", gimpcolor.RGB(0,0,0)),
+		(PF_INT, "pf_space_width", "Space Width", 15),
+		(PF_INT, "pf_horizontal_offset", "Horizontal Offset", 10),
+		(PF_INT, "pf_vertical_offset", "Vertical Offset", 10),
+		(PF_TOGGLE, "pf_auto_size", "Auto Size (up to Text Size)", False),
+		(PF_TOGGLE, "pf_balanced_lines", "Balance Line Lengths", False),
+		(PF_TOGGLE, "pf_detect_bubbles", "Detect Bubbles (ids 1, 2, 3...)", False),
+		(PF_OPTION, "pf_scan_mode", "Scan Mode", FULL_SCAN, SCAN_MODES),
+	],
+	[
+		(PF_STRING, "report", "Json report of filled speech bubbles"),
+	],
+	speech_bubblifier_batch
+)
+
 main()
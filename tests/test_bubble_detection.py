@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import collections
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(
+	0,
+	os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+)
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+else:
+	from bubble_detection import detect_bubbles, label_runs
+	from bubble_layout import find_row_runs
+
+
+# Tests of the run labelling and bubble detection of bubble_detection against
+# flood filling every pixel, on random masks and pages.
+
+
+# Utils
+def make_random_mask(rng, width, height):
+	"""Make a random mask of noise and rectangles.
+
+	Args:
+		rng (random.Random): random number generator to use.
+		width (int): width of the mask.
+		height (int): height of the mask.
+
+	Returns:
+		list(list(bool)): whether each pixel of each row is set.
+	"""
+	density = rng.uniform(0.2, 0.8)
+	rows = [
+		[rng.random() < density for _ in range(width)] for _ in range(height)
+	]
+	for _ in range(rng.randint(0, 4)):
+		x_min = rng.randrange(width)
+		y_min = rng.randrange(height)
+		x_max = rng.randint(x_min + 1, width)
+		y_max = rng.randint(y_min + 1, height)
+		value = rng.random() < 0.7
+		for row in rows[y_min:y_max]:
+			row[x_min:x_max] = [value] * (x_max - x_min)
+	return rows
+
+
+def flood_fill_components(rows):
+	"""Find the 4-connected components of a mask by flood filling.
+
+	Args:
+		rows (list(list(bool))): whether each pixel of each row is set.
+
+	Returns:
+		list(set(tuple(int, int))): the x and y of the pixels of each
+			component.
+	"""
+	height = len(rows)
+	width = len(rows[0]) if rows else 0
+	visited = set()
+	components = []
+	for y in range(height):
+		for x in range(width):
+			if not rows[y][x] or (x, y) in visited:
+				continue
+			component = set([(x, y)])
+			queue = collections.deque([(x, y)])
+			while queue:
+				pixel_x, pixel_y = queue.popleft()
+				for next_x, next_y in (
+						(pixel_x - 1, pixel_y),
+						(pixel_x + 1, pixel_y),
+						(pixel_x, pixel_y - 1),
+						(pixel_x, pixel_y + 1)):
+					if (0 <= next_x < width and 0 <= next_y < height
+							and rows[next_y][next_x]
+							and (next_x, next_y) not in component):
+						component.add((next_x, next_y))
+						queue.append((next_x, next_y))
+			visited.update(component)
+			components.append(component)
+	return components
+
+
+def get_sorted_components(components):
+	"""Get components in a form that can be compared.
+
+	Args:
+		components (list(set(tuple(int, int)))): pixels of each component.
+
+	Returns:
+		list(list(tuple(int, int))): the sorted pixels of each component,
+			sorted by their first pixel.
+	"""
+	return sorted(sorted(component) for component in components)
+
+
+# Tests
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class LabelRunsTest(unittest.TestCase):
+	"""Test labelling runs against flood filling every pixel."""
+	def setUp(self):
+		self.rng = random.Random(9)
+
+	def test_label_runs(self):
+		for _ in range(300):
+			width = self.rng.randint(1, 40)
+			height = self.rng.randint(1, 30)
+			rows = make_random_mask(self.rng, width, height)
+			run_rows, starts, ends = find_row_runs(
+				numpy.array(rows, dtype=bool)
+			)
+			labels = label_runs(run_rows, starts, ends, width)
+			components = collections.defaultdict(set)
+			for run, label in enumerate(labels.tolist()):
+				# labels are the index of the first run of each component
+				self.assertLessEqual(label, run)
+				components[label].update(
+					(x, int(run_rows[run]))
+					for x in range(starts[run], ends[run])
+				)
+			self.assertEqual(
+				get_sorted_components(components.values()),
+				get_sorted_components(flood_fill_components(rows)),
+			)
+
+	def test_no_runs(self):
+		run_rows, starts, ends = find_row_runs(numpy.zeros((5, 8), dtype=bool))
+		self.assertEqual(len(label_runs(run_rows, starts, ends, 8)), 0)
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class DetectBubblesTest(unittest.TestCase):
+	"""Test detecting bubbles against flood filling every light pixel."""
+	def setUp(self):
+		self.rng = random.Random(10)
+
+	def test_detect_bubbles(self):
+		min_area = 6
+		max_area_fraction = 0.25
+		min_fill_ratio = 0.5
+		for _ in range(300):
+			width = self.rng.randint(1, 40)
+			height = self.rng.randint(1, 30)
+			rows = make_random_mask(self.rng, width, height)
+			pixels = numpy.array(
+				[[[255 if value else 0] for value in row] for row in rows],
+				dtype=numpy.uint8,
+			)
+			expected = []
+			for component in flood_fill_components(rows):
+				x_min = min(x for x, _ in component)
+				y_min = min(y for _, y in component)
+				x_max = max(x for x, _ in component) + 1
+				y_max = max(y for _, y in component) + 1
+				area = len(component)
+				box_area = (x_max - x_min) * (y_max - y_min)
+				if (x_min > 0 and y_min > 0
+						and x_max < width and y_max < height
+						and area >= min_area
+						and area <= max_area_fraction * width * height
+						and area >= min_fill_ratio * box_area):
+					expected.append(sorted(component))
+			bubbles = detect_bubbles(
+				pixels,
+				light_threshold=0.5,
+				min_area=min_area,
+				max_area_fraction=max_area_fraction,
+				min_fill_ratio=min_fill_ratio,
+			)
+			found = []
+			for bubble in bubbles:
+				ys, xs = numpy.nonzero(bubble.mask)
+				component = sorted(
+					(int(x) + bubble.x_min, int(y) + bubble.y_min)
+					for x, y in zip(xs, ys)
+				)
+				self.assertEqual(bubble.area, len(component))
+				self.assertEqual(
+					(bubble.x_min, bubble.y_min, bubble.x_max, bubble.y_max),
+					(
+						min(x for x, _ in component),
+						min(y for _, y in component),
+						max(x for x, _ in component) + 1,
+						max(y for _, y in component) + 1,
+					),
+				)
+				found.append(component)
+			self.assertEqual(sorted(found), sorted(expected))
+
+
+if __name__ == "__main__":
+	unittest.main()
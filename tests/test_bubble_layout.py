@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+
+import math
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(
+	0,
+	os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+)
+
+from bubble_layout import (
+	ANALYTIC_SCAN,
+	FULL_SCAN,
+	PYRAMID_SCAN,
+	BlockRow,
+	SelectionSpans,
+	SpeechBubble,
+	WordLayer,
+	intersect_spans,
+	sliding_window_intersection,
+	sliding_window_max,
+	sliding_window_min,
+	sliding_window_offset_max,
+)
+from layout_backends import MaskSelection
+
+
+# Tests of the fast paths of bubble_layout against brute force versions,
+# on random shapes run through the MaskSelection stand-in.
+
+
+# Utils
+def make_random_rows(rng, width, height, max_spans=1, empty_chance=0.0):
+	"""Make random rows of a selection mask.
+
+	Args:
+		rng (random.Random): random number generator to use.
+		width (int): width of each row.
+		height (int): number of rows.
+		max_spans (int): largest number of spans in a row.
+		empty_chance (float): chance of a row having no selected pixels.
+
+	Returns:
+		list(list(int)): 0 or 1 for each pixel of each row.
+	"""
+	rows = []
+	for _ in range(height):
+		row = [0] * width
+		if rng.random() >= empty_chance:
+			for _ in range(rng.randint(1, max_spans)):
+				start = rng.randrange(width)
+				end = rng.randint(start + 1, width)
+				row[start:end] = [1] * (end - start)
+		rows.append(row)
+	return rows
+
+
+def make_random_bubble_rows(rng, width, height, empty_chance=0.0):
+	"""Make rows of a random bubble, whose edges wander from row to row.
+
+	Args:
+		rng (random.Random): random number generator to use.
+		width (int): width of each row.
+		height (int): number of rows.
+		empty_chance (float): chance of a row having no selected pixels.
+
+	Returns:
+		list(list(int)): 0 or 1 for each pixel of each row.
+	"""
+	rows = []
+	left = width // 4
+	right = width - width // 4
+	for _ in range(height):
+		left = min(max(left + rng.randint(-3, 3), 0), width // 2 - 1)
+		right = min(max(right + rng.randint(-3, 3), width // 2 + 1), width)
+		if rng.random() < empty_chance:
+			rows.append([0] * width)
+		else:
+			rows.append([int(left <= x < right) for x in range(width)])
+	return rows
+
+
+def get_row_pixels(row_spans):
+	"""Get the set of pixels covered by some spans.
+
+	Args:
+		row_spans (list(tuple(int, int))): start and exclusive end of spans.
+
+	Returns:
+		set(int): the pixels in the spans.
+	"""
+	return set(x for start, end in row_spans for x in range(start, end))
+
+
+def get_linear_block_row_bounds(speech_bubble, top):
+	"""Find block row bounds by scanning its pixel rows, as BlockRow used to.
+
+	Args:
+		speech_bubble (SpeechBubble): the speech bubble.
+		top (int): top pixel row of the block row.
+
+	Returns:
+		tuple(int, int, int): left, right and width of the block row, or
+			None, None and 0 if a pixel row in it is unselected.
+	"""
+	left = None
+	right = None
+	for y in range(top, top + speech_bubble.row_height):
+		bounds = speech_bubble.get_pixel_row_bounds(y)
+		if not bounds:
+			return None, None, 0
+		if not left or bounds[0] > left:
+			left = bounds[0] + speech_bubble.horizontal_offset
+		if not right or bounds[1] < right:
+			right = bounds[1] - speech_bubble.horizontal_offset
+	if left and right and right > left:
+		return left, right, right - left
+	return left, right, 0
+
+
+def is_inside_polygons(polygons, x, y):
+	"""Check if a point is inside some polygons by the even-odd rule.
+
+	Args:
+		polygons (list(list(tuple(float, float)))): points of each polygon.
+		x (float): x coordinate of point.
+		y (float): y coordinate of point.
+
+	Returns:
+		bool: whether the point is inside.
+	"""
+	inside = False
+	for polygon in polygons:
+		for (x_start, y_start), (x_end, y_end) in zip(
+				polygon, polygon[1:] + polygon[:1]):
+			if (y_start <= y) == (y_end <= y):
+				continue
+			crossing = x_start + (y - y_start) * (x_end - x_start) / (
+				y_end - y_start
+			)
+			if crossing <= x:
+				inside = not inside
+	return inside
+
+
+# Tests
+class SlidingWindowTest(unittest.TestCase):
+	"""Test sliding window functions against scanning every window."""
+	def setUp(self):
+		self.rng = random.Random(3)
+
+	def test_max_and_min(self):
+		for _ in range(200):
+			values = [self.rng.randint(-20, 20) for _ in range(30)]
+			window_size = self.rng.randint(1, len(values))
+			windows = [
+				values[i:i + window_size]
+				for i in range(len(values) - window_size + 1)
+			]
+			self.assertEqual(
+				sliding_window_max(values, window_size),
+				[max(window) for window in windows],
+			)
+			self.assertEqual(
+				sliding_window_min(values, window_size),
+				[min(window) for window in windows],
+			)
+
+	def test_offset_max(self):
+		for _ in range(500):
+			values = [self.rng.randint(0, 50) for _ in range(40)]
+			window_size = self.rng.randint(1, len(values))
+			offset = self.rng.randint(0, 10)
+			expected = []
+			for i in range(len(values) - window_size + 1):
+				kept_value = values[i]
+				for value in values[i + 1:i + window_size]:
+					if value > kept_value + offset:
+						kept_value = value
+				expected.append(kept_value)
+			self.assertEqual(
+				sliding_window_offset_max(values, window_size, offset),
+				expected,
+			)
+
+
+class BlockRowTest(unittest.TestCase):
+	"""Test block rows and row counts against the linear scans they replace."""
+	def setUp(self):
+		self.rng = random.Random(4)
+
+	def make_speech_bubble(self, empty_chance=0.0):
+		width = self.rng.randint(20, 80)
+		height = self.rng.randint(10, 60)
+		selection = MaskSelection.from_rows(
+			make_random_bubble_rows(self.rng, width, height, empty_chance),
+			x_offset=5,
+			y_offset=5,
+		)
+		_, x_min, y_min, x_max, y_max = selection.get_bounds()
+		return SpeechBubble(
+			selection,
+			x_min,
+			y_min,
+			x_max,
+			y_max,
+			self.rng.randint(1, 8),
+			self.rng.randint(1, 4),
+			self.rng.randint(0, 5),
+			self.rng.randint(0, 3),
+		)
+
+	def test_block_row_bounds(self):
+		for _ in range(100):
+			speech_bubble = self.make_speech_bubble(empty_chance=0.05)
+			for top in range(
+					speech_bubble.y_min,
+					speech_bubble.y_max - speech_bubble.row_height + 1):
+				block_row = BlockRow(speech_bubble, top)
+				left, right, width = get_linear_block_row_bounds(
+					speech_bubble,
+					top,
+				)
+				self.assertEqual(block_row.width, width)
+				if width:
+					self.assertEqual(
+						(block_row.left, block_row.right),
+						(left, right),
+					)
+
+	def test_num_rows(self):
+		for _ in range(300):
+			speech_bubble = self.make_speech_bubble()
+			word_layers = [
+				WordLayer("word", self.rng.randint(1, 20), 1)
+				for _ in range(self.rng.randint(1, 30))
+			]
+			min_num_rows = speech_bubble._get_min_num_rows(word_layers)
+			if min_num_rows is None:
+				continue
+			expected = None
+			for num_rows in range(min_num_rows, speech_bubble.max_num_rows):
+				block_rows = (
+					speech_bubble.odd_block_rows if num_rows % 2
+					else speech_bubble.even_block_rows
+				)
+				if len(block_rows) < num_rows:
+					# the linear scan failed with an IndexError here
+					continue
+				if speech_bubble._fit_words(word_layers, num_rows) is not None:
+					expected = num_rows
+					break
+			fit = speech_bubble._find_num_rows(
+				word_layers,
+				min_num_rows,
+				speech_bubble.max_num_rows,
+			)
+			other_parity_fit = speech_bubble._find_num_rows(
+				word_layers,
+				min_num_rows + 1,
+				fit[0] if fit else speech_bubble.max_num_rows,
+			)
+			fit = other_parity_fit or fit
+			self.assertEqual(fit[0] if fit else None, expected)
+
+
+class SelectionSpansTest(unittest.TestCase):
+	"""Test selection spans against reading and intersecting every pixel."""
+	def setUp(self):
+		self.rng = random.Random(5)
+
+	def test_from_mask(self):
+		for _ in range(50):
+			width = self.rng.randint(1, 40)
+			rows = make_random_rows(self.rng, width, 10, 4, 0.2)
+			selection = MaskSelection.from_rows(rows, x_offset=3, y_offset=7)
+			spans = SelectionSpans.from_mask(
+				selection.read_mask(3, 7, 3 + width, 17),
+				3,
+				7,
+				width,
+			)
+			for y, row in enumerate(rows):
+				self.assertEqual(
+					get_row_pixels(spans.get_row_spans(y + 7)),
+					set(x + 3 for x, value in enumerate(row) if value),
+				)
+
+	def test_intersect_spans(self):
+		for _ in range(200):
+			row_spans = [
+				SelectionSpans.from_mask(
+					bytes(bytearray(255 * value for value in row)),
+					0,
+					0,
+					30,
+				).get_row_spans(0)
+				for row in make_random_rows(self.rng, 30, 2, 4)
+			]
+			self.assertEqual(
+				get_row_pixels(intersect_spans(*row_spans)),
+				get_row_pixels(row_spans[0]) & get_row_pixels(row_spans[1]),
+			)
+
+	def test_sliding_window_intersection(self):
+		for _ in range(50):
+			rows = make_random_rows(self.rng, 40, 20, 3, 0.1)
+			spans = SelectionSpans.from_mask(
+				bytes(bytearray(255 * value for row in rows for value in row)),
+				0,
+				0,
+				40,
+			)
+			row_spans = [spans.get_row_spans(y) for y in range(len(rows))]
+			window_size = self.rng.randint(1, len(rows))
+			intersections = sliding_window_intersection(row_spans, window_size)
+			self.assertEqual(len(intersections), len(rows) - window_size + 1)
+			for i, intersection in enumerate(intersections):
+				expected = get_row_pixels(row_spans[i])
+				for other_spans in row_spans[i + 1:i + window_size]:
+					expected &= get_row_pixels(other_spans)
+				self.assertEqual(get_row_pixels(intersection), expected)
+
+	def test_from_polygons(self):
+		for _ in range(30):
+			polygons = [
+				[
+					(self.rng.uniform(0, 30), self.rng.uniform(0, 30))
+					for _ in range(self.rng.randint(3, 8))
+				]
+				for _ in range(self.rng.randint(1, 3))
+			]
+			scale = self.rng.choice([1.0, 1.5])
+			spans = SelectionSpans.from_polygons(polygons, scale)
+			scaled_polygons = [
+				[(scale * x, scale * y) for x, y in polygon]
+				for polygon in polygons
+			]
+			for y in range(-1, 47):
+				self.assertEqual(
+					get_row_pixels(spans.get_row_spans(y)),
+					set(
+						x for x in range(-1, 47)
+						if is_inside_polygons(scaled_polygons, x + 0.5, y + 0.5)
+					),
+				)
+
+
+class ScanModeTest(unittest.TestCase):
+	"""Test the analytic and pyramid scan modes against a full scan."""
+	def make_rounded_rect(self, width, height, radius):
+		rows = []
+		for y in range(height):
+			corner_y = max(radius - y - 0.5, y + 0.5 - (height - radius), 0)
+			inset = radius - math.sqrt(max(radius ** 2 - corner_y ** 2, 0))
+			rows.append([
+				int(inset <= x + 0.5 <= width - inset) for x in range(width)
+			])
+		return rows
+
+	def assert_scan_matches(self, rows):
+		selection = MaskSelection.from_rows(rows, x_offset=2, y_offset=2)
+		_, x_min, y_min, x_max, y_max = selection.get_bounds()
+		speech_bubbles = [
+			SpeechBubble(
+				selection, x_min, y_min, x_max, y_max, 10, 3, 2, 2, scan_mode
+			)
+			for scan_mode in (FULL_SCAN, ANALYTIC_SCAN, PYRAMID_SCAN)
+		]
+		full_speech_bubble = speech_bubbles[0]
+		for speech_bubble in speech_bubbles[1:]:
+			for y in range(full_speech_bubble.y_min, full_speech_bubble.y_max):
+				self.assertEqual(
+					speech_bubble.get_pixel_row_bounds(y),
+					full_speech_bubble.get_pixel_row_bounds(y),
+				)
+
+	def test_shapes(self):
+		for radius in (0, 20, 60):
+			self.assert_scan_matches(self.make_rounded_rect(300, 120, radius))
+
+	def test_dent(self):
+		rows = self.make_rounded_rect(300, 120, 60)
+		for row in rows[50:63]:
+			left = row.index(1)
+			row[left:left + 40] = [0] * 40
+		self.assert_scan_matches(rows)
+
+	def test_islands(self):
+		rows = self.make_rounded_rect(300, 120, 60)
+		for row in rows[20:24]:
+			row[5:10] = [1] * 5
+		self.assert_scan_matches(rows)
+		rng = random.Random(6)
+		for _ in range(100):
+			width = rng.randint(40, 160)
+			height = rng.randint(20, 120)
+			rows = make_random_bubble_rows(rng, width, height)
+			# outer bounds are kept around holes, so add those too
+			for _ in range(rng.randint(1, 3)):
+				value = rng.randint(0, 1)
+				x = rng.randrange(width)
+				y = rng.randrange(height)
+				island_width = min(rng.randint(1, 10), width - x)
+				for row in rows[y:y + rng.randint(1, 6)]:
+					row[x:x + island_width] = [value] * island_width
+			self.assert_scan_matches(rows)
+
+
+if __name__ == "__main__":
+	unittest.main()
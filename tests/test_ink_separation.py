@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+import os
+import random
+import sys
+import unittest
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+sys.path.insert(
+	0,
+	os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+)
+
+from ink_separation import (
+	parse_inks,
+	parse_thresholds,
+	separate_inks,
+	threshold_outlines,
+)
+
+
+# Tests of the numpy thresholding and ink separation of the Isolate Outlines
+# and Isolate Inks plugins against brute force versions on every pixel.
+
+
+# Utils
+def make_random_pixels(rng, num_channels, width=30, height=20):
+	"""Make random pixels, with many close to black or the test inks.
+
+	Args:
+		rng (random.Random): random number generator to use.
+		num_channels (int): number of channels of each pixel, 1 for gray, 2
+			for gray and alpha, 3 for rgb or 4 for rgba.
+		width (int): width of the pixels.
+		height (int): height of the pixels.
+
+	Returns:
+		numpy.ndarray: height x width x channels uint8 array of the pixels.
+	"""
+	bases = [(0, 0, 0), (26, 35, 126), (198, 40, 40), (255, 255, 255)]
+	pixels = []
+	for _ in range(height):
+		row = []
+		for _ in range(width):
+			base = rng.choice(bases)
+			if rng.random() < 0.5:
+				color = [rng.randint(0, 255) for _ in range(3)]
+			else:
+				color = [
+					min(max(value + rng.randint(-80, 80), 0), 255)
+					for value in base
+				]
+			pixel = color[:1] if num_channels in (1, 2) else color
+			if num_channels in (2, 4):
+				pixel.append(rng.choice([0, 128, 255, rng.randint(0, 255)]))
+			row.append(pixel)
+		pixels.append(row)
+	return numpy.array(pixels, dtype=numpy.uint8)
+
+
+def get_pixel_colors(pixel):
+	"""Get the color channels and alpha of a pixel.
+
+	Args:
+		pixel (list(int)): channels of the pixel.
+
+	Returns:
+		tuple(list(int), int): the color channels and the alpha, which is 255
+			if the pixel has no alpha channel.
+	"""
+	if len(pixel) in (2, 4):
+		return pixel[:-1], pixel[-1]
+	return pixel, 255
+
+
+def get_ink_distance(colors, ink_color):
+	"""Get the distance of a pixel's color to an ink, as selecting by color.
+
+	Args:
+		colors (list(int)): color channels of the pixel.
+		ink_color (tuple(int, int, int)): red, green and blue values of ink.
+
+	Returns:
+		int: the largest difference between the color channels.
+	"""
+	if len(colors) == 1:
+		red, green, blue = ink_color
+		ink_color = (
+			int(round(0.2126 * red + 0.7152 * green + 0.0722 * blue)),
+		)
+	return max(
+		abs(value - ink_value) for value, ink_value in zip(colors, ink_color)
+	)
+
+
+def composite_over_white(colors, alpha):
+	"""Get the colors of a pixel composited over white.
+
+	Args:
+		colors (list(int)): color channels of the pixel.
+		alpha (int): alpha of the pixel.
+
+	Returns:
+		list(float): the composited color channels.
+	"""
+	return [
+		value * alpha / 255.0 + 255 * (1 - alpha / 255.0) for value in colors
+	]
+
+
+# Tests
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class ThresholdOutlinesTest(unittest.TestCase):
+	"""Test thresholding outlines against checking every pixel."""
+	def setUp(self):
+		self.rng = random.Random(7)
+
+	def test_hard_edges(self):
+		for num_channels in (1, 2, 3, 4):
+			pixels = make_random_pixels(self.rng, num_channels)
+			thresholds = [0.7, 0.3, 0.0, 1.0]
+			all_outlines = threshold_outlines(pixels, thresholds)
+			self.assertEqual(len(all_outlines), len(thresholds))
+			for threshold, outlines in zip(thresholds, all_outlines):
+				for row, outline_row in zip(
+						pixels.tolist(),
+						outlines.tolist()):
+					for pixel, outline_pixel in zip(row, outline_row):
+						colors, alpha = get_pixel_colors(pixel)
+						is_outline = max(colors) <= threshold * 255
+						self.assertEqual(
+							outline_pixel,
+							colors + [alpha if is_outline else 0],
+						)
+
+	def test_soft_edges(self):
+		for num_channels in (1, 2, 3, 4):
+			pixels = make_random_pixels(self.rng, num_channels)
+			hard_outlines, = threshold_outlines(pixels, [0.7])
+			soft_outlines, = threshold_outlines(pixels, [0.7], True)
+			for row, hard_row, soft_row in zip(
+					pixels.tolist(),
+					hard_outlines.tolist(),
+					soft_outlines.tolist()):
+				for pixel, hard_pixel, soft_pixel in zip(
+						row,
+						hard_row,
+						soft_row):
+					if not hard_pixel[-1]:
+						self.assertEqual(soft_pixel[-1], 0)
+						continue
+					# over white, soft edges look the same as the pixel
+					soft_colors, soft_alpha = get_pixel_colors(soft_pixel)
+					for soft_value, value in zip(
+							composite_over_white(soft_colors, soft_alpha),
+							composite_over_white(*get_pixel_colors(pixel))):
+						self.assertAlmostEqual(soft_value, value, delta=1.5)
+
+	def test_soft_edge_example(self):
+		pixels = numpy.array([[[100, 100, 100]]], dtype=numpy.uint8)
+		outlines, = threshold_outlines(pixels, [0.7], True)
+		self.assertEqual(outlines.tolist(), [[[0, 0, 0, 155]]])
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class SeparateInksTest(unittest.TestCase):
+	"""Test separating inks against finding every pixel's nearest ink."""
+	def setUp(self):
+		self.rng = random.Random(8)
+		self.inks = parse_inks("#000000:0.7, #1a237e:0.3, #c62828:0.3")
+
+	def get_pixel_ink(self, colors):
+		distances = [
+			get_ink_distance(colors, ink_color) for ink_color, _ in self.inks
+		]
+		index = distances.index(min(distances))
+		if distances[index] <= self.inks[index][1] * 255:
+			return index
+		return None
+
+	def test_hard_edges(self):
+		for num_channels in (1, 2, 3, 4):
+			pixels = make_random_pixels(self.rng, num_channels)
+			all_inks = separate_inks(pixels, self.inks)
+			self.assertEqual(len(all_inks), len(self.inks))
+			ink_rows = zip(*[ink_pixels.tolist() for ink_pixels in all_inks])
+			for row, ink_row in zip(pixels.tolist(), ink_rows):
+				for pixel, ink_pixels in zip(row, zip(*ink_row)):
+					colors, alpha = get_pixel_colors(pixel)
+					index = self.get_pixel_ink(colors)
+					self.assertEqual(
+						list(ink_pixels),
+						[
+							colors + [alpha if i == index else 0]
+							for i in range(len(self.inks))
+						],
+					)
+
+	def test_soft_edges(self):
+		for num_channels in (1, 2, 3, 4):
+			pixels = make_random_pixels(self.rng, num_channels)
+			all_inks = separate_inks(pixels, self.inks, True)
+			ink_rows = zip(*[ink_pixels.tolist() for ink_pixels in all_inks])
+			for row, ink_row in zip(pixels.tolist(), ink_rows):
+				for pixel, ink_pixels in zip(row, zip(*ink_row)):
+					colors, alpha = get_pixel_colors(pixel)
+					index = self.get_pixel_ink(colors)
+					for i, ink_pixel in enumerate(ink_pixels):
+						if i != index:
+							self.assertEqual(ink_pixel[-1], 0)
+							continue
+						soft_colors, soft_alpha = get_pixel_colors(ink_pixel)
+						for soft_value, value in zip(
+								composite_over_white(soft_colors, soft_alpha),
+								composite_over_white(colors, alpha)):
+							self.assertAlmostEqual(
+								soft_value,
+								value,
+								delta=1.5,
+							)
+
+
+class ParseTest(unittest.TestCase):
+	"""Test parsing thresholds and inks."""
+	def test_parse_thresholds(self):
+		self.assertEqual(parse_thresholds("0.5, 0.6 0.7"), [0.5, 0.6, 0.7])
+		self.assertEqual(parse_thresholds(""), [])
+
+	def test_parse_inks(self):
+		self.assertEqual(
+			parse_inks("#000000:0.7, 1A237E:0.3"),
+			[((0, 0, 0), 0.7), ((26, 35, 126), 0.3)],
+		)
+		for text in ("", "#000000", "#00000:0.7", "#000000:dark", "#0000g0:1"):
+			self.assertRaises(ValueError, parse_inks, text)
+
+
+if __name__ == "__main__":
+	unittest.main()
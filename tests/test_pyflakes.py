@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import ast
+import os
+import unittest
+
+try:
+	from pyflakes import checker
+except ImportError:
+	checker = None
+
+
+# Check every module of the repo with pyflakes, eg. for calls to functions
+# that no longer exist. The plugins use "from gimpfu import *", which stops
+# pyflakes finding undefined names, so that import is dropped and the names
+# the plugins use from gimpfu are given as builtins instead.
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GIMPFU_NAMES = set([
+	"gimp",
+	"main",
+	"pdb",
+	"register",
+	"PF_BOOL",
+	"PF_COLOR",
+	"PF_COLOUR",
+	"PF_DRAWABLE",
+	"PF_FILE",
+	"PF_FLOAT",
+	"PF_FONT",
+	"PF_IMAGE",
+	"PF_INT",
+	"PF_LAYER",
+	"PF_OPTION",
+	"PF_SLIDER",
+	"PF_SPINNER",
+	"PF_STRING",
+	"PF_TEXT",
+	"PF_TOGGLE",
+	"PF_VECTORS",
+])
+
+
+# Utils
+def get_python_files():
+	"""Get the python files of the repo.
+
+	Returns:
+		list(str): paths of the python files, sorted.
+	"""
+	python_files = []
+	for directory, _, file_names in os.walk(REPO_DIR):
+		python_files.extend(
+			os.path.join(directory, file_name)
+			for file_name in file_names if file_name.endswith(".py")
+		)
+	return sorted(python_files)
+
+
+def check_file(file_path):
+	"""Check a python file with pyflakes.
+
+	Args:
+		file_path (str): path of the file.
+
+	Returns:
+		list(str): the problems pyflakes found.
+	"""
+	with open(file_path, "r") as file_:
+		tree = ast.parse(file_.read(), file_path)
+	tree.body = [
+		node for node in tree.body
+		if not (isinstance(node, ast.ImportFrom) and node.module == "gimpfu")
+	]
+	return [
+		str(message) for message in
+		checker.Checker(tree, filename=file_path, builtins=GIMPFU_NAMES).messages
+	]
+
+
+# Tests
+@unittest.skipIf(checker is None, "pyflakes isn't installed")
+class PyflakesTest(unittest.TestCase):
+	"""Test that pyflakes finds no problems in the repo."""
+	def test_pyflakes(self):
+		messages = []
+		for file_path in get_python_files():
+			messages.extend(check_file(file_path))
+		self.assertEqual(messages, [])
+
+
+if __name__ == "__main__":
+	unittest.main()